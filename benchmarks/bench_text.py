@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for text.py: glyph layout on its own, and end-to-end commit creation through
+every commit backend. Everything runs in temporary local repositories, with no network access.
+
+Usage:
+    python benchmarks/bench_text.py [--quick] [--backends commit,fast-import,...] [--output results.json]
+
+Each end-to-end case runs in a fresh child process, so peak RSS and process-spawn counts are
+per case. Results are printed (or written) as JSON so runs can be compared between releases.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import text
+
+BENCH_YEAR = 2023
+TEXTS = {
+    'short': "HI",
+    'medium': "HELLO",
+    'long': "HELLO WORLD 2023",
+}
+COMMITS_PER_DOT = (1, 10, 50)
+SPACINGS = (0, 1, 3)
+LAYOUT_REPEAT = 200
+# Fixed identity so the native backends work without any Git config
+BENCH_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Bench', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'Bench', 'GIT_COMMITTER_EMAIL': 'bench@example.com',
+}
+
+# --- Measurement Helpers ---
+
+class SpawnCounter:
+    """Counts every process started through subprocess.Popen (which subprocess.run also uses)."""
+
+    def __init__(self):
+        self.count = 0
+        self.original_popen = subprocess.Popen
+
+    def __enter__(self):
+        counter = self
+
+        class CountingPopen(self.original_popen):
+            def __init__(self, *args, **kwargs):
+                counter.count += 1
+                super().__init__(*args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *exc_info):
+        subprocess.Popen = self.original_popen
+
+def peak_rss_kb():
+    """Peak resident set size of this process and of its largest finished child, in KiB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin': # ru_maxrss is in bytes on macOS
+        own //= 1024
+        children //= 1024
+    return {'self': own, 'children': children}
+
+# --- Benchmarks ---
+
+def bench_layout(text_value, spacing):
+    """Times rasterize_text plus planning (no git) for one text and spacing."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        for _ in range(LAYOUT_REPEAT):
+            plan, _ = text.plan_text(text_value, BENCH_YEAR, 1, 1, spacing)
+            dots = sum(1 for _ in plan)
+        elapsed = time.perf_counter() - start_time
+    return {
+        'kind': 'layout', 'text': text_value, 'spacing': spacing, 'dots': dots,
+        'wall_seconds': elapsed / LAYOUT_REPEAT, 'layouts_per_second': LAYOUT_REPEAT / elapsed,
+    }
+
+def make_repo(path, bare):
+    """Creates an empty repository for one run. Batched backends get a bare repository."""
+    command = ['git', 'init', '-q'] + (['--bare'] if bare else []) + [path]
+    subprocess.run(command, check=True)
+
+def run_case(case):
+    """Paints one case into a fresh temporary repository and measures it (runs in a child process)."""
+    os.environ.update(BENCH_IDENTITY)
+    with tempfile.TemporaryDirectory(prefix="bench-text-") as temp_dir:
+        repo_path = os.path.join(temp_dir, "repo")
+        make_repo(repo_path, bare=(case['backend'] != 'commit'))
+
+        with SpawnCounter() as spawns, contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            commits = text.paint_text(repo_path, case['text'], BENCH_YEAR, 1, case['commits_per_dot'], case['spacing'], backend=case['backend'])
+            elapsed = time.perf_counter() - start_time
+
+    result = dict(case)
+    result.update({
+        'kind': 'commit', 'commits': commits, 'wall_seconds': elapsed,
+        'commits_per_second': commits / elapsed if elapsed else 0.0,
+        'process_spawns': spawns.count, 'peak_rss_kb': peak_rss_kb(),
+    })
+    return result
+
+def run_case_in_child(case):
+    """Runs a case in a fresh interpreter so RSS and spawn counts are not shared between cases."""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        return dict(case, kind='commit', error=completed.stderr.strip().splitlines()[-1:])
+    return json.loads(completed.stdout)
+
+def get_git_version():
+    completed = subprocess.run(['git', '--version'], capture_output=True, text=True)
+    return completed.stdout.strip()
+
+def build_cases(backends, quick):
+    """End-to-end sweep. The per-commit backend is limited to the smaller counts unless asked for."""
+    text_keys = ('short', 'medium') if quick else tuple(TEXTS)
+    dots_values = (1, 10) if quick else COMMITS_PER_DOT
+    spacings = (1,) if quick else SPACINGS
+    cases = []
+    for backend in backends:
+        for text_key in text_keys:
+            for commits_per_dot in dots_values:
+                if backend == 'commit' and commits_per_dot > 10 and text_key != 'short':
+                    continue # Minutes per case; covered by the 'short' text
+                for spacing in spacings:
+                    cases.append({'backend': backend, 'text': TEXTS[text_key], 'commits_per_dot': commits_per_dot, 'spacing': spacing})
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text.py layout and commit backends.")
+    parser.add_argument('--backends', default=','.join(text.BACKENDS), help="Comma separated backends to run")
+    parser.add_argument('--quick', action='store_true', help="Run a reduced sweep")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    backends = [backend.strip() for backend in args.backends.split(',') if backend.strip()]
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'git': get_git_version(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'layout': [],
+        'commit': [],
+    }
+    for text_value in TEXTS.values():
+        for spacing in SPACINGS:
+            results['layout'].append(bench_layout(text_value, spacing))
+
+    for case in build_cases(backends, args.quick):
+        print(f"Running {case['backend']:<12} text={case['text']!r} dots={case['commits_per_dot']} spacing={case['spacing']}", file=sys.stderr, flush=True)
+        results['commit'].append(run_case_in_child(case))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
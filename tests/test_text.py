@@ -0,0 +1,334 @@
+"""
+Tests for text.py: planning and shading, the packfile delta encoder, compacted histories,
+backend equivalence, resuming, publish failures and batch mode.
+Everything runs in temporary local repositories. Run with 'python -m pytest tests' (or unittest).
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import text
+
+TEST_YEAR = 2020
+# Fixed identity so every backend writes the same commits without any Git config
+TEST_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+}
+HAS_GIT = shutil.which('git') is not None
+
+
+def git(repo_path, *args):
+    """Runs a git command in 'repo_path' and returns its stripped stdout (raises on failure)."""
+    result = subprocess.run(['git', *args], cwd=repo_path, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+class RepoTestCase(unittest.TestCase):
+    """Gives each test a temporary directory and the fixed identity."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="contribution-art-test-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        env = mock.patch.dict(os.environ, TEST_IDENTITY)
+        env.start()
+        self.addCleanup(env.stop)
+
+    def paint(self, name, **options):
+        """Paints into a new repository under the temporary directory; returns its path."""
+        repo_path = os.path.join(self.tmp_dir, name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = text.paint(repo_path, text=options.pop('text', "HI"), year=TEST_YEAR, **options)
+        self.assertTrue(result.ok, result.error)
+        return repo_path
+
+    def run_script(self, *args):
+        """Runs text.py as a separate process."""
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "text.py")
+        return subprocess.run([sys.executable, script, *args], capture_output=True, text=True)
+
+
+class DeltaTests(unittest.TestCase):
+
+    def assert_round_trip(self, base, target):
+        delta = text.make_delta(base, target)
+        self.assertEqual(text.apply_delta(base, delta), target)
+        return delta
+
+    def test_similar_commits(self):
+        base = b"tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\nparent 1111\nauthor A <a@x> 1577836800 +0000\n\nArt commit char=H pos=0\n"
+        target = base.replace(b"1111", b"2222").replace(b"1577836800", b"1577840400").replace(b"pos=0", b"pos=1")
+        delta = self.assert_round_trip(base, target)
+        self.assertLess(len(delta), len(target))
+
+    def test_random_lines(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            base = b"\n".join(bytes(rng.choices(b"abc\n", k=rng.randrange(0, 40))) for _ in range(rng.randrange(0, 6)))
+            target = b"\n".join(bytes(rng.choices(b"abc\n", k=rng.randrange(0, 40))) for _ in range(rng.randrange(0, 6)))
+            self.assert_round_trip(base, target)
+
+    def test_copies_over_64_kib(self):
+        # A copy can cover at most 64 KiB, so long shared runs are split into several copies
+        line = bytes(random.Random(2).choices(b"0123456789abcdef", k=200_000))
+        base = line + b"\n" + line + b"\n"
+        target = line[:150_000] + b"X" + line[150_001:] + b"\n" + line + b"\n"
+        delta = self.assert_round_trip(base, target)
+        self.assertLess(len(delta), 100)
+        self.assert_round_trip(base, base)
+        self.assert_round_trip(b"", base)
+
+
+class ShadingTests(unittest.TestCase):
+    WEEK = [date(2020, 1, 6) + timedelta(days=offset) for offset in range(7)]
+
+    def test_shade_counts(self):
+        d = self.WEEK
+        cases = [
+            # (target levels, baseline, expected additions, expected peak)
+            ("empty baseline", {d[0]: 4, d[1]: 1, d[2]: 2}, {}, {d[0]: 4, d[1]: 1, d[2]: 2}, 4),
+            ("painted day sets the peak", {d[0]: 4, d[1]: 1}, {d[0]: 10}, {d[1]: 1}, 10),
+            # Shading the busy background day level 4 would be cheaper, but it would show up in the art
+            ("background stays level 1", {d[0]: 4, d[1]: 1}, {d[5]: 20}, {d[0]: 80, d[1]: 1}, 80),
+            ("painted day too dark for its level", {d[0]: 4, d[1]: 2}, {d[1]: 9}, {d[0]: 18}, 18),
+            ("nothing to paint", {}, {d[5]: 3}, {}, 3),
+        ]
+        for name, target_levels, baseline, additions, peak in cases:
+            with self.subTest(name):
+                self.assertEqual(text.shade_counts(target_levels, baseline, d), (additions, peak))
+                final = {day: baseline.get(day, 0) + additions.get(day, 0) for day in d}
+                self.assertEqual(max(final.values()), peak)
+                for day, level in target_levels.items():
+                    self.assertEqual(text.count_to_level(final[day], peak), level)
+
+    def test_count_to_level_buckets(self):
+        # ceil(4c / M): with a peak of 8, 1-2 commits are level 1, 3-4 level 2, 5-6 level 3, 7-8 level 4
+        self.assertEqual([text.count_to_level(count, 8) for count in range(10)], [0, 1, 1, 2, 2, 3, 3, 4, 4, 4])
+        for level in range(1, text.MAX_LEVEL + 1):
+            lowest, highest = text.level_range(level, 8)
+            self.assertEqual({text.count_to_level(count, 8) for count in range(lowest, highest + 1)}, {level})
+
+
+class PlanningTests(unittest.TestCase):
+
+    def test_diff_plan(self):
+        d = ShadingTests.WEEK
+        plan = [(d[0], 3, "a"), (d[1], 2, "b"), (d[2], 4, "c")]
+        self.assertEqual(list(text.diff_plan(iter(plan), {d[0]: 1, d[1]: 5})), [(d[0], 2, "a"), (d[2], 4, "c")])
+        self.assertEqual(list(text.diff_plan(iter(plan), {})), plan)
+
+    def test_split_plan(self):
+        calendar = text.get_calendar(TEST_YEAR)
+        # Five entries over four week columns: 10, 10, 10 and 10 commits
+        plan = [(calendar.start + timedelta(days=offset), count, name)
+                for offset, count, name in ((1, 5, "a"), (2, 5, "b"), (8, 10, "c"), (15, 10, "d"), (22, 10, "e"))]
+        cases = [(1, ["abcde"]), (2, ["abc", "de"]), (3, ["abc", "d", "e"]), (10, ["ab", "c", "d", "e"])]
+        for shards, expected in cases:
+            with self.subTest(shards=shards):
+                parts = text.split_plan(plan, shards, calendar)
+                self.assertEqual(["".join(entry[2] for entry in part) for part in parts], expected)
+        self.assertEqual(text.split_plan([], 3, calendar), [])
+
+    def test_fit_text(self):
+        layout = text.TextLayout("HI", text.BUILTIN_FONT) # 6 columns, 7 with a spacing of 1
+        wide = text.TextLayout("HELLO WORLD AGAIN", text.BUILTIN_FONT) # Wider than the graph at any spacing
+        cases = [
+            # (layout, start column, spacing, align, expected (start column, spacing))
+            (layout, 48, 1, 'left', (48, 1)),
+            (layout, 46, 1, 'fit', (46, 1)),
+            (layout, 47, 1, 'fit', (47, 0)),
+            (layout, 50, 3, 'fit', (47, 0)),
+            (layout, 1, 1, 'center', (23, 1)),
+            (layout, 50, 3, 'center', (22, 3)),
+            (wide, 5, 1, 'fit', (0, 0)),
+            (wide, 5, 1, 'center', (0, 0)),
+        ]
+        for layout_case, column, spacing, align, expected in cases:
+            with self.subTest(align=align, column=column, spacing=spacing):
+                self.assertEqual(text.fit_text(layout_case, column, spacing, align), expected)
+
+    def test_layout_text_reports_clipping(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(text.layout_text("HI", 1, 1), (1, 1))
+        self.assertEqual(output.getvalue(), "")
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(text.layout_text("HELLO WORLD AGAIN", 1, 1), (1, 1))
+        self.assertIn("of 17 characters fit", output.getvalue())
+        self.assertIn("--align fit", output.getvalue())
+
+
+class ConfigTests(unittest.TestCase):
+
+    def test_marquee_rejects_options_that_hold_the_whole_plan(self):
+        base = {'repo_path': "repo", 'text': "HI", 'marquee': True}
+        for options in ({'shards': 2}, {'seed': 1, 'cache': True}, {'shading': True}):
+            with self.subTest(**options):
+                with self.assertRaises(ValueError):
+                    text.validate_config({**base, **options})
+        self.assertTrue(text.validate_config(base)['marquee'])
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class CompactTests(RepoTestCase):
+
+    def test_compacted_history_is_valid(self):
+        repo_path = self.paint("compact", seed=1, compact=True, dots=3)
+        self.assertEqual(git(repo_path, 'fsck', '--full', '--strict', '--no-dangling'), "")
+        pack_dir = os.path.join(repo_path, ".git", "objects", "pack")
+        packs = [name for name in os.listdir(pack_dir) if name.endswith(".pack")]
+        self.assertTrue(packs)
+        deltas = 0
+        for name in packs:
+            listing = git(repo_path, 'verify-pack', '-v', os.path.join(pack_dir, name))
+            deltas += sum(len(line.split()) == 7 for line in listing.splitlines()) # Deltas also list their base
+        self.assertGreater(deltas, 0)
+        self.assertGreater(int(git(repo_path, 'rev-list', '--count', 'HEAD')), 20)
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class BackendTests(RepoTestCase):
+
+    def test_native_pack_matches_commit(self):
+        tips = {backend: git(self.paint(backend, backend=backend, seed=5), 'rev-parse', 'HEAD') for backend in ('commit', 'native-pack')}
+        self.assertEqual(tips['commit'], tips['native-pack'])
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class CheckpointTests(RepoTestCase):
+
+    def paint_interrupted(self, name, dots_before_interrupt, **options):
+        """Paints with the 'commit' backend and presses Ctrl-C once the given number of dots is written."""
+        write_dot = text.CommitCommandWriter.write_dot
+        written = []
+
+        def interrupting_write_dot(writer, *args, **kwargs):
+            if len(written) == dots_before_interrupt:
+                raise KeyboardInterrupt
+            written.append(args)
+            return write_dot(writer, *args, **kwargs)
+
+        with mock.patch.object(text.CommitCommandWriter, 'write_dot', interrupting_write_dot):
+            with self.assertRaises(KeyboardInterrupt):
+                self.paint(name, **options)
+        return os.path.join(self.tmp_dir, name)
+
+    def paint_again(self, repo_path, **options):
+        """Paints into an existing repository; returns the captured output."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = text.paint(repo_path, text=options.pop('text', "HI"), year=TEST_YEAR, **options)
+        self.assertTrue(result.ok, result.error)
+        return output.getvalue()
+
+    def test_interrupted_commit_run_resumes(self):
+        expected_tip = git(self.paint("reference", seed=3, dots=2), 'rev-parse', 'HEAD')
+        repo_path = self.paint_interrupted("resumed", 5, seed=3, dots=2)
+        self.assertEqual(git(repo_path, 'rev-list', '--count', 'HEAD'), "1") # Only the initial commit
+        self.assertEqual(len(git(repo_path, 'for-each-ref', text.SCRATCH_REF_PREFIX).splitlines()), 1)
+
+        output = self.paint_again(repo_path, seed=3, dots=2)
+        self.assertIn("Resuming an interrupted run: 5 dots (10 commits)", output)
+        self.assertEqual(git(repo_path, 'rev-parse', 'HEAD'), expected_tip)
+        self.assertEqual(git(repo_path, 'for-each-ref', text.SCRATCH_REF_PREFIX), "")
+        self.assertFalse(os.path.exists(os.path.join(repo_path, ".git", text.PaintCheckpoint.FILE_NAME)))
+
+    def test_different_plan_drops_the_checkpoint(self):
+        expected_tip = git(self.paint("reference", text="OK", seed=3), 'rev-parse', 'HEAD')
+        repo_path = self.paint_interrupted("changed", 5, seed=3)
+        output = self.paint_again(repo_path, text="OK", seed=3)
+        self.assertNotIn("Resuming", output)
+        self.assertEqual(git(repo_path, 'rev-parse', 'HEAD'), expected_tip)
+        self.assertEqual(git(repo_path, 'for-each-ref', text.SCRATCH_REF_PREFIX), "")
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class PublishFailureTests(RepoTestCase):
+
+    def test_locked_branch_fails_the_run(self):
+        repo_path = self.paint("locked")
+        tip = git(repo_path, 'rev-parse', 'HEAD')
+        branch_ref = git(repo_path, 'symbolic-ref', 'HEAD')
+        # A lock git never releases: every compare-and-swap attempt on the branch fails
+        open(os.path.join(repo_path, ".git", *branch_ref.split('/')) + ".lock", "w").close()
+        for backend in ('commit', 'fast-import', 'native'):
+            with self.subTest(backend=backend):
+                result = self.run_script('--repo', repo_path, '--text', "OK", '--year', str(TEST_YEAR), '--backend', backend)
+                self.assertEqual(result.returncode, 1, result.stdout)
+                self.assertIn("were not written", result.stdout)
+                self.assertEqual(git(repo_path, 'rev-parse', 'HEAD'), tip)
+        result = self.run_script('--repo', repo_path, '--text', "OK", '--year', str(TEST_YEAR), '--shards', "2")
+        self.assertEqual(result.returncode, 1, result.stdout)
+        self.assertEqual(git(repo_path, 'rev-parse', 'HEAD'), tip)
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class BatchMetricsTests(RepoTestCase):
+
+    def test_worker_metrics_reach_the_parent(self):
+        manifest_path = os.path.join(self.tmp_dir, "jobs.json")
+        jobs = [{'repo_path': os.path.join(self.tmp_dir, f"repo{index % 3}"), 'text': "HI", 'year': TEST_YEAR + index // 3}
+                for index in range(6)]
+        with open(manifest_path, "w") as f:
+            json.dump(jobs, f)
+        metrics_path = os.path.join(self.tmp_dir, "metrics.jsonl")
+        result = self.run_script('--batch', manifest_path, '--workers', "3", '--summary', '--metrics-json', metrics_path)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        table = result.stdout.split("--- Run Metrics ---")[1]
+        self.assertIn("phase commit", table)
+        self.assertRegex(table, r"commits_written +120\n")
+        with open(metrics_path) as f:
+            events = [json.loads(line)['event'] for line in f]
+        self.assertEqual(events.count('phase_start'), events.count('phase_end'))
+        self.assertEqual(events.count('phase_end'), 6 * 3) # init, layout and commit per job
+        self.assertEqual(events[-1], 'summary')
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class AsyncBatchTests(RepoTestCase):
+
+    def run_batch(self, jobs):
+        manifest_path = os.path.join(self.tmp_dir, "jobs.json")
+        with open(manifest_path, "w") as f:
+            json.dump(jobs, f)
+        return self.run_script('--batch', manifest_path, '--async')
+
+    def test_incremental_rerun_succeeds(self):
+        job = {'repo_path': os.path.join(self.tmp_dir, "repo"), 'text': "HI", 'year': TEST_YEAR, 'incremental': True}
+        for _ in range(2):
+            result = self.run_batch([job])
+            self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn(" 0 commits", result.stdout)
+
+    def test_other_backends_are_rejected(self):
+        result = self.run_batch([{'repo_path': os.path.join(self.tmp_dir, "repo"), 'text': "HI", 'year': TEST_YEAR, 'backend': "native"}])
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("native backend is not available in async batch mode", result.stdout)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "repo")))
+
+
+class AsyncGitRunnerTests(unittest.TestCase):
+
+    def test_timeout_covers_a_stalled_input_stream(self):
+        import asyncio
+
+        runner = text.AsyncGitRunner(timeout=1)
+        chunks = (b"x" * 65536 for _ in range(1000)) # Far more than a pipe holds
+        command = [sys.executable, '-c', "import time; time.sleep(60)"]
+        returncode, _, stderr = asyncio.run(runner.execute(command, None, input_chunks=chunks))
+        self.assertIsNone(returncode)
+        self.assertIn("Timed out", stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
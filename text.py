@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import os
-import subprocess
+import sys
+import collections
+import contextlib
 import datetime
+import functools
+import struct
+import zlib
 from datetime import date, timedelta
-import random
 import time # Added for potential delays if needed
 
 # --- Character Map (5 Rows High, Variable Width) ---
@@ -90,308 +94,4106 @@ for char_code in range(ord('a'), ord('z') + 1):
 
 CHAR_HEIGHT = 5 # Explicitly define height (corresponds to Monday-Friday)
 
+# --- Compiled Glyphs ---
+# CHAR_MAP is compiled once at import into per-column bitmasks: bit r of a column mask
+# is set when graph row r (0=Sunday ... 6=Saturday) has a dot. Layout then works on whole
+# columns instead of individual 'X' characters.
+GRAPH_ROWS = 7  # Days per week column (Sunday-Saturday)
+GRAPH_COLS = 53 # GitHub graph has 53 columns (weeks)
+MAX_LEVEL = 4   # GitHub shades cells in levels 0 (empty) to 4 (darkest)
+
+class Glyph:
+    """A compiled character: its width in columns and one row bitmask per column."""
+    __slots__ = ('width', 'columns')
+
+    def __init__(self, width, columns):
+        self.width = width
+        self.columns = columns
+
+def compile_glyph(pattern, row_offset=1):
+    """
+    Compiles a CHAR_MAP pattern into a Glyph.
+    'row_offset' is the graph row of the pattern's first row (1 = Monday).
+    """
+    width = len(pattern[0]) if pattern else 0
+    columns = [0] * width
+    for pattern_row_index, pattern_row_str in enumerate(pattern[:CHAR_HEIGHT]):
+        for pattern_col_offset, cell in enumerate(pattern_row_str[:width]):
+            if cell == 'X':
+                columns[pattern_col_offset] |= 1 << (row_offset + pattern_row_index)
+    return Glyph(width, tuple(columns))
+
+GLYPHS = {char: compile_glyph(pattern) for char, pattern in CHAR_MAP.items()}
+
+# COLUMN_CELLS[level][mask] is the 7 cell values of a column painted with 'mask' at 'level',
+# so a whole column is written with a single slice assignment.
+COLUMN_CELLS = [
+    [bytes(level if mask >> row & 1 else 0 for row in range(GRAPH_ROWS)) for mask in range(1 << GRAPH_ROWS)]
+    for level in range(MAX_LEVEL + 1)
+]
+EMPTY_COLUMN = bytes(GRAPH_ROWS)
+
+
+class ContributionGrid:
+    """
+    A 7 x width grid of intensity levels (0-4), stored column-major in a bytearray
+    (cell index = column * 7 + row). 'sources' records what painted each column
+    (e.g. "char='A' pos=0"), for commit messages.
+    """
+    __slots__ = ('width', 'cells', 'sources')
+
+    def __init__(self, width=GRAPH_COLS):
+        self.width = width
+        self.cells = bytearray(width * GRAPH_ROWS)
+        self.sources = [None] * width
+
+    def paint_column(self, col, mask, level=MAX_LEVEL, source=None):
+        """Writes a whole column from a row bitmask."""
+        start = col * GRAPH_ROWS
+        self.cells[start:start + GRAPH_ROWS] = COLUMN_CELLS[level][mask]
+        if source is not None:
+            self.sources[col] = source
+
+    def paint_levels(self, col, levels, source=None):
+        """Writes a whole column from 7 per-row levels (bytes)."""
+        start = col * GRAPH_ROWS
+        self.cells[start:start + GRAPH_ROWS] = levels
+        if source is not None:
+            self.sources[col] = source
+
+    def level(self, col, row):
+        return self.cells[col * GRAPH_ROWS + row]
+
+    def dot_count(self):
+        """Number of non-empty cells."""
+        return len(self.cells) - self.cells.count(0)
+
+    def dots(self):
+        """Yields (col, row, level) for every non-empty cell, in date order. Empty columns are skipped whole."""
+        cells = self.cells
+        for col in range(self.width):
+            start = col * GRAPH_ROWS
+            column = cells[start:start + GRAPH_ROWS]
+            if column == EMPTY_COLUMN:
+                continue
+            for row, level in enumerate(column):
+                if level:
+                    yield col, row, level
+
+
+# --- Bitmap Fonts ---
+# Besides the built-in CHAR_MAP, text can be drawn with BDF or PSF (v1/v2) bitmap fonts of up to
+# 7 rows. Font files are memory-mapped and only the glyphs that are actually used get parsed:
+# a BDF font is indexed incrementally while looking for a codepoint, and a PSF font addresses its
+# fixed-size glyphs directly. Compiled glyphs are kept in an LRU cache keyed by (font, codepoint).
+
+GLYPH_CACHE_SIZE = 4096
+PSF1_MAGIC = b'\x36\x04'
+PSF2_MAGIC = b'\x72\xb5\x4a\x86'
+
+class BuiltinFont:
+    """The CHAR_MAP glyphs (5 rows, drawn Monday-Friday)."""
+    name = 'built-in'
+
+    def load_glyph(self, codepoint):
+        return GLYPHS.get(chr(codepoint))
+
+BUILTIN_FONT = BuiltinFont()
+
+def compile_bitmap_rows(rows, bits, row_offset, blank_width):
+    """
+    Compiles bitmap rows (ints whose highest of 'bits' bits is the leftmost pixel) into a Glyph
+    drawn from graph row 'row_offset' down. The glyph is as wide as its ink; blank glyphs
+    (spaces) are 'blank_width' columns wide.
+    """
+    columns = [0] * bits
+    for row_index, row in enumerate(rows):
+        for x in range(bits):
+            if row >> (bits - 1 - x) & 1:
+                columns[x] |= 1 << (row_offset + row_index)
+    width = max((x + 1 for x, mask in enumerate(columns) if mask), default=0)
+    if not width:
+        return Glyph(blank_width, (0,) * blank_width)
+    return Glyph(width, tuple(columns[:width]))
+
+def map_font_file(font_path):
+    """Memory-maps a font file (gzip-compressed fonts are decompressed into memory instead)."""
+    import mmap
+
+    if font_path.endswith('.gz'):
+        import gzip
+
+        with gzip.open(font_path, 'rb') as f:
+            return f.read()
+    with open(font_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Font file '{font_path}' is empty.")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def check_font_height(font_path, height):
+    if not 1 <= height <= GRAPH_ROWS:
+        raise ValueError(f"Font '{font_path}' is {height} rows high; the contribution graph has {GRAPH_ROWS} rows.")
+    return (GRAPH_ROWS - height) // 2 # Center the font vertically
+
+class BdfFont:
+    """
+    A BDF font. Only the header is parsed when the font is opened; glyph positions are indexed
+    on demand by scanning forward for ENCODING lines, and a glyph's bitmap is parsed when it is used.
+    """
+
+    def __init__(self, font_path, data):
+        self.name = os.path.basename(font_path)
+        self.data = data
+        header_end = data.find(b'\nSTARTCHAR')
+        header = bytes(data[:header_end if header_end >= 0 else len(data)]).decode('latin-1')
+        bounding_box = None
+        for line in header.splitlines():
+            if line.startswith('FONTBOUNDINGBOX'):
+                bounding_box = [int(value) for value in line.split()[1:5]]
+        if bounding_box is None:
+            raise ValueError(f"Font '{font_path}' has no FONTBOUNDINGBOX.")
+        self.cell_width, self.height, _, self.descent = bounding_box
+        self.row_offset = check_font_height(font_path, self.height)
+        self.offsets = {} # codepoint -> offset of its ENCODING line
+        self.scan_pos = max(header_end, 0)
+
+    def find_glyph(self, codepoint):
+        """Offset of the glyph's ENCODING line, indexing further into the file as needed (None if missing)."""
+        data = self.data
+        while codepoint not in self.offsets and self.scan_pos >= 0:
+            pos = data.find(b'\nENCODING ', self.scan_pos)
+            if pos < 0:
+                self.scan_pos = -1
+                break
+            line_end = data.find(b'\n', pos + 1)
+            if line_end < 0:
+                line_end = len(data)
+            encoding = int(data[pos + 10:line_end].split()[0])
+            if encoding >= 0:
+                self.offsets.setdefault(encoding, pos + 1)
+            self.scan_pos = line_end
+        return self.offsets.get(codepoint)
+
+    def load_glyph(self, codepoint):
+        offset = self.find_glyph(codepoint)
+        if offset is None:
+            return None
+        end = self.data.find(b'ENDCHAR', offset)
+        lines = bytes(self.data[offset:end if end >= 0 else len(self.data)]).decode('latin-1').splitlines()
+        advance = self.cell_width
+        box = (0, 0, 0, 0)
+        bitmap = []
+        for line_index, line in enumerate(lines):
+            if line.startswith('DWIDTH'):
+                advance = int(line.split()[1])
+            elif line.startswith('BBX'):
+                box = tuple(int(value) for value in line.split()[1:5])
+            elif line.startswith('BITMAP'):
+                bitmap = [row.strip() for row in lines[line_index + 1:] if row.strip()]
+                break
+
+        # Place the glyph's box in the font's cell: cell row 0 is the top of FONTBOUNDINGBOX
+        box_width, box_height, box_x, box_y = box
+        cell_top = self.descent + self.height - 1
+        bits = max(box_x + box_width, 0)
+        rows = [0] * self.height
+        for bitmap_row_index, hex_row in enumerate(bitmap[:box_height]):
+            cell_row = cell_top - (box_y + box_height - 1 - bitmap_row_index)
+            if not 0 <= cell_row < self.height:
+                continue
+            # Pixel j sits in cell column box_x + j; columns left of the origin are dropped
+            padding = len(hex_row) * 4 - box_width
+            pixels = int(hex_row, 16) >> padding if padding >= 0 else int(hex_row, 16) << -padding
+            rows[cell_row] = pixels & ((1 << bits) - 1)
+        return compile_bitmap_rows(rows, bits, self.row_offset, advance)
+
+class PsfFont:
+    """
+    A PC Screen Font (PSF1 or PSF2). Glyphs have a fixed size, so each one is read directly
+    from its offset; the Unicode table (if any) is parsed the first time a glyph is looked up.
+    """
+
+    def __init__(self, font_path, data):
+        self.name = os.path.basename(font_path)
+        self.data = data
+        if data[:2] == PSF1_MAGIC:
+            mode, self.glyph_bytes = data[2], data[3]
+            self.height, self.cell_width, self.header_size = self.glyph_bytes, 8, 4
+            self.length = 512 if mode & 0x01 else 256
+            self.table_format = 'psf1' if mode & 0x06 else None
+        else:
+            (_, _, self.header_size, flags, self.length, self.glyph_bytes,
+             self.height, self.cell_width) = struct.unpack('<4s7I', data[:32])
+            self.table_format = 'psf2' if flags & 0x01 else None
+        self.row_bytes = (self.cell_width + 7) // 8
+        self.row_offset = check_font_height(font_path, self.height)
+        self.unicode_map = None
+        if len(data) < self.header_size + self.length * self.glyph_bytes:
+            raise ValueError(f"Font '{font_path}' is truncated.")
+
+    def read_unicode_table(self):
+        """Maps codepoints to glyph indexes. Multi-codepoint sequences are ignored."""
+        table = bytes(self.data[self.header_size + self.length * self.glyph_bytes:])
+        unicode_map = {}
+        if self.table_format == 'psf2':
+            for index, entry in enumerate(table.split(b'\xff')[:self.length]):
+                for char in entry.split(b'\xfe', 1)[0].decode('utf-8', 'ignore'):
+                    unicode_map.setdefault(ord(char), index)
+        else:
+            values = struct.unpack(f'<{len(table) // 2}H', table[:len(table) // 2 * 2])
+            index = 0
+            in_sequence = False
+            for value in values:
+                if value == 0xFFFF:
+                    index += 1
+                    in_sequence = False
+                elif value == 0xFFFE:
+                    in_sequence = True
+                elif not in_sequence:
+                    unicode_map.setdefault(value, index)
+        return unicode_map
+
+    def load_glyph(self, codepoint):
+        if self.table_format:
+            if self.unicode_map is None:
+                self.unicode_map = self.read_unicode_table()
+            index = self.unicode_map.get(codepoint)
+        else:
+            index = codepoint if codepoint < self.length else None
+        if index is None:
+            return None
+        start = self.header_size + index * self.glyph_bytes
+        rows = [
+            int.from_bytes(self.data[start + row * self.row_bytes:start + (row + 1) * self.row_bytes], 'big')
+            >> (self.row_bytes * 8 - self.cell_width)
+            for row in range(self.height)
+        ]
+        return compile_bitmap_rows(rows, self.cell_width, self.row_offset, self.cell_width)
+
+@functools.lru_cache(maxsize=8)
+def load_font(font_path):
+    """
+    Opens a BDF or PSF font (optionally gzip-compressed). Cached, so every use of a path shares
+    one font object and its glyph cache entries. Raises ValueError for unsupported or too tall fonts.
+    """
+    data = map_font_file(font_path)
+    if data[:2] == PSF1_MAGIC or data[:4] == PSF2_MAGIC:
+        return PsfFont(font_path, data)
+    if data[:9] == b'STARTFONT':
+        return BdfFont(font_path, data)
+    raise ValueError(f"'{font_path}' is not a BDF or PSF font.")
+
+@functools.lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def get_glyph(font, codepoint):
+    """The compiled Glyph of 'codepoint' in 'font', or None if the font lacks it (cached)."""
+    return font.load_glyph(codepoint)
+
+
+# --- Text Layout ---
+# Glyph widths are looked up once and kept as prefix sums, so the position of any character,
+# the width of the whole text and the number of characters that fit are O(1) or O(log n) for
+# any spacing. The text is measured (and, if asked, fitted or centered) before any git work.
+
+ALIGN_MODES = ('left', 'fit', 'center')
+
+class TextLayout:
+    """
+    The glyphs of a text in one font and the prefix sums of their widths: offsets[i] is the
+    combined width of the first i glyphs. Characters the font lacks use the space glyph.
+    """
+    __slots__ = ('text', 'font', 'glyphs', 'offsets', 'missing')
+
+    def __init__(self, text, font=BUILTIN_FONT):
+        self.text = text
+        self.font = font
+        self.glyphs = []
+        self.offsets = [0]
+        self.missing = []
+        for char in text:
+            glyph = get_glyph(font, ord(char))
+            if glyph is None:
+                if char not in self.missing:
+                    self.missing.append(char)
+                glyph = get_glyph(font, ord(' ')) or GLYPHS[' ']
+            self.glyphs.append(glyph)
+            self.offsets.append(self.offsets[-1] + glyph.width)
+
+    def __len__(self):
+        return len(self.glyphs)
+
+    def start(self, index, spacing):
+        """Column of character 'index', relative to the start of the text."""
+        return self.offsets[index] + spacing * index
+
+    def width(self, spacing, count=None):
+        """Columns taken by the first 'count' characters (default: all of them)."""
+        count = len(self.glyphs) if count is None else count
+        return self.offsets[count] + spacing * (count - 1) if count else 0
+
+    def count_fitting(self, start_column, spacing, width, whole=True):
+        """
+        How many leading characters fit before column 'width': those that end before it, or
+        with whole=False those that merely start before it (their tail is clipped).
+        """
+        low, high = 0, len(self.glyphs)
+        while low < high: # Character positions only grow, so binary search the first misfit
+            middle = (low + high) // 2
+            edge = self.start(middle + 1, spacing) - spacing if whole else self.start(middle, spacing) + 1
+            if start_column + edge <= width:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def widest_spacing(self, available, max_spacing):
+        """The largest spacing up to 'max_spacing' at which the text fits in 'available' columns, or None."""
+        if self.width(0) > available:
+            return None
+        low, high = 0, max_spacing
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.width(middle) <= available:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+def fit_text(layout, start_column, spacing, align='left', width=GRAPH_COLS):
+    """
+    Returns the (start_column, spacing) to draw 'layout' with. 'left' keeps both as given.
+    'fit' keeps the column if the text fits, otherwise shrinks the spacing and then moves the
+    text left. 'center' centers the text, at the largest spacing (up to the given one) that fits.
+    Text wider than the graph even without spacing starts at column 0 and is cut off.
+    """
+    if align == 'fit':
+        if start_column + layout.width(spacing) <= width:
+            return start_column, spacing
+        fitted = layout.widest_spacing(width - start_column, spacing)
+        if fitted is not None:
+            return start_column, fitted
+        return max(0, width - layout.width(0)), 0
+    if align == 'center':
+        fitted = layout.widest_spacing(width, spacing)
+        if fitted is None:
+            return 0, 0
+        return (width - layout.width(fitted)) // 2, fitted
+    return start_column, spacing
+
+def layout_text(text, start_column, spacing, align='left', font_path=None, width=GRAPH_COLS):
+    """
+    Measures the text before anything is painted, applies the alignment (see fit_text) and
+    reports up front which characters would be cut off. Returns (start_column, spacing).
+    """
+    font = load_font(os.path.abspath(font_path)) if font_path else BUILTIN_FONT
+    layout = TextLayout(text, font)
+    column, chosen_spacing = fit_text(layout, start_column, spacing, align, width)
+    if (column, chosen_spacing) != (start_column, spacing):
+        print(f"Layout: '{align}' moved the text to column {column} with spacing {chosen_spacing}.", flush=True)
+
+    whole = layout.count_fitting(column, chosen_spacing, width)
+    if whole < len(layout):
+        started = layout.count_fitting(column, chosen_spacing, width, whole=False)
+        needed = column + layout.width(chosen_spacing)
+        print(f"Warning: The text needs {needed} columns but the graph has {width}. "
+              f"Only the first {whole} of {len(layout)} characters fit"
+              + (f", '{text[whole]}' is clipped" if started > whole else "")
+              + (f" and '{text[started:]}' is dropped." if started < len(layout) else "."), flush=True)
+        if align == 'left':
+            print("Use --align fit or center (or a smaller column or spacing) to fit it.", flush=True)
+    return column, chosen_spacing
+
+
+def rasterize_text(text, start_column, spacing, width=GRAPH_COLS, verbose=False, font=BUILTIN_FONT):
+    """
+    Lays the text out on a ContributionGrid using the glyphs of 'font' (the compiled CHAR_MAP
+    by default). Characters the font lacks are drawn as spaces, with one warning listing them.
+    Characters that would start at or past the right edge are dropped; columns of a character
+    that run past the edge are clipped (layout_text reports both before painting).
+    """
+    grid = ContributionGrid(width)
+    layout = TextLayout(text, font)
+    visible = layout.count_fitting(start_column, spacing, width, whole=False)
+    if visible < len(layout) and verbose:
+        print(f"Characters from index {visible} on start at or beyond the maximum {width} columns; they are not painted.", flush=True)
+
+    for char_index in range(visible):
+        char = ' ' if text[char_index] in layout.missing else text[char_index]
+        glyph = layout.glyphs[char_index]
+        current_col = start_column + layout.start(char_index, spacing)
+        if verbose:
+            print(f"Placing char '{char}' (Index: {char_index}, Width: {glyph.width}) at column {current_col}", flush=True)
+        # Columns past the edge are clipped in one step
+        for col_offset, mask in enumerate(glyph.columns[:width - current_col]):
+            if mask:
+                grid.paint_column(current_col + col_offset, mask, source=f"char='{char}' pos={char_index}")
+
+    if layout.missing:
+        print(f"Warning: Font {font.name} has no glyph for {', '.join(repr(char) for char in layout.missing)}; painted as spaces.", flush=True)
+    return grid
+
+
+# --- Image Input ---
+# Netpbm images (PBM/PGM/PPM, plain or raw) are decoded without extra dependencies. Large files
+# are memory-mapped and read one row at a time. To downsample, each row is packed into one big
+# integer with a 64-bit lane per pixel, so a band of rows is summed with a few integer additions
+# and the Python-level work grows with the image height and the 7 x N output, not the pixel count.
+
+NETPBM_FORMATS = {
+    # magic: (channels, raw)
+    b'P1': (1, False), b'P2': (1, False), b'P3': (3, False),
+    b'P4': (1, True), b'P5': (1, True), b'P6': (3, True),
+}
+NETPBM_MMAP_THRESHOLD = 1 << 20 # Files at least this large (bytes) are memory-mapped
+NETPBM_WHITESPACE = b' \t\r\n\x0b\x0c'
+LANE_BYTES = 8
+LUMA_WEIGHTS = (299, 587, 114) # ITU-R BT.601 luma, in thousandths
+# PBM_SAMPLES[b] is the 8 pixels of one packed PBM byte. A set bit is black, stored as
+# brightness 0 so that every format reads as 0 = black ... maxval = white.
+PBM_SAMPLES = [bytes(0 if byte >> (7 - bit) & 1 else 1 for bit in range(8)) for byte in range(256)]
+PBM_PLAIN_SAMPLES = bytes.maketrans(b'01', b'\x01\x00')
+
+class NetpbmImage:
+    """
+    A decoded Netpbm image whose raster is read one row at a time.
+    Rows are 'width' pixels of 'channels' samples (brightness 0..maxval, 0 = black), each
+    'sample_size' bytes (big-endian when 2). PBM bits are unpacked to one byte per pixel.
+    """
+    __slots__ = ('path', 'width', 'height', 'maxval', 'channels', 'sample_size', 'data', 'offset', 'row_bytes', 'bit_packed')
+
+    def __init__(self, path, width, height, maxval, channels, data, offset=0, bit_packed=False):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.maxval = maxval
+        self.channels = channels
+        self.sample_size = 1 if maxval < 256 else 2
+        self.data = data
+        self.offset = offset
+        self.bit_packed = bit_packed
+        self.row_bytes = (width + 7) // 8 if bit_packed else width * channels * self.sample_size
+        if len(data) < offset + height * self.row_bytes:
+            raise ValueError(f"Image '{path}' is truncated.")
+
+    def row(self, y):
+        start = self.offset + y * self.row_bytes
+        row = self.data[start:start + self.row_bytes]
+        if self.bit_packed:
+            row = b"".join(map(PBM_SAMPLES.__getitem__, row))[:self.width]
+        return row
+
+    def close(self):
+        if hasattr(self.data, 'close'): # Memory-mapped
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def parse_netpbm_header(data):
+    """Parses a Netpbm header. Returns (magic, width, height, maxval, offset of the raster)."""
+    magic = bytes(data[:2])
+    if magic not in NETPBM_FORMATS:
+        raise ValueError("Not a Netpbm image (expected a P1-P6 header).")
+    values = []
+    needed = 2 if magic in (b'P1', b'P4') else 3
+    pos = 2
+    while len(values) < needed:
+        if pos >= len(data):
+            raise ValueError("Truncated Netpbm header.")
+        if data[pos] in NETPBM_WHITESPACE:
+            pos += 1
+        elif data[pos] == ord('#'): # Comments run to the end of the line
+            end = data.find(b'\n', pos)
+            pos = len(data) if end < 0 else end + 1
+        else:
+            start = pos
+            while pos < len(data) and 0x30 <= data[pos] <= 0x39:
+                pos += 1
+            if pos == start:
+                raise ValueError(f"Unexpected byte {bytes(data[pos:pos + 1])!r} in Netpbm header.")
+            values.append(int(data[start:pos]))
+    width, height = values[0], values[1]
+    maxval = values[2] if needed == 3 else 1
+    if width < 1 or height < 1 or not 1 <= maxval <= 65535:
+        raise ValueError(f"Invalid Netpbm size {width}x{height} or maxval {maxval}.")
+    return magic, width, height, maxval, pos + 1 # A single whitespace byte precedes the raster
+
+def decode_plain_raster(magic, raster, width, height, maxval, channels):
+    """Converts the ASCII raster of a P1/P2/P3 image to the layout of its raw counterpart."""
+    # Comments may appear anywhere in plain files
+    raster = b"\n".join(line.split(b'#', 1)[0] for line in raster.split(b'\n'))
+    count = width * height * channels
+    if magic == b'P1':
+        # Bits need no separators ("0110" is four pixels)
+        samples = raster.translate(None, NETPBM_WHITESPACE)[:count]
+        return samples.translate(PBM_PLAIN_SAMPLES)
+    samples = list(map(int, raster.split()[:count]))
+    if maxval < 256:
+        return bytes(samples)
+    return struct.pack(f">{len(samples)}H", *samples)
+
+def open_netpbm(image_path):
+    """
+    Opens a PBM, PGM or PPM image (plain or raw). Raw files of NETPBM_MMAP_THRESHOLD bytes
+    or more are memory-mapped instead of read. Raises ValueError for malformed files.
+    """
+    import mmap
+
+    with open(image_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= NETPBM_MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+    try:
+        magic, width, height, maxval, offset = parse_netpbm_header(data)
+        channels, raw = NETPBM_FORMATS[magic]
+        if raw:
+            return NetpbmImage(image_path, width, height, maxval, channels, data, offset, bit_packed=(magic == b'P4'))
+        raster = decode_plain_raster(magic, bytes(data[offset:]), width, height, maxval, channels)
+    except ValueError:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        raise
+    if isinstance(data, mmap.mmap):
+        data.close()
+    return NetpbmImage(image_path, width, height, maxval, channels, raster)
+
+def box_bounds(index, count, size):
+    """Start and end of the index-th of 'count' equal boxes over 'size' pixels (at least one pixel wide)."""
+    start = index * size // count
+    return start, max((index + 1) * size // count, start + 1)
+
+def pack_row_lanes(row, image, weights):
+    """Packs a row into an integer with one LANE_BYTES lane per pixel holding its weighted brightness."""
+    stride = image.channels * image.sample_size
+    packed = 0
+    for channel, weight in enumerate(weights):
+        lanes = bytearray(image.width * LANE_BYTES)
+        for byte_index in range(image.sample_size): # Samples are big-endian, lanes little-endian
+            lanes[image.sample_size - 1 - byte_index::LANE_BYTES] = row[channel * image.sample_size + byte_index::stride]
+        packed += int.from_bytes(lanes, 'little') * weight
+    return packed
+
+def box_means(image, columns, rows=GRAPH_ROWS):
+    """
+    Area-averages the image into rows x columns boxes.
+    Returns a list of rows of mean brightness values (0.0 = black, 1.0 = white).
+    """
+    import array
+
+    weights = LUMA_WEIGHTS if image.channels == 3 else (1,)
+    full_scale = image.maxval * sum(weights)
+    means = []
+    for band in range(rows):
+        y_start, y_end = box_bounds(band, rows, image.height)
+        band_total = 0
+        for y in range(y_start, y_end):
+            band_total += pack_row_lanes(image.row(y), image, weights)
+        lanes = array.array('Q', band_total.to_bytes(image.width * LANE_BYTES, 'little'))
+        if sys.byteorder == 'big':
+            lanes.byteswap()
+        band_means = []
+        for col in range(columns):
+            x_start, x_end = box_bounds(col, columns, image.width)
+            band_means.append(sum(lanes[x_start:x_end]) / ((x_end - x_start) * (y_end - y_start) * full_scale))
+        means.append(band_means)
+    return means
+
+def quantize_levels(values, dither=False):
+    """
+    Maps rows of values in 0.0-1.0 to levels 0-MAX_LEVEL by rounding.
+    With 'dither' the rounding error is diffused to the neighbouring cells (Floyd-Steinberg),
+    so gradients keep their average shade.
+    """
+    if not dither:
+        return [[min(MAX_LEVEL, int(value * MAX_LEVEL + 0.5)) for value in row] for row in values]
+    errors = [[value * MAX_LEVEL for value in row] for row in values]
+    levels = []
+    for y, row in enumerate(errors):
+        level_row = []
+        for x, value in enumerate(row):
+            level = max(0, min(MAX_LEVEL, int(value + 0.5)))
+            level_row.append(level)
+            error = value - level
+            if x + 1 < len(row):
+                row[x + 1] += error * 7 / 16
+            if y + 1 < len(errors):
+                below = errors[y + 1]
+                if x > 0:
+                    below[x - 1] += error * 3 / 16
+                below[x] += error * 5 / 16
+                if x + 1 < len(row):
+                    below[x + 1] += error * 1 / 16
+        levels.append(level_row)
+    return levels
+
+def rasterize_image(image, start_column, width=GRAPH_COLS, dither=False, invert=False, verbose=False):
+    """
+    Downsamples the image onto a ContributionGrid, 7 rows high from 'start_column' on, keeping
+    its aspect ratio (clipped to the columns left on the graph). Dark pixels become dark cells;
+    'invert' is for light-on-dark artwork.
+    """
+    grid = ContributionGrid(width)
+    available = width - start_column
+    columns = max(1, round(image.width * GRAPH_ROWS / image.height))
+    if columns > available:
+        print(f"Warning: The image needs {columns} columns but only {max(available, 0)} are left from column {start_column}. Squeezing it to fit.", flush=True)
+        columns = available
+    if columns <= 0:
+        return grid
+
+    means = box_means(image, columns)
+    levels = quantize_levels([row if invert else [1.0 - mean for mean in row] for row in means], dither)
+    name = os.path.basename(image.path)
+    if verbose:
+        print(f"Downsampled {image.width}x{image.height} image '{name}' to {columns}x{GRAPH_ROWS} cells at column {start_column}", flush=True)
+    for col in range(columns):
+        grid.paint_levels(start_column + col, bytes(level_row[col] for level_row in levels), source=f"image='{name}' col={col}")
+    return grid
+
+
+# --- Instrumentation ---
+# Counters, phase timers and git-call latency histograms, reported through pluggable sinks:
+# a human progress bar, a JSON lines event log and a summary table. The module-level METRICS
+# instance is what the painting functions report to; configure_metrics() swaps its sinks.
+
+# Upper bounds (milliseconds) of the git-call latency histogram buckets; the last is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+
+class LatencyHistogram:
+    """Bucketed latency distribution with count, total and maximum."""
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """Adds the samples of another histogram (e.g. one from a worker process)."""
+        self.buckets = [hits + other_hits for hits, other_hits in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def as_dict(self):
+        labels = [f"<={bound:g}ms" if bound != float('inf') else f">{LATENCY_BUCKETS_MS[-2]:g}ms" for bound in LATENCY_BUCKETS_MS]
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'max_ms': self.max * 1000,
+            'buckets': {label: hits for label, hits in zip(labels, self.buckets) if hits},
+        }
+
+
+class Metrics:
+    """Collects counters, phase durations and latency histograms and forwards events to sinks."""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.counters = {}
+        self.phases = {}
+        self.histograms = {}
+        self.progress_done = 0
+        self.progress_total = 0
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds, **fields):
+        """Records one latency sample (e.g. a git call)."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.observe(seconds)
+        self.emit(name, seconds=seconds, **fields)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times a phase of the run (init, layout, commit, ...)."""
+        self.emit('phase_start', phase=name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            self.emit('phase_end', phase=name, seconds=elapsed)
+
+    def start_progress(self, total):
+        self.progress_done = 0
+        self.progress_total = total
+        for sink in self.sinks:
+            sink.start_progress(total)
+
+    def advance(self, amount=1):
+        self.progress_done += amount
+        for sink in self.sinks:
+            sink.progress(self.progress_done, self.progress_total)
+
+    def finish_progress(self):
+        for sink in self.sinks:
+            sink.finish_progress()
+
+    def emit(self, kind, **fields):
+        for sink in self.sinks:
+            sink.event(kind, fields)
+
+    def flush(self):
+        """Writes out whatever the sinks buffer (a worker process calls this before it can exit)."""
+        for sink in self.sinks:
+            sink.flush()
+
+    def export(self):
+        """The counters, phases and histograms collected so far, for merge() in another process."""
+        return {'counters': self.counters, 'phases': self.phases, 'histograms': self.histograms}
+
+    def merge(self, exported):
+        """Adds what another collector recorded (see export) to this one."""
+        for name, amount in exported['counters'].items():
+            self.count(name, amount)
+        for name, seconds in exported['phases'].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        for name, histogram in exported['histograms'].items():
+            self.histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+
+    def summary(self):
+        return {
+            'phases': dict(self.phases),
+            'counters': dict(self.counters),
+            'histograms': {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+        }
+
+    def close(self):
+        """Hands the final summary to every sink."""
+        summary = self.summary()
+        for sink in self.sinks:
+            sink.close(summary)
+
+
+class MetricsSink:
+    """Base sink: ignores everything. Subclasses override what they report."""
+
+    def event(self, kind, fields):
+        pass
+
+    def start_progress(self, total):
+        pass
+
+    def progress(self, done, total):
+        pass
+
+    def finish_progress(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self, summary):
+        pass
+
+
+class ProgressSink(MetricsSink):
+    """
+    The '[=====]' progress bar. Writes (and flushes) only when the bar actually grows.
+    Without an explicit stream it follows whatever sys.stdout currently is.
+    When the total is unknown (None) it shows a running count instead, refreshed at most
+    every 'refresh_seconds'.
+    """
+
+    def __init__(self, stream=None, width=50, refresh_seconds=0.5):
+        self.stream = stream
+        self.width = width
+        self.refresh_seconds = refresh_seconds
+        self.ticks = 0
+        self.open_ended = False
+        self.done = 0
+        self.last_refresh = 0.0
+
+    def write(self, chunk):
+        stream = self.stream or sys.stdout
+        stream.write(chunk)
+        stream.flush()
+
+    def start_progress(self, total):
+        self.ticks = 0
+        self.done = 0
+        self.open_ended = total is None
+        self.last_refresh = time.perf_counter()
+        self.write("Progress: 0 dots" if self.open_ended else "Progress: [")
+
+    def progress(self, done, total):
+        self.done = done
+        if self.open_ended:
+            now = time.perf_counter()
+            if now - self.last_refresh >= self.refresh_seconds:
+                self.write(f"\rProgress: {done} dots")
+                self.last_refresh = now
+            return
+        if not total:
+            return
+        ticks = min(self.width, int(self.width * done / total))
+        if ticks > self.ticks:
+            self.write("=" * (ticks - self.ticks))
+            self.ticks = ticks
+
+    def finish_progress(self):
+        if self.open_ended:
+            self.write(f"\rProgress: {self.done} dots\n")
+        else:
+            self.write("=" * (self.width - self.ticks) + "]\n")
+
+
+class JsonLinesSink(MetricsSink):
+    """Writes every event, and the final summary, as one JSON object per line (buffered)."""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.start_time = time.perf_counter()
+
+    def write(self, kind, fields):
+        import json
+
+        record = {'t': round(time.perf_counter() - self.start_time, 6), 'event': kind}
+        record.update(fields)
+        self.file.write(json.dumps(record, default=str) + "\n")
+
+    def event(self, kind, fields):
+        self.write(kind, fields)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self, summary):
+        self.write('summary', summary)
+        self.file.close()
+
+
+class SummarySink(MetricsSink):
+    """Prints a table of phase durations, counters and git-call latencies at the end of a run."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def close(self, summary):
+        lines = ["\n--- Run Metrics ---"]
+        for name, seconds in summary['phases'].items():
+            lines.append(f"  phase {name:<20} {seconds:>10.3f}s")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"  {name:<26} {value:>10}")
+        for name, histogram in summary['histograms'].items():
+            lines.append(f"  {name:<26} {histogram['count']:>10} calls, mean {histogram['mean_ms']:.2f}ms, max {histogram['max_ms']:.2f}ms")
+            for bucket, hits in histogram['buckets'].items():
+                lines.append(f"      {bucket:>10} {hits:>8}")
+        lines.append("-------------------")
+        stream = self.stream or sys.stdout
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+
+METRICS = Metrics([ProgressSink()])
+
+def timed_phase(name):
+    """Decorator that times every call of a function as a METRICS phase."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def configure_metrics(progress=True, json_path=None, summary=False):
+    """Replaces the global METRICS with a fresh collector using the requested sinks."""
+    global METRICS
+    sinks = []
+    if progress:
+        sinks.append(ProgressSink())
+    if json_path:
+        sinks.append(JsonLinesSink(json_path))
+    if summary:
+        sinks.append(SummarySink())
+    METRICS = Metrics(sinks)
+    return METRICS
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    """
+    Runs func under cProfile and dumps the stats to 'profile_path' (readable with pstats or
+    snakeviz). Returns func's result.
+    """
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        print(f"Profile written to {profile_path}", flush=True)
+
+# --- Errors ---
+
+class ContributionArtError(Exception):
+    """
+    A repository could not be prepared or painted. Library functions raise this instead of
+    exiting the process; the command line turns it into an exit code.
+    """
+
+class GitCommandError(ContributionArtError):
+    """A critical git command failed."""
+
+    def __init__(self, command, repo_path, returncode=None, stderr=""):
+        super().__init__(f"'{' '.join(command)}' failed in '{repo_path}' (return code {returncode}): {stderr.strip()}")
+        self.command = command
+        self.repo_path = repo_path
+        self.returncode = returncode
+        self.stderr = stderr
+
+class UnwrittenDotsError(ContributionArtError):
+    """
+    A paint run stopped before publishing. 'dots' and 'commits' count the planned work that did
+    not reach the branch (all of it, since runs are all or nothing), from 'first_date' to 'last_date'.
+    """
+
+    def __init__(self, reason, dots, commits, first_date=None, last_date=None):
+        span = f", {first_date} to {last_date}" if first_date else ""
+        super().__init__(f"{reason}. {dots} dots ({commits} commits{span}) were not written; the branch was left unchanged.")
+        self.dots = dots
+        self.commits = commits
+        self.first_date = first_date
+        self.last_date = last_date
+
+# --- Retries & Locking ---
+# Git refuses to work while another process holds one of its lock files (index.lock, <ref>.lock).
+# Such failures are transient and are retried with bounded exponential backoff; anything else
+# (a bad revision, a ref that moved, a missing identity) fails at once. Painter runs on the same
+# repository also take a per-repository lock first, so they queue up instead of colliding.
+
+GIT_RETRY_ATTEMPTS = 6
+GIT_RETRY_BASE_SECONDS = 0.05
+GIT_RETRY_MAX_SECONDS = 2.0
+RETRYABLE_GIT_ERRORS = (".lock': File exists", "Another git process seems to be running", "is locked by another process")
+REPO_LOCK_TIMEOUT_SECONDS = 600
+
+def is_retryable_git_error(stderr):
+    """True for lock contention, which goes away once the other process is done."""
+    return any(marker in (stderr or "") for marker in RETRYABLE_GIT_ERRORS)
+
+def get_retry_delay(attempt):
+    """Seconds to wait before retry number 'attempt' (1-based): exponential, capped, with jitter."""
+    import random
+
+    return min(GIT_RETRY_MAX_SECONDS, GIT_RETRY_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+class RepoLock:
+    """
+    An advisory lock that serializes painter runs on one repository, across processes. The lock
+    file lives in the temp directory, keyed by the repository's absolute path, so it can be
+    taken before the repository exists. Waiting backs off like git retries, up to 'timeout'.
+    """
+
+    def __init__(self, repo_path, timeout=REPO_LOCK_TIMEOUT_SECONDS):
+        import hashlib
+        import tempfile
+
+        self.repo_path = os.path.abspath(repo_path)
+        self.timeout = timeout
+        key = hashlib.sha1(self.repo_path.encode('utf-8')).hexdigest()[:16]
+        self.lock_path = os.path.join(tempfile.gettempdir(), f"contribution-art-{key}.lock")
+        self.file = None
+
+    def try_acquire(self):
+        """Takes the lock if it is free. Returns True on success."""
+        f = open(self.lock_path, "a+")
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def wait_delays(self):
+        """Yields the delays between attempts; raises ContributionArtError once 'timeout' has passed."""
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        print(f"Another run is painting '{self.repo_path}'. Waiting for it to finish...", flush=True)
+        while time.monotonic() < deadline:
+            attempt += 1
+            yield min(get_retry_delay(attempt), max(0.0, deadline - time.monotonic()))
+        raise ContributionArtError(f"Another run kept '{self.repo_path}' locked for {self.timeout}s ('{self.lock_path}').")
+
+    def acquire(self):
+        if self.try_acquire():
+            return
+        for delay in self.wait_delays():
+            time.sleep(delay)
+            if self.try_acquire():
+                return
+
+    async def acquire_async(self):
+        import asyncio
+
+        if self.try_acquire():
+            return
+        for delay in self.wait_delays():
+            await asyncio.sleep(delay)
+            if self.try_acquire():
+                return
+
+    def release(self):
+        if self.file:
+            self.file.close() # Closing the file drops the lock
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
 # --- Git Helper Functions ---
 
-def run_git_command(command, repo_path, env=None, verbose=False):
+GIT_NOT_FOUND_MESSAGE = "'git' command not found. Make sure Git is installed and in your system's PATH."
+
+def report_git_error(command, repo_path, env, returncode, stderr, stdout):
+    """Prints the details of a failed git command."""
+    print(f"\n--- Git Command Error ---", flush=True)
+    print(f"Command: {' '.join(command)}")
+    print(f"Path: {repo_path}")
+    if env:
+        print(f"Environment: GIT_AUTHOR_DATE={env.get('GIT_AUTHOR_DATE')}, GIT_COMMITTER_DATE={env.get('GIT_COMMITTER_DATE')}")
+    print(f"Return Code: {returncode}")
+    print(f"Stderr: {stderr.strip()}")
+    print(f"Stdout: {stdout.strip()}")
+    print(f"-------------------------\n", flush=True)
+
+def run_git_command(command, repo_path, env=None, verbose=False, fatal=False):
+    """
+    Runs a Git command using subprocess in the specified repository path
+    and handles errors.
+    Lock contention is retried with backoff (see is_retryable_git_error). Other failures are
+    reported and return None, or raise GitCommandError when 'fatal' is set.
+    """
+    import subprocess
+
+    for attempt in range(1, GIT_RETRY_ATTEMPTS + 1):
+        start_time = time.perf_counter()
+        try:
+            # Execute commands within the target repository directory
+            result = subprocess.run(command, check=True, capture_output=True, text=True, env=env, cwd=repo_path)
+            METRICS.observe('git_call', time.perf_counter() - start_time, command=command[1])
+            if verbose:
+                 print(f"DEBUG: Ran '{' '.join(command)}' in '{repo_path}'. Output:\n{result.stdout}\n{result.stderr}")
+            return result
+        except subprocess.CalledProcessError as e:
+            METRICS.observe('git_call', time.perf_counter() - start_time, command=command[1], returncode=e.returncode)
+            if attempt < GIT_RETRY_ATTEMPTS and is_retryable_git_error(e.stderr):
+                METRICS.count('git_retries')
+                if verbose: print(f"DEBUG: '{' '.join(command)}' hit a lock, retrying ({attempt}/{GIT_RETRY_ATTEMPTS - 1})", flush=True)
+                time.sleep(get_retry_delay(attempt))
+                continue
+            METRICS.count('git_failures')
+            report_git_error(command, repo_path, env, e.returncode, e.stderr, e.stdout)
+            # The caller decides whether it can carry on without this command
+            if fatal:
+                 raise GitCommandError(command, repo_path, e.returncode, e.stderr)
+            return None # Indicate failure for this specific command
+        except FileNotFoundError:
+            raise ContributionArtError(GIT_NOT_FOUND_MESSAGE)
+        except Exception as e:
+            print(f"An unexpected error occurred while running git command: {e}", flush=True)
+            print(f"Command: {' '.join(command)}")
+            print(f"Path: {repo_path}")
+            return None
+
+# --- Async Git Execution ---
+# AsyncGitRunner runs git as asyncio subprocesses, so independent commands (different
+# repositories, read-only queries) overlap in one process and one thread. A semaphore caps the
+# number of git processes alive at once, and every command has a timeout. Failures behave like
+# run_git_command: the error is reported and None returned, or GitCommandError raised if fatal.
+
+GIT_TIMEOUT_SECONDS = 300
+
+class AsyncGitRunner:
+    """Runs git commands concurrently, at most 'concurrency' at a time, each within 'timeout' seconds."""
+
+    def __init__(self, concurrency=None, timeout=GIT_TIMEOUT_SECONDS, verbose=False):
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.timeout = timeout
+        self.verbose = verbose
+        self.semaphore = None # Created on first use, inside the running event loop
+
+    def slot(self):
+        """The semaphore every git process holds while it runs."""
+        import asyncio
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+    async def execute(self, command, repo_path, env=None, input_chunks=None):
+        """
+        Runs one command, feeding it 'input_chunks' (an iterable of bytes) if given.
+        Returns (returncode, stdout, stderr); the return code is None if the command timed out.
+        """
+        import asyncio
+        import subprocess
+
+        async with self.slot():
+            start_time = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command, cwd=repo_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    stdin=subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL
+                )
+            except FileNotFoundError:
+                raise ContributionArtError(GIT_NOT_FOUND_MESSAGE)
+
+            async def feed_and_wait():
+                if input_chunks is not None:
+                    for chunk in input_chunks:
+                        process.stdin.write(chunk)
+                        await process.stdin.drain() # Lets other commands run while the pipe is full
+                    process.stdin.close()
+                return await process.communicate()
+
+            try:
+                # One deadline for the whole exchange: a process that stops reading its input times out too
+                stdout, stderr = await asyncio.wait_for(feed_and_wait(), self.timeout)
+                returncode = process.returncode
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                returncode, stdout, stderr = None, b"", f"Timed out after {self.timeout}s".encode('utf-8')
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            METRICS.observe('git_call', time.perf_counter() - start_time, command=command[1], returncode=returncode)
+        return returncode, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace')
+
+    async def run(self, command, repo_path, env=None, fatal=False, input_chunks=None):
+        """The async run_git_command: a CompletedProcess, or None (GitCommandError if 'fatal') on failure."""
+        import asyncio
+        import subprocess
+
+        for attempt in range(1, GIT_RETRY_ATTEMPTS + 1):
+            returncode, stdout, stderr = await self.execute(command, repo_path, env, input_chunks)
+            # A consumed input stream cannot be replayed, so only plain commands are retried
+            if returncode in (0, None) or input_chunks is not None or attempt == GIT_RETRY_ATTEMPTS or not is_retryable_git_error(stderr):
+                break
+            METRICS.count('git_retries')
+            await asyncio.sleep(get_retry_delay(attempt))
+        if returncode == 0:
+            if self.verbose:
+                print(f"DEBUG: Ran '{' '.join(command)}' in '{repo_path}'. Output:\n{stdout}\n{stderr}")
+            return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+        METRICS.count('git_failures')
+        report_git_error(command, repo_path, env, returncode, stderr, stdout)
+        if fatal:
+            raise GitCommandError(command, repo_path, returncode, stderr)
+        return None
+
+    async def query(self, command, repo_path):
+        """The async query_git: the stripped stdout, or None if the command failed (not reported)."""
+        returncode, stdout, _ = await self.execute(command, repo_path)
+        return stdout.strip() if returncode == 0 else None
+
+    async def commit_counts(self, repo_path, ref='HEAD'):
+        """The async read_commit_counts: one streaming 'git log' pass."""
+        import asyncio
+        import subprocess
+
+        counts = {}
+        if await self.query(['git', 'rev-parse', '--verify', '-q', ref], repo_path) is None:
+            return counts
+        command = ['git', 'log', '--format=%ad', '--date=short', ref]
+
+        async def count_lines(process):
+            async for line in process.stdout:
+                day = date.fromisoformat(line.decode('ascii').strip())
+                counts[day] = counts.get(day, 0) + 1
+            await process.wait()
+
+        async with self.slot():
+            process = await asyncio.create_subprocess_exec(*command, cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                await asyncio.wait_for(count_lines(process), self.timeout)
+            except asyncio.TimeoutError:
+                raise GitCommandError(command, repo_path, None, f"Timed out after {self.timeout}s")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        return counts
+
+
+def make_commit_times(commit_date, commits_per_dot, seed=None):
+    """
+    Picks a time of day for each commit of a single dot.
+    Returns a list of 'YYYY-MM-DD HH:MM:SS' strings, one per commit.
+    With a 'seed' the times depend only on the seed and the date, so a seeded run always
+    produces the same commits, whether it is painted in one go, in shards or resumed (see PaintCheckpoint).
+    """
+    import random
+
+    rng = random.Random(f"{seed}:{commit_date.isoformat()}") if seed is not None else random
+    base_time_sec = rng.randint(0, 59)
+    date_strs = []
+
+    for i in range(commits_per_dot):
+        # Vary commit times slightly to look more 'natural'
+        commit_hour = rng.randint(10, 19) # Simulate business hours
+        commit_min = rng.randint(0, 59)
+        # Ensure seconds are distinct within the same minute for multiple dots
+        commit_sec = (base_time_sec + i) % 60
+        date_strs.append(f"{commit_date.isoformat()} {commit_hour:02d}:{commit_min:02d}:{commit_sec:02d}")
+
+    return date_strs
+
+
+def create_commit(repo_path, tree, parent, date_str, message, verbose=False):
+    """
+    Creates one empty commit dated 'date_str' on top of 'parent' (None for a root commit) with
+    'git commit-tree', which leaves HEAD, the index and the work tree alone.
+    Returns the new commit id, or None if git failed.
+    """
+    # Set Git environment variables for author and committer dates
+    env = os.environ.copy()
+    env['GIT_AUTHOR_DATE'] = date_str
+    env['GIT_COMMITTER_DATE'] = date_str
+
+    commit_command = ['git', 'commit-tree', tree, '-m', message] + (['-p', parent] if parent else [])
+    result = run_git_command(commit_command, repo_path, env=env, verbose=verbose)
+    return result.stdout.strip() if result else None
+
+# --- Commit Backends ---
+# 'commit'      : one 'git commit-tree' process per commit (the original, slowest path)
+# 'fast-import' : the whole history is streamed into a single 'git fast-import' process
+# 'native'      : commit objects are built in-process and written as loose objects (no git needed)
+# 'native-pack' : like 'native', but all objects go into a single packfile + index
+BACKENDS = ('commit', 'fast-import', 'native', 'native-pack')
+
+def query_git(command, repo_path, input_text=""):
+    """
+    Runs a Git query whose failure is an expected answer (e.g. an unborn HEAD).
+    Returns the stripped stdout, or None if the command failed.
+    """
+    import subprocess
+
+    try:
+        result = subprocess.run(command, input=input_text, capture_output=True, text=True, cwd=repo_path)
+    except FileNotFoundError:
+        raise ContributionArtError(GIT_NOT_FOUND_MESSAGE)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+def get_branch_ref(repo_path):
+    """Returns the full ref HEAD points to (e.g. 'refs/heads/main')."""
+    ref = query_git(['git', 'symbolic-ref', '-q', 'HEAD'], repo_path)
+    if not ref:
+        raise ContributionArtError(f"HEAD is detached in '{repo_path}'. Check out a branch before painting.")
+    return ref
+
+def get_git_ident(repo_path, kind='AUTHOR'):
+    """Returns 'Name <email>' for the configured author or committer identity."""
+    ident = query_git(['git', 'var', f'GIT_{kind}_IDENT'], repo_path)
+    if not ident:
+        raise ContributionArtError(f"Could not determine the Git {kind.lower()} identity. Set user.name and user.email.")
+    # 'git var' appends '<timestamp> <tz>', drop it
+    return ident.rsplit(' ', 2)[0]
+
+def format_raw_date(date_str):
+    """
+    Converts a local 'YYYY-MM-DD HH:MM:SS' string into Git's raw date format
+    ('<unix timestamp> <+hhmm>'), interpreting it the same way 'git commit --date' does.
+    """
+    local_dt = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S").astimezone()
+    offset_min = int(local_dt.utcoffset().total_seconds()) // 60
+    sign = '+' if offset_min >= 0 else '-'
+    offset_min = abs(offset_min)
+    return f"{int(local_dt.timestamp())} {sign}{offset_min // 60:02d}{offset_min % 60:02d}"
+
+COMPACT_COMMIT_MESSAGE = "Contribution art"
+
+def format_commit_message(message_suffix, index, count, compact=False):
+    """
+    The message of commit 'index' (1-based) of a dot. Compact histories give every commit the
+    same short message, so neighbouring commits differ only in their parent and dates (see make_delta).
+    """
+    if compact:
+        return COMPACT_COMMIT_MESSAGE
+    return f"Art commit {message_suffix} ({index}/{count})"
+
+
+class CommitCommandWriter:
+    """
+    Writes each commit with its own 'git commit-tree' process, onto the transaction's
+    scratch ref. The scratch ref follows every finished dot.
+    """
+
+    def __init__(self, repo_path, transaction, verbose=False, seed=None, compact=False):
+        self.repo_path = os.path.abspath(repo_path)
+        self.transaction = transaction
+        self.verbose = verbose
+        self.seed = seed
+        self.compact = compact
+        self.parent = transaction.base
+        self.failed = False
+        if self.parent:
+            self.tree = query_git(['git', 'rev-parse', f'{self.parent}^{{tree}}'], self.repo_path)
+        else:
+            self.tree = query_git(['git', 'mktree'], self.repo_path) # Writes the empty tree
+
+    def write_dot(self, commit_date, commits_per_dot, message_suffix=""):
+        for i, date_str in enumerate(make_commit_times(commit_date, commits_per_dot, self.seed)):
+            message = format_commit_message(message_suffix, i + 1, commits_per_dot, self.compact)
+            commit_sha = create_commit(self.repo_path, self.tree, self.parent, date_str, message, self.verbose)
+            if not commit_sha:
+                # If one commit fails, the whole run is abandoned
+                METRICS.count('commit_failures')
+                print(f"  Failed to create commit {i+1}/{commits_per_dot} for {date_str}. Stopping.", flush=True)
+                self.failed = True
+                return False
+            self.parent = commit_sha
+            METRICS.count('commits_written')
+            if self.verbose:
+                print(f"  Commit {i+1}/{commits_per_dot} created for {date_str}")
+        if run_git_command(['git', 'update-ref', self.transaction.scratch_ref, self.parent], self.repo_path, verbose=self.verbose) is None:
+            self.failed = True
+            return False
+        return True
+
+    def close(self):
+        """Publishes the commits to the branch (see PaintTransaction.publish)."""
+        if self.failed:
+            self.transaction.abort()
+            return False
+        if self.parent == self.transaction.base: # Nothing was written
+            self.transaction.abort()
+            return True
+        return self.transaction.publish(self.parent)
+
+    def abort(self):
+        self.transaction.abort()
+
+
+def format_fast_import_commit(ref, author, committer, date_str, message, parent=None):
+    """The 'git fast-import' command for one empty commit on 'ref' (on top of 'parent', if given)."""
+    raw_date = format_raw_date(date_str)
+    # 'git commit -m' stores the message with a trailing newline, match it
+    data = (message + "\n").encode('utf-8')
+    header = f"commit {ref}\nauthor {author} {raw_date}\ncommitter {committer} {raw_date}\ndata {len(data)}\n"
+    chunks = [header.encode('utf-8'), data]
+    if parent:
+        chunks.append(f"from {parent}\n".encode('utf-8'))
+    chunks.append(b"\n")
+    return b"".join(chunks)
+
+class FastImportWriter:
+    """
+    Streams every commit into one 'git fast-import' process, onto the transaction's scratch ref.
+    Commits carry no file changes, so each one keeps its parent's tree exactly like
+    'git commit --allow-empty'. Nothing reaches the branch before close().
+    """
+
+    def __init__(self, repo_path, transaction, verbose=False, seed=None, compact=False):
+        import subprocess
+
+        self.repo_path = os.path.abspath(repo_path)
+        self.transaction = transaction
+        self.verbose = verbose
+        self.seed = seed
+        self.compact = compact
+        self.ref = transaction.scratch_ref
+        self.parent = transaction.base
+        self.author = get_git_ident(self.repo_path, 'AUTHOR')
+        self.committer = get_git_ident(self.repo_path, 'COMMITTER')
+        self.commits_written = 0
+        self.start_time = time.perf_counter()
+        self.process = subprocess.Popen(
+            ['git', 'fast-import', '--quiet', '--date-format=raw'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.repo_path
+        )
+        if verbose:
+            print(f"DEBUG: Started 'git fast-import' for {self.ref} (parent: {self.parent or 'none'})", flush=True)
+
+    def add_commit(self, date_str, message):
+        """Queues a single empty commit on the branch."""
+        # Later commits on the same ref chain onto the previous one automatically
+        parent = self.parent if self.commits_written == 0 else None
+        self.process.stdin.write(format_fast_import_commit(self.ref, self.author, self.committer, date_str, message, parent))
+        self.commits_written += 1
+
+    def write_dot(self, commit_date, commits_per_dot, message_suffix=""):
+        for i, date_str in enumerate(make_commit_times(commit_date, commits_per_dot, self.seed)):
+            self.add_commit(date_str, format_commit_message(message_suffix, i + 1, commits_per_dot, self.compact))
+            if self.verbose:
+                print(f"  Commit {i+1}/{commits_per_dot} queued for {date_str}")
+        METRICS.count('commits_written', commits_per_dot)
+        return True
+
+    def close(self):
+        """Finishes the stream, then publishes the scratch ref fast-import updated to the branch."""
+        stdout, stderr = self.process.communicate()
+        METRICS.observe('git_call', time.perf_counter() - self.start_time, command='fast-import', returncode=self.process.returncode)
+        if self.process.returncode != 0:
+            METRICS.count('git_failures')
+            print(f"\n--- Git Command Error ---", flush=True)
+            print(f"Command: git fast-import")
+            print(f"Path: {self.repo_path}")
+            print(f"Return Code: {self.process.returncode}")
+            print(f"Stderr: {stderr.decode('utf-8', 'replace').strip()}")
+            print(f"-------------------------\n", flush=True)
+            self.transaction.abort()
+            return False
+        if self.verbose:
+            print(f"DEBUG: fast-import wrote {self.commits_written} commits to {self.ref}", flush=True)
+        if not self.commits_written:
+            self.transaction.abort()
+            return True
+        return self.transaction.publish(query_git(['git', 'rev-parse', '--verify', '-q', self.ref], self.repo_path))
+
+    def abort(self):
+        """Stops fast-import without updating any ref."""
+        self.process.kill()
+        self.process.communicate()
+        self.transaction.abort()
+
+
+# --- Native Object Writer ---
+# Builds commit objects in pure Python (zlib + SHA-1) and writes them straight into
+# '.git/objects', either as loose objects or as a single packfile with its index.
+# This needs no 'git' binary at all.
+
+PACK_TYPE_CODES = {'commit': 1, 'tree': 2, 'blob': 3, 'tag': 4}
+PACK_TYPE_NAMES = {code: name for name, code in PACK_TYPE_CODES.items()}
+PACK_OFS_DELTA = 6
+PACK_REF_DELTA = 7
+DELTA_BASE_CACHE_SIZE = 256 # Resolved delta bases kept, like git's delta base cache
+
+# (pack path, offset) -> (type, content), least recently used first. Packs are named after their
+# checksum, so an entry stays valid for as long as its pack exists
+delta_base_cache = collections.OrderedDict()
+
+def hash_object(obj_type, content):
+    """
+    Returns (sha, raw) for a Git object, where 'raw' is the 'type size\\0content'
+    bytes whose SHA-1 is the object id.
+    """
+    import hashlib
+
+    raw = f"{obj_type} {len(content)}\0".encode('ascii') + content
+    return hashlib.sha1(raw).hexdigest(), raw
+
+def get_git_dir(repo_path):
+    """Returns the '.git' directory of a work tree, or the path itself for a bare repository."""
+    git_dir = os.path.join(repo_path, ".git")
+    if os.path.isdir(git_dir):
+        return git_dir
+    if os.path.isfile(os.path.join(repo_path, "HEAD")) and os.path.isdir(os.path.join(repo_path, "objects")):
+        return repo_path
+    raise ContributionArtError(f"'{repo_path}' is not a Git repository.")
+
+def read_head_ref(git_dir):
+    """Returns the ref HEAD points to, without calling git."""
+    with open(os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        raise ContributionArtError(f"HEAD is detached in '{git_dir}'. Check out a branch before painting.")
+    return head[5:]
+
+def read_ref(git_dir, ref):
+    """Returns the object id a ref points to (loose or packed), or None if it does not exist."""
+    ref_path = os.path.join(git_dir, *ref.split('/'))
+    if os.path.isfile(ref_path):
+        with open(ref_path) as f:
+            return f.read().strip() or None
+    packed_refs = os.path.join(git_dir, "packed-refs")
+    if os.path.isfile(packed_refs):
+        with open(packed_refs) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref and not line.startswith(('#', '^')):
+                    return parts[0]
+    return None
+
+def write_ref(git_dir, ref, sha, old_sha=None):
+    """
+    Points a ref at an object id, replacing the ref file atomically under git's lock file
+    protocol. With 'old_sha' this is a compare-and-swap: the ref must still point at old_sha
+    (NULL_SHA: must not exist yet). A lock held by another process is waited for with backoff.
+    Raises ContributionArtError if the ref stays locked or has moved.
+    """
+    ref_path = os.path.join(git_dir, *ref.split('/'))
+    os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+    lock_path = ref_path + ".lock"
+    for attempt in range(1, GIT_RETRY_ATTEMPTS + 1):
+        try:
+            f = open(lock_path, "x")
+            break
+        except FileExistsError:
+            if attempt == GIT_RETRY_ATTEMPTS:
+                raise ContributionArtError(f"{ref} is locked by another process ('{lock_path}' exists).")
+            METRICS.count('git_retries')
+            time.sleep(get_retry_delay(attempt))
+    try:
+        with f:
+            if old_sha is not None:
+                current_sha = read_ref(git_dir, ref) or NULL_SHA
+                if current_sha != old_sha:
+                    raise ContributionArtError(f"{ref} points at {current_sha}, expected {old_sha}.")
+            f.write(sha + "\n")
+        os.replace(lock_path, ref_path)
+    except BaseException:
+        os.remove(lock_path)
+        raise
+
+def read_git_config(repo_path, section, key):
+    """
+    Reads a single value from the global and repository Git config files, without calling git.
+    Later files win, like git's own lookup order. Returns None if the key is not set.
+    """
+    home = os.path.expanduser("~")
+    xdg_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(home, ".config")
+    paths = [os.path.join(xdg_home, "git", "config"), os.path.join(home, ".gitconfig")]
+    if repo_path:
+        try:
+            paths.append(os.path.join(get_git_dir(repo_path), "config"))
+        except ContributionArtError:
+            pass
+
+    value = None
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        current_section = None
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in '#;':
+                    continue
+                if line.startswith('['):
+                    current_section = line[1:line.index(']')].split()[0].lower()
+                    continue
+                name, _, raw_value = line.partition('=')
+                if current_section == section and name.strip().lower() == key:
+                    value = raw_value.strip().strip('"')
+    return value
+
+def get_native_ident(repo_path, kind='AUTHOR'):
+    """Returns 'Name <email>' from the GIT_* environment variables or the Git config files."""
+    name = os.environ.get(f'GIT_{kind}_NAME') or read_git_config(repo_path, 'user', 'name')
+    email = os.environ.get(f'GIT_{kind}_EMAIL') or read_git_config(repo_path, 'user', 'email')
+    if not name or not email:
+        raise ContributionArtError(f"Could not determine the Git {kind.lower()} identity. Set user.name and user.email.")
+    return f"{name} <{email}>"
+
+def apply_delta(base, delta):
+    """Rebuilds an object from its delta base and a packfile delta."""
+    pos = 0
+    # Skip the source and target size varints
+    for _ in range(2):
+        while delta[pos] & 0x80:
+            pos += 1
+        pos += 1
+    out = bytearray()
+    while pos < len(delta):
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:
+            # Copy a range from the base object
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (1 << (4 + i)):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        else:
+            # Insert literal bytes
+            out += delta[pos:pos + opcode]
+            pos += opcode
+    return bytes(out)
+
+def encode_delta_size(size):
+    """A size varint of a delta header: 7 bits per byte, least significant first."""
+    out = bytearray()
+    while size > 0x7f:
+        out.append(0x80 | (size & 0x7f))
+        size >>= 7
+    out.append(size)
+    return bytes(out)
+
+def make_delta(base, target):
+    """
+    Builds a packfile delta that turns 'base' into 'target' (the inverse of apply_delta).
+    Lines are compared in place: each target line copies the start and end it shares with the
+    base line at the same position and inserts the rest. That is linear and close to optimal for
+    objects that only differ inside fixed lines, like consecutive commits of a painted history.
+    """
+    ops = bytearray(encode_delta_size(len(base)) + encode_delta_size(len(target)))
+    literal = bytearray()
+    copy_offset = copy_size = 0 # The pending copy from the base
+
+    def flush():
+        nonlocal copy_offset, copy_size
+        for start in range(0, len(literal), 0x7f):
+            chunk = literal[start:start + 0x7f]
+            ops.append(len(chunk))
+            ops.extend(chunk)
+        literal.clear()
+        while copy_size:
+            size = min(copy_size, 0xffffff)
+            opcode, args = 0x80, bytearray()
+            for i in range(4):
+                if (copy_offset >> (8 * i)) & 0xff:
+                    opcode |= 1 << i
+                    args.append((copy_offset >> (8 * i)) & 0xff)
+            for i in range(3):
+                if (size >> (8 * i)) & 0xff:
+                    opcode |= 1 << (4 + i)
+                    args.append((size >> (8 * i)) & 0xff)
+            ops.append(opcode)
+            ops.extend(args)
+            copy_offset, copy_size = copy_offset + size, copy_size - size
+
+    def copy(offset, size):
+        nonlocal copy_offset, copy_size
+        if copy_size and not literal and copy_offset + copy_size == offset:
+            copy_size += size # Continues the pending copy for free
+        elif size < 4:
+            insert(base[offset:offset + size]) # A copy op would cost more
+        else:
+            flush()
+            copy_offset, copy_size = offset, size
+
+    def insert(data):
+        if copy_size:
+            flush()
+        literal.extend(data)
+
+    base_lines = base.splitlines(keepends=True)
+    base_offset = 0
+    for i, line in enumerate(target.splitlines(keepends=True)):
+        if i >= len(base_lines):
+            insert(line)
+            continue
+        base_line = base_lines[i]
+        if line == base_line:
+            copy(base_offset, len(line))
+            base_offset += len(base_line)
+            continue
+        shortest = min(len(base_line), len(line))
+        prefix = 0
+        while prefix < shortest and base_line[prefix] == line[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < shortest - prefix and base_line[-1 - suffix] == line[-1 - suffix]:
+            suffix += 1
+        if prefix:
+            copy(base_offset, prefix)
+        insert(line[prefix:len(line) - suffix])
+        if suffix:
+            copy(base_offset + len(base_line) - suffix, suffix)
+        base_offset += len(base_line)
+    flush()
+    return bytes(ops)
+
+def encode_pack_entry_header(type_code, size):
+    """The type and size header of a packfile entry."""
+    header = bytearray()
+    byte = (type_code << 4) | (size & 0x0f)
+    size >>= 4
+    while size:
+        header.append(byte | 0x80)
+        byte = size & 0x7f
+        size >>= 7
+    header.append(byte)
+    return bytes(header)
+
+def encode_delta_offset(distance):
+    """The base distance of an OFS_DELTA entry (the inverse of read_pack_entry's decoding)."""
+    out = bytearray([distance & 0x7f])
+    distance >>= 7
+    while distance:
+        distance -= 1
+        out.insert(0, 0x80 | (distance & 0x7f))
+        distance >>= 7
+    return bytes(out)
+
+def read_delta_base(pack_file, offset, git_dir):
+    """read_pack_entry for a delta base, through delta_base_cache: neighbouring objects share most of their chain."""
+    key = (pack_file.name, offset)
+    entry = delta_base_cache.get(key)
+    if entry is None:
+        entry = read_pack_entry(pack_file, offset, git_dir)
+        delta_base_cache[key] = entry
+        if len(delta_base_cache) > DELTA_BASE_CACHE_SIZE:
+            delta_base_cache.popitem(last=False)
+    else:
+        delta_base_cache.move_to_end(key)
+    return entry
+
+def read_pack_entry(pack_file, offset, git_dir):
+    """Reads (type, content) of the object stored at 'offset' in an open packfile."""
+    pack_file.seek(offset)
+    header = pack_file.read(32)
+    byte = header[0]
+    obj_type = (byte >> 4) & 7
+    pos = 1
+    while byte & 0x80:
+        byte = header[pos]
+        pos += 1
+
+    base = None
+    if obj_type == PACK_OFS_DELTA:
+        byte = header[pos]
+        pos += 1
+        base_distance = byte & 0x7f
+        while byte & 0x80:
+            byte = header[pos]
+            pos += 1
+            base_distance = ((base_distance + 1) << 7) | (byte & 0x7f)
+        base = read_delta_base(pack_file, offset - base_distance, git_dir)
+    elif obj_type == PACK_REF_DELTA:
+        base = read_object(git_dir, header[pos:pos + 20].hex())
+        pos += 20
+
+    pack_file.seek(offset + pos)
+    decompressor = zlib.decompressobj()
+    data = b""
+    while not decompressor.eof:
+        chunk = pack_file.read(65536)
+        if not chunk:
+            break
+        data += decompressor.decompress(chunk)
+
+    if base is not None:
+        return base[0], apply_delta(base[1], data)
+    return PACK_TYPE_NAMES[obj_type], data
+
+@functools.lru_cache(maxsize=16)
+def load_pack_index(idx_path):
+    """Reads a pack index. Pack files are named after their checksum, so their contents never change."""
+    with open(idx_path, "rb") as f:
+        return f.read()
+
+def read_pack_index_names(idx_path):
+    """Returns the ids of all objects in a version 2 pack index."""
+    idx = load_pack_index(idx_path)
+    total = struct.unpack(">I", idx[8 + 255 * 4:8 + 1024])[0]
+    names = idx[8 + 1024:8 + 1024 + total * 20]
+    return [names[i:i + 20].hex() for i in range(0, len(names), 20)]
+
+def find_in_pack_index(idx_path, sha):
+    """Looks an object id up in a version 2 pack index. Returns its pack offset or None."""
+    binary_sha = bytes.fromhex(sha)
+    idx = load_pack_index(idx_path)
+    if idx[:4] != b'\xfftOc' or struct.unpack(">I", idx[4:8])[0] != 2:
+        return None
+    fanout = struct.unpack(">256I", idx[8:8 + 1024])
+    total = fanout[255]
+    low = fanout[binary_sha[0] - 1] if binary_sha[0] else 0
+    high = fanout[binary_sha[0]]
+    names_start = 8 + 1024
+    while low < high:
+        mid = (low + high) // 2
+        candidate = idx[names_start + mid * 20:names_start + mid * 20 + 20]
+        if candidate == binary_sha:
+            offsets_start = names_start + total * 24
+            offset = struct.unpack(">I", idx[offsets_start + mid * 4:offsets_start + mid * 4 + 4])[0]
+            if offset & 0x80000000:
+                large_start = offsets_start + total * 4
+                large_index = offset & 0x7fffffff
+                offset = struct.unpack(">Q", idx[large_start + large_index * 8:large_start + large_index * 8 + 8])[0]
+            return offset
+        if candidate < binary_sha:
+            low = mid + 1
+        else:
+            high = mid
+    return None
+
+def read_object(git_dir, sha):
+    """Reads (type, content) of an object from the loose object store or any packfile."""
+    loose_path = os.path.join(git_dir, "objects", sha[:2], sha[2:])
+    if os.path.isfile(loose_path):
+        with open(loose_path, "rb") as f:
+            raw = zlib.decompress(f.read())
+        header, _, content = raw.partition(b"\0")
+        return header.split(b" ")[0].decode('ascii'), content
+
+    pack_dir = os.path.join(git_dir, "objects", "pack")
+    if os.path.isdir(pack_dir):
+        for name in os.listdir(pack_dir):
+            if not name.endswith(".idx"):
+                continue
+            offset = find_in_pack_index(os.path.join(pack_dir, name), sha)
+            if offset is not None:
+                with open(os.path.join(pack_dir, name[:-4] + ".pack"), "rb") as pack_file:
+                    return read_pack_entry(pack_file, offset, git_dir)
+    raise ContributionArtError(f"Object {sha} not found in '{git_dir}'.")
+
+def write_loose_object(git_dir, obj_type, content):
+    """Writes an object into '.git/objects' (if not already present) and returns its id."""
+    sha, raw = hash_object(obj_type, content)
+    object_dir = os.path.join(git_dir, "objects", sha[:2])
+    object_path = os.path.join(object_dir, sha[2:])
+    if not os.path.exists(object_path):
+        os.makedirs(object_dir, exist_ok=True)
+        tmp_path = f"{object_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(raw, 1))
+        os.replace(tmp_path, object_path)
+    return sha
+
+
+class PackWriter:
+    """
+    Streams objects into a single version 2 packfile and writes its .idx on close.
+    Objects are stored whole unless a delta base is given; the object count in the header
+    is patched in once all objects are known. 'compression' is the zlib level.
+    """
+
+    def __init__(self, pack_dir, compression=1):
+        self.pack_dir = pack_dir
+        self.compression = compression
+        import tempfile
+
+        os.makedirs(self.pack_dir, exist_ok=True)
+        # A name of its own: several writers (a cache store, a compaction) may be open in one process
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.pack_dir, prefix="tmp_pack_")
+        self.file = os.fdopen(fd, "w+b")
+        self.file.write(b"PACK" + struct.pack(">II", 2, 0))
+        self.entries = [] # (binary sha, crc32, offset)
+        self.offsets = {}
+
+    def add(self, obj_type, content, base=None):
+        """
+        Appends an object to the pack and returns its id. With 'base', the (sha, content) of an
+        object already in this pack, the object is stored as a delta against it if that is smaller.
+        """
+        sha, _ = hash_object(obj_type, content)
+        if sha in self.offsets:
+            return sha
+        offset = self.file.tell()
+        self.offsets[sha] = offset
+
+        entry = None
+        if base is not None:
+            delta = make_delta(base[1], content)
+            if len(delta) < len(content):
+                entry = (encode_pack_entry_header(PACK_OFS_DELTA, len(delta)) + encode_delta_offset(offset - self.offsets[base[0]])
+                         + zlib.compress(delta, self.compression))
+        if entry is None:
+            entry = encode_pack_entry_header(PACK_TYPE_CODES[obj_type], len(content)) + zlib.compress(content, self.compression)
+
+        self.entries.append((bytes.fromhex(sha), zlib.crc32(entry), offset))
+        self.file.write(entry)
+        return sha
+
+    def close(self):
+        """Finishes the pack, writes the index next to it and returns the pack checksum."""
+        import hashlib
+
+        self.file.seek(8)
+        self.file.write(struct.pack(">I", len(self.entries)))
+        self.file.seek(0)
+        pack_hash = hashlib.sha1()
+        for chunk in iter(lambda: self.file.read(1 << 20), b""):
+            pack_hash.update(chunk)
+        pack_checksum = pack_hash.digest()
+        self.file.write(pack_checksum)
+        self.file.close()
+
+        entries = sorted(self.entries)
+        fanout = [0] * 256
+        for binary_sha, _, _ in entries:
+            fanout[binary_sha[0]] += 1
+        for i in range(1, 256):
+            fanout[i] += fanout[i - 1]
+
+        large_offsets = []
+        offset_table = bytearray()
+        for _, _, offset in entries:
+            if offset < 0x80000000:
+                offset_table += struct.pack(">I", offset)
+            else:
+                offset_table += struct.pack(">I", 0x80000000 | len(large_offsets))
+                large_offsets.append(offset)
+
+        idx = bytearray(b'\xfftOc' + struct.pack(">I", 2))
+        idx += struct.pack(">256I", *fanout)
+        idx += b"".join(binary_sha for binary_sha, _, _ in entries)
+        idx += b"".join(struct.pack(">I", crc) for _, crc, _ in entries)
+        idx += offset_table
+        idx += b"".join(struct.pack(">Q", offset) for offset in large_offsets)
+        idx += pack_checksum
+        idx += hashlib.sha1(idx).digest()
+
+        # Like git, the pack goes into place first and the index last: an index without its
+        # pack is a broken pack to git, while a pack without an index is simply ignored
+        base_name = os.path.join(self.pack_dir, f"pack-{pack_checksum.hex()}")
+        idx_tmp_path = self.tmp_path + ".idx"
+        with open(idx_tmp_path, "wb") as f:
+            f.write(idx)
+        os.replace(self.tmp_path, base_name + ".pack")
+        os.replace(idx_tmp_path, base_name + ".idx")
+        return pack_checksum.hex()
+
+    def abort(self):
+        """Throws the unfinished pack away."""
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class NativeObjectWriter:
+    """
+    Writes commits without invoking git: each commit object is hashed and compressed
+    in-process, chained onto its parent and reuses the parent's tree. Objects go to the
+    loose object store, or into one packfile when 'pack' is True. The commits are
+    published through the transaction once, on close.
+    """
+
+    def __init__(self, repo_path, transaction, verbose=False, pack=False, seed=None, compact=False):
+        self.repo_path = os.path.abspath(repo_path)
+        self.transaction = transaction
+        self.verbose = verbose
+        self.seed = seed
+        self.compact = compact
+        self.git_dir = get_git_dir(self.repo_path)
+        self.ref = transaction.scratch_ref
+        self.parent = transaction.base
+        self.author = get_native_ident(self.repo_path, 'AUTHOR')
+        self.committer = get_native_ident(self.repo_path, 'COMMITTER')
+        self.pack = PackWriter(os.path.join(self.git_dir, "objects", "pack")) if pack else None
+        self.commits_written = 0
+
+        if self.parent:
+            obj_type, content = read_object(self.git_dir, self.parent)
+            self.tree = content[5:45].decode('ascii') # 'tree <sha>' is always the first line
+        else:
+            self.tree = self.write_object('tree', b"")
+
+    def write_object(self, obj_type, content):
+        if self.pack:
+            return self.pack.add(obj_type, content)
+        return write_loose_object(self.git_dir, obj_type, content)
+
+    def add_commit(self, date_str, message):
+        """Writes a single commit object on top of the previous one."""
+        raw_date = format_raw_date(date_str)
+        lines = [f"tree {self.tree}"]
+        if self.parent:
+            lines.append(f"parent {self.parent}")
+        lines.append(f"author {self.author} {raw_date}")
+        lines.append(f"committer {self.committer} {raw_date}")
+        content = ("\n".join(lines) + "\n\n" + message + "\n").encode('utf-8')
+        self.parent = self.write_object('commit', content)
+        self.commits_written += 1
+
+    def write_dot(self, commit_date, commits_per_dot, message_suffix=""):
+        for i, date_str in enumerate(make_commit_times(commit_date, commits_per_dot, self.seed)):
+            self.add_commit(date_str, format_commit_message(message_suffix, i + 1, commits_per_dot, self.compact))
+            if self.verbose:
+                print(f"  Commit {i+1}/{commits_per_dot} written for {date_str}")
+        METRICS.count('commits_written', commits_per_dot)
+        return True
+
+    def close(self):
+        """Finishes the pack (if any) and publishes the last commit to the branch."""
+        try:
+            if self.pack:
+                pack_name = self.pack.close()
+                if self.verbose:
+                    print(f"DEBUG: Wrote pack-{pack_name}.pack", flush=True)
+            if self.commits_written:
+                write_ref(self.git_dir, self.ref, self.parent)
+        except (OSError, ContributionArtError) as e:
+            print(f"Error: Could not finish writing objects to '{self.git_dir}': {e}", flush=True)
+            self.transaction.abort()
+            return False
+        if self.verbose:
+            print(f"DEBUG: Native writer wrote {self.commits_written} commits to {self.ref}", flush=True)
+        if not self.commits_written:
+            self.transaction.abort()
+            return True
+        return self.transaction.publish(self.parent)
+
+    def abort(self):
+        """Discards the unfinished pack (loose objects stay unreferenced) and the scratch ref."""
+        if self.pack:
+            self.pack.abort()
+        self.transaction.abort()
+
+
+def write_index(git_dir, repo_path, entries):
+    """
+    Writes a version 2 '.git/index' for files at the top of the work tree.
+    'entries' is a list of (path, blob sha); stat data is taken from the files on disk.
+    """
+    import hashlib
+
+    body = bytearray(b"DIRC" + struct.pack(">II", 2, len(entries)))
+    for path, sha in sorted(entries):
+        st = os.stat(os.path.join(repo_path, path))
+        name = path.encode('utf-8')
+        entry = struct.pack(
+            ">10I", int(st.st_ctime) & 0xffffffff, 0, int(st.st_mtime) & 0xffffffff, 0,
+            st.st_dev & 0xffffffff, st.st_ino & 0xffffffff, 0o100644,
+            st.st_uid & 0xffffffff, st.st_gid & 0xffffffff, st.st_size & 0xffffffff
+        )
+        entry += bytes.fromhex(sha) + struct.pack(">H", min(len(name), 0xfff)) + name
+        # Entries are NUL-padded to a multiple of 8 bytes (at least one NUL)
+        entry += b"\0" * (8 - len(entry) % 8)
+        body += entry
+    body += hashlib.sha1(body).digest()
+    with open(os.path.join(git_dir, "index"), "wb") as f:
+        f.write(body)
+
+def init_repo_native(repo_path):
+    """Creates an empty '.git' directory by hand, without calling 'git init'."""
+    git_dir = os.path.join(repo_path, ".git")
+    for sub_dir in ("objects/info", "objects/pack", "refs/heads", "refs/tags"):
+        os.makedirs(os.path.join(git_dir, sub_dir), exist_ok=True)
+    branch = read_git_config(None, 'init', 'defaultbranch') or 'master'
+    with open(os.path.join(git_dir, "HEAD"), "w") as f:
+        f.write(f"ref: refs/heads/{branch}\n")
+    with open(os.path.join(git_dir, "config"), "w") as f:
+        f.write("[core]\n\trepositoryformatversion = 0\n\tfilemode = true\n\tbare = false\n\tlogallrefupdates = true\n")
+    with open(os.path.join(git_dir, "description"), "w") as f:
+        f.write("Unnamed repository; edit this file 'description' to name the repository.\n")
+
+def create_initial_commit_native(repo_path, readme_path, date_str, message):
+    """Commits README.md as the root commit, writing objects, the ref and the index by hand."""
+    git_dir = get_git_dir(repo_path)
+    with open(readme_path, "rb") as f:
+        blob_sha = write_loose_object(git_dir, 'blob', f.read())
+    tree_sha = write_loose_object(git_dir, 'tree', b"100644 README.md\0" + bytes.fromhex(blob_sha))
+    raw_date = format_raw_date(date_str)
+    content = (
+        f"tree {tree_sha}\n"
+        f"author {get_native_ident(repo_path, 'AUTHOR')} {raw_date}\n"
+        f"committer {get_native_ident(repo_path, 'COMMITTER')} {raw_date}\n"
+        f"\n{message}\n"
+    ).encode('utf-8')
+    commit_sha = write_loose_object(git_dir, 'commit', content)
+    write_ref(git_dir, read_head_ref(git_dir), commit_sha)
+    write_index(git_dir, repo_path, [("README.md", blob_sha)])
+    return commit_sha
+
+
+# --- Paint Transactions ---
+# Writers never commit onto the checked-out branch directly. Each run builds its commits on a
+# scratch ref of its own, without touching HEAD, the index or the work tree. Only a complete run
+# moves the branch, with one compare-and-swap from the tip the run started on. A failed run just
+# deletes its scratch ref, so the branch is never left half painted, and painters running
+# against the same repository cannot overwrite each other's commits.
+
+SCRATCH_REF_PREFIX = 'refs/contribution-art/'
+NULL_SHA = '0' * 40
+
+class PaintTransaction:
+    """
+    The scratch ref of one paint run and the branch it is published to ('branch_ref', or the
+    branch HEAD points to). 'base' is the commit the new history starts from: the branch tip,
+    or None for an 'orphan' history that replaces the branch.
+    Native transactions (for the native backends) read and move refs without running git.
+    A 'staged' transaction's publish only points the scratch ref at the painted tip; the
+    branch moves later, with publish_staged, once every part of a larger run is painted.
+    """
+
+    def __init__(self, repo_path, native=False, verbose=False, branch_ref=None, orphan=False, staged=False):
+        self.repo_path = os.path.abspath(repo_path)
+        self.native = native
+        self.verbose = verbose
+        if native:
+            self.git_dir = get_git_dir(self.repo_path)
+            self.branch_ref = branch_ref or read_head_ref(self.git_dir)
+            self.old_tip = read_ref(self.git_dir, self.branch_ref)
+        else:
+            self.branch_ref = branch_ref or get_branch_ref(self.repo_path)
+            self.old_tip = query_git(['git', 'rev-parse', '--verify', '-q', self.branch_ref], self.repo_path)
+        self.base = None if orphan else self.old_tip
+        self.staged = staged
+        self.staged_tip = None
+        self.published_tip = None
+        self.scratch_ref = f"{SCRATCH_REF_PREFIX}paint-{os.getpid()}-{time.time_ns():x}"
+
+    def publish(self, tip):
+        """
+        Moves the branch from its tip at the start of the run to 'tip' in one atomic
+        compare-and-swap and drops the scratch ref. If the branch moved in the meantime
+        nothing is changed. Returns True on success.
+        """
+        if self.staged:
+            return self.stage(tip)
+        old_sha = self.old_tip or NULL_SHA
+        try:
+            if self.native:
+                write_ref(self.git_dir, self.branch_ref, tip, old_sha)
+            else:
+                run_git_command(['git', 'update-ref', '-m', 'contribution art', self.branch_ref, tip, old_sha],
+                                self.repo_path, verbose=self.verbose, fatal=True)
+        except ContributionArtError as e:
+            print(f"Error: Could not move {self.branch_ref} to the painted commits: {e}", flush=True)
+            print("The branch changed while painting (or is locked). Nothing was published; run the painter again.", flush=True)
+            self.abort()
+            return False
+        if self.verbose:
+            print(f"DEBUG: Moved {self.branch_ref} from {self.old_tip or 'nothing'} to {tip}", flush=True)
+        self.published_tip = tip
+        self.abort() # The scratch ref is no longer needed
+        return True
+
+    def stage(self, tip):
+        """Points the scratch ref at 'tip', keeping the commits for publish_staged. Returns True on success."""
+        try:
+            if self.native:
+                write_ref(self.git_dir, self.scratch_ref, tip)
+            else:
+                run_git_command(['git', 'update-ref', self.scratch_ref, tip], self.repo_path, verbose=self.verbose, fatal=True)
+        except ContributionArtError as e:
+            print(f"Error: Could not keep the painted commits on {self.scratch_ref}: {e}", flush=True)
+            self.abort()
+            return False
+        self.staged_tip = tip
+        return True
+
+    def publish_staged(self, tip):
+        """Publishes a tip staged by this transaction (or by a copy of it in a worker process)."""
+        self.staged = False
+        return self.publish(tip)
+
+    def abort(self):
+        """Drops the scratch ref. The branch is left as it was."""
+        self.delete_ref(self.scratch_ref)
+
+    def delete_ref(self, ref):
+        """Deletes a loose ref of this repository (missing refs are ignored)."""
+        if self.native:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.git_dir, *ref.split('/')))
+        else:
+            query_git(['git', 'update-ref', '-d', ref], self.repo_path)
+
+    def create_merge(self, parents, date_str, message):
+        """
+        Writes a merge commit of 'parents' that keeps the first parent's tree, dated 'date_str'.
+        Returns its id, or None if git failed.
+        """
+        if not self.native:
+            tree = query_git(['git', 'rev-parse', f'{parents[0]}^{{tree}}'], self.repo_path)
+            env = os.environ.copy()
+            env['GIT_AUTHOR_DATE'] = date_str
+            env['GIT_COMMITTER_DATE'] = date_str
+            command = ['git', 'commit-tree', tree, '-m', message]
+            for parent in parents:
+                command += ['-p', parent]
+            result = run_git_command(command, self.repo_path, env=env, verbose=self.verbose)
+            return result.stdout.strip() if result else None
+
+        _, first_parent = read_object(self.git_dir, parents[0])
+        raw_date = format_raw_date(date_str)
+        lines = [f"tree {first_parent[5:45].decode('ascii')}"] + [f"parent {parent}" for parent in parents]
+        lines.append(f"author {get_native_ident(self.repo_path, 'AUTHOR')} {raw_date}")
+        lines.append(f"committer {get_native_ident(self.repo_path, 'COMMITTER')} {raw_date}")
+        return write_loose_object(self.git_dir, 'commit', ("\n".join(lines) + "\n\n" + message + "\n").encode('utf-8'))
+
+
+def open_commit_writer(backend, repo_path, verbose=False, branch_ref=None, orphan=False, seed=None, compact=False, transaction=None):
+    """
+    Returns the commit writer for the chosen backend, inside a new PaintTransaction that
+    publishes to 'branch_ref' (default: the checked-out branch), or inside 'transaction' if
+    one is given. A 'seed' makes the commit times, and so the commits, reproducible (see
+    make_commit_times). 'compact' gives every commit the same short message (see format_commit_message).
+    """
+    native = backend in ('native', 'native-pack')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    if transaction is None:
+        transaction = PaintTransaction(repo_path, native=native, verbose=verbose, branch_ref=branch_ref, orphan=orphan)
+    if backend == 'commit':
+        return CommitCommandWriter(repo_path, transaction, verbose=verbose, seed=seed, compact=compact)
+    if backend == 'fast-import':
+        return FastImportWriter(repo_path, transaction, verbose=verbose, seed=seed, compact=compact)
+    return NativeObjectWriter(repo_path, transaction, verbose=verbose, pack=(backend == 'native-pack'), seed=seed, compact=compact)
+
+# --- Core Logic ---
+
+# --- Calendar Index ---
+# A graph window is either a calendar year or GitHub's rolling "last year" profile view.
+# Each window is indexed once into a (column, row) -> date table and its reverse, so layout
+# and planning only do table reads.
+
+ROLLING_WINDOW = 'rolling' # Accepted wherever a year is, for the profile's rolling view
+
+def get_sunday_on_or_before(day):
+    """Returns the Sunday that starts the graph week containing 'day'."""
+    # weekday() returns 0 for Monday, 6 for Sunday.
+    # We want the offset from Sunday (0). (day.weekday() + 1) % 7 gives Sunday=0, Monday=1, etc.
+    return day - timedelta(days=(day.weekday() + 1) % 7)
+
+class GraphCalendar:
+    """
+    The date of every cell of one graph window. Cells outside the window (before Jan 1 or
+    after Dec 31 of a year, or after the last day of a rolling window) map to None.
+    """
+    __slots__ = ('label', 'start', 'first', 'last', 'width', 'dates', 'positions')
+
+    def __init__(self, label, first, last, width=GRAPH_COLS):
+        self.label = label
+        self.first = first
+        self.last = last
+        self.start = get_sunday_on_or_before(first) # Sunday of column 0
+        self.width = width
+        self.dates = []
+        self.positions = {}
+        for index in range(width * GRAPH_ROWS):
+            day = self.start + timedelta(days=index)
+            if first <= day <= last:
+                self.dates.append(day)
+                self.positions[day] = divmod(index, GRAPH_ROWS)
+            else:
+                self.dates.append(None)
+
+    def date_at(self, col, row):
+        """Returns the date of a cell, or None if the cell is outside the window."""
+        return self.dates[col * GRAPH_ROWS + row]
+
+    def position(self, day):
+        """Returns (col, row) of a date, or None if the date is not shown."""
+        return self.positions.get(day)
+
+@functools.lru_cache(maxsize=64)
+def build_calendar(year, end_date):
+    if year == ROLLING_WINDOW:
+        # The profile shows the current week plus the 52 full weeks before it
+        start = get_sunday_on_or_before(end_date) - timedelta(weeks=GRAPH_COLS - 1)
+        return GraphCalendar(f"last year (to {end_date})", start, end_date)
+    return GraphCalendar(str(year), date(year, 1, 1), date(year, 12, 31))
+
+def get_calendar(year, end_date=None):
+    """
+    Returns the cached GraphCalendar for a year, or for the rolling window ending on
+    'end_date' (default: today) when 'year' is ROLLING_WINDOW.
+    """
+    if year == ROLLING_WINDOW:
+        return build_calendar(year, end_date or date.today())
+    return build_calendar(int(year), None)
+
+def get_initial_commit(year):
+    """
+    The (README text, date string, message) of a new repository's initial commit. It is dated
+    slightly before the graph window starts, so it never shows up in the art.
+    """
+    initial_commit_date = get_calendar(year).first - timedelta(days=3)
+    readme_text = f"# GitHub Contribution Art\n\nRepository initialized for GitHub contribution art ({year}).\nGenerated by script.\n"
+    return readme_text, f"{initial_commit_date.isoformat()} 12:00:00", f'Initial commit ({year})'
+
+@timed_phase('init')
+def initialize_repo(repo_path, year, verbose=False, backend='commit'):
+    """
+    Initializes a Git repository at the specified path if it doesn't exist.
+    Creates the directory if necessary.
+    Adds an initial commit if the repository is empty.
+    With a native backend the repository is set up without invoking git.
+    """
+    print("\n--- Initializing Repository ---", flush=True)
+    repo_path = os.path.abspath(repo_path) # Ensure we have an absolute path
+
+    # Create directory if it doesn't exist
+    if not os.path.exists(repo_path):
+        try:
+            os.makedirs(repo_path)
+            print(f"Created directory: {repo_path}", flush=True)
+        except OSError as e:
+            raise ContributionArtError(f"Could not create directory: {repo_path} ({e})")
+    elif not os.path.isdir(repo_path):
+         raise ContributionArtError(f"The specified path '{repo_path}' exists but is not a directory.")
+
+    git_dir = os.path.join(repo_path, ".git")
+    native = backend in ('native', 'native-pack')
+
+    # Initialize Git repo if .git directory doesn't exist
+    if not os.path.isdir(git_dir):
+        print("'.git' directory not found. Initializing a new Git repository...", flush=True)
+        if native:
+            init_repo_native(repo_path)
+        else:
+            run_git_command(['git', 'init'], repo_path=repo_path, verbose=verbose, fatal=True)
+    else:
+        if verbose: print("Existing '.git' directory found.", flush=True)
+
+    # Check if the repository has any commits
+    try:
+        if native:
+            has_commits = read_ref(git_dir, read_head_ref(git_dir)) is not None
+        else:
+            # rev-parse HEAD fails in an empty repo
+            has_commits = query_git(['git', 'rev-parse', '--verify', '-q', 'HEAD'], repo_path) is not None
+    except Exception as e:
+        print(f"Error checking for existing commits: {e}", flush=True)
+        # Decide if we should continue or exit? Let's try to continue.
+        has_commits = True
+    if verbose:
+        print("Repository already has commits." if has_commits else "No existing commits found (or HEAD is unborn).", flush=True)
+
+    # Create an initial commit if the repository is empty
+    if not has_commits:
+        print("Creating an initial commit...", flush=True)
+        readme_path = os.path.join(repo_path, "README.md")
+        try:
+            # Create a simple README.md
+            readme_text, initial_date_str, initial_message = get_initial_commit(year)
+            initial_commit_date = date.fromisoformat(initial_date_str[:10])
+            with open(readme_path, "w") as f:
+                f.write(readme_text)
+            if verbose: print(f"Created {readme_path}", flush=True)
+
+            if native:
+                create_initial_commit_native(repo_path, readme_path, initial_date_str, initial_message)
+                print(f"Initial commit created for date {initial_commit_date.isoformat()}.", flush=True)
+            else:
+                # Add the README
+                add_result = run_git_command(['git', 'add', 'README.md'], repo_path=repo_path, verbose=verbose)
+                if not add_result:
+                     print("Failed to git add README.md. Cannot create initial commit.", flush=True)
+                     # Consider cleanup? For now, we might continue, but painting will likely fail.
+                else:
+                    env = os.environ.copy()
+                    env['GIT_AUTHOR_DATE'] = initial_date_str
+                    env['GIT_COMMITTER_DATE'] = initial_date_str
+
+                    commit_result = run_git_command(
+                        ['git', 'commit', '-m', initial_message],
+                        repo_path=repo_path,
+                        env=env,
+                        verbose=verbose,
+                        fatal=True
+                    )
+                    if commit_result:
+                        print(f"Initial commit created for date {initial_commit_date.isoformat()}.", flush=True)
+                    else:
+                        # Stop here as subsequent commits will likely fail without a HEAD
+                        raise ContributionArtError("Failed to create initial commit.")
+
+        except ContributionArtError:
+            raise
+        except Exception as e:
+            raise ContributionArtError(f"Error creating initial commit files: {e}") from e
+    else:
+        print("Repository is not empty. Skipping initial commit.", flush=True)
+
+    print("--- Initialization Complete ---", flush=True)
+
+
+# --- Intensity Shading ---
+# GitHub shades a day relative to the busiest day shown: with a peak of M commits, a day with
+# c > 0 commits gets level ceil(4c / M) (1-4). The shading engine picks the peak M and the
+# smallest number of commits to add per day so that every painted cell lands on its target
+# level on top of the existing (baseline) activity, instead of a flat commits_per_dot.
+
+def count_to_level(count, max_count):
+    """Returns the graph level (0-4) of a day with 'count' commits when the busiest day has 'max_count'."""
+    if count <= 0 or max_count <= 0:
+        return 0
+    return min(MAX_LEVEL, -(-MAX_LEVEL * count // max_count))
+
+def level_range(level, max_count):
+    """Returns the (lowest, highest) commit count that shows as 'level' for the given peak."""
+    lowest = (level - 1) * max_count // MAX_LEVEL + 1
+    highest = level * max_count // MAX_LEVEL
+    return lowest, highest
+
+def shade_counts(target_levels, baseline, window_dates):
+    """
+    Computes the commits to add per day so that each date in 'target_levels' ({date: 1-4})
+    shows at its level, given the existing 'baseline' ({date: count}) of the window.
+    Candidate peaks are tried from the busiest existing day upwards; the winner has the fewest
+    wrongly shaded painted cells, then the fewest background days shaded above level 1, then
+    the fewest added commits.
+    Returns ({date: commits to add}, peak).
+    """
+    existing = {day: baseline.get(day, 0) for day in window_dates}
+    background_max = max((count for day, count in existing.items() if day not in target_levels), default=0)
+    lowest_peak = max(max(existing.values(), default=0), 1)
+    # Past 4x the busiest background day every background day is already level 1, and past
+    # 4c/level a painted day with c existing commits is no longer too dark for its level
+    too_dark_peak = max((-(-MAX_LEVEL * existing[day] // level) for day, level in target_levels.items()), default=0)
+    highest_peak = max(lowest_peak, MAX_LEVEL * background_max, too_dark_peak) + MAX_LEVEL
+
+    best = None
+    for peak in range(lowest_peak, highest_peak + 1):
+        additions = {}
+        for day, level in target_levels.items():
+            lowest, highest = level_range(level, peak)
+            if existing[day] < lowest <= highest:
+                additions[day] = lowest - existing[day]
+
+        # Some day has to actually reach the peak, or the shading is relative to a lower one
+        final = {day: existing[day] + additions.get(day, 0) for day in existing}
+        if max(final.values(), default=0) < peak:
+            darkest = [day for day, level in target_levels.items() if level == MAX_LEVEL] or list(target_levels)
+            if not darkest:
+                continue
+            day = max(darkest, key=lambda d: final[d])
+            additions[day] = additions.get(day, 0) + peak - final[day]
+            final[day] = peak
+
+        wrong = sum(1 for day, level in target_levels.items() if count_to_level(final[day], peak) != level)
+        noisy = sum(1 for day, count in final.items() if day not in target_levels and count_to_level(count, peak) > 1)
+        cost = (wrong, noisy, sum(additions.values()))
+        if best is None or cost < best[0]:
+            best = (cost, additions, peak)
+
+    if best is None:
+        return {}, lowest_peak
+    return best[1], best[2]
+
+def load_baseline(baseline_path):
+    """
+    Reads per-day contribution counts from a JSON object ({"YYYY-MM-DD": count}) or a CSV
+    file of 'date,count' rows (a header row is allowed). Returns {date: count}.
+    """
+    import json
+
+    with open(baseline_path, newline='') as f:
+        if baseline_path.lower().endswith('.csv'):
+            import csv
+            rows = [row for row in csv.reader(f) if len(row) >= 2]
+            if rows and not rows[0][1].strip().isdigit():
+                rows = rows[1:] # Skip header
+        else:
+            rows = json.load(f).items()
+        return {date.fromisoformat(str(day).strip()): int(count) for day, count in rows}
+
+# --- Planning & Execution ---
+# A plan is a lazy stream of (date, commit count, message) entries in date order. The planner
+# never touches the repository; the executor pulls entries one at a time and hands them to a
+# commit writer, so even very large plans never sit in memory as a whole.
+
+# Rough per-commit cost of each backend (seconds), used for dry-run estimates
+ESTIMATED_SECONDS_PER_COMMIT = {
+    'commit': 1 / 220,
+    'fast-import': 1 / 9000,
+    'native': 1 / 10000,
+    'native-pack': 1 / 20000,
+}
+
+def plan_commits(grid, year, commits_per_dot, verbose=False, shading_baseline=None):
+    """
+    Returns a generator of (commit_date, count, message) for every painted cell of the grid
+    that falls inside the graph window of 'year' (a year or ROLLING_WINDOW).
+    'message' identifies what painted the dot (a character, or an image column).
+    Without shading a cell at level L gets ceil(commits_per_dot * L / 4) commits. With a
+    'shading_baseline' ({date: existing count}) the counts come from shade_counts instead.
+    """
+    calendar = get_calendar(year)
+    shaded_counts = None
+    if shading_baseline is not None:
+        target_levels = {}
+        for commit_col, row, level in grid.dots():
+            commit_date = calendar.date_at(commit_col, row)
+            if commit_date is not None:
+                target_levels[commit_date] = level
+        shaded_counts, peak = shade_counts(target_levels, shading_baseline, calendar.positions)
+        print(f"Shading: busiest day will have {peak} commits; adding {sum(shaded_counts.values())} commits in total.", flush=True)
+    return iter_grid_plan(grid, calendar, commits_per_dot, verbose, shaded_counts)
+
+def iter_grid_plan(grid, calendar, commits_per_dot, verbose=False, shaded_counts=None):
+    for commit_col, row, level in grid.dots():
+        # Grid rows are graph days (0=Sun ... 6=Sat)
+        commit_date = calendar.date_at(commit_col, row)
+
+        # Crucially, only make commits inside the graph window
+        if commit_date is None:
+            if verbose: print(f"  Skipping cell (Week: {commit_col}, Day: {row}) because it's outside {calendar.label}")
+            continue
+
+        if shaded_counts is None:
+            count = -(-commits_per_dot * level // MAX_LEVEL)
+        else:
+            count = shaded_counts.get(commit_date, 0)
+            if not count:
+                continue # Already at the right shade
+
+        yield commit_date, count, grid.sources[commit_col]
+
+def plan_text(text, year, start_column, commits_per_dot, spacing, verbose=False, shading_baseline=None, font_path=None):
+    """
+    Lays the text out and returns (plan, expected_dots): the lazy commit plan and the number
+    of painted cells it will visit (an upper bound on its length, used for progress).
+    'font_path' selects a BDF/PSF font instead of the built-in CHAR_MAP.
+    """
+    font = load_font(os.path.abspath(font_path)) if font_path else BUILTIN_FONT
+    grid = rasterize_text(text, start_column, spacing, verbose=verbose, font=font)
+    return plan_commits(grid, year, commits_per_dot, verbose=verbose, shading_baseline=shading_baseline), grid.dot_count()
+
+def plan_image(image_path, year, start_column, commits_per_dot, dither=False, invert=False, verbose=False, shading_baseline=None):
+    """Like plan_text, for a Netpbm image downsampled onto the graph (see rasterize_image)."""
+    with open_netpbm(image_path) as image:
+        grid = rasterize_image(image, start_column, dither=dither, invert=invert, verbose=verbose)
+    return plan_commits(grid, year, commits_per_dot, verbose=verbose, shading_baseline=shading_baseline), grid.dot_count()
+
+def iter_marquee_columns(text, start_column, spacing, font=BUILTIN_FONT, verbose=False):
+    """
+    Lays the text out on an endless strip of week columns, one character at a time, instead
+    of on a fixed-width grid. Yields (column, row mask, source) for every non-empty column, in
+    column order. Only the current glyph is held in memory, so the text can be arbitrarily long.
+    """
+    current_col = start_column
+    missing_chars = set()
+    for char_index, char in enumerate(text):
+        glyph = get_glyph(font, ord(char))
+        if glyph is None:
+            if char not in missing_chars:
+                missing_chars.add(char)
+                print(f"Warning: Font {font.name} has no glyph for {char!r}; painted as a space.", flush=True)
+            char = ' '
+            glyph = get_glyph(font, ord(char)) or GLYPHS[char]
+        if verbose:
+            print(f"Placing char '{char}' (Index: {char_index}, Width: {glyph.width}) at column {current_col}", flush=True)
+        for col_offset, mask in enumerate(glyph.columns):
+            if mask:
+                yield current_col + col_offset, mask, f"char='{char}' pos={char_index}"
+        current_col += glyph.width + spacing
+
+def plan_marquee(text, year, start_column, commits_per_dot, spacing, verbose=False, font_path=None):
+    """
+    Like plan_text, but the text does not stop at the edge of the graph: it keeps flowing
+    into the following weeks, across as many years (or rolling windows) as it needs.
+    Returns (plan, None); the plan is a generator in date order whose length is not known
+    up front.
+    """
+    calendar = get_calendar(year)
+    font = load_font(os.path.abspath(font_path)) if font_path else BUILTIN_FONT
+
+    last_column = (date.max - calendar.start).days // GRAPH_ROWS - 1
+
+    def iter_plan():
+        today = date.today()
+        warned_future = False
+        for commit_col, mask, message in iter_marquee_columns(text, start_column, spacing, font, verbose):
+            if commit_col > last_column:
+                print(f"\nWarning: The marquee reached the last date Python can represent ({date.max}); the rest of the text is dropped.", flush=True)
+                return
+            week_start = calendar.start + timedelta(weeks=commit_col)
+            for row in range(GRAPH_ROWS):
+                if not mask >> row & 1:
+                    continue
+                commit_date = week_start + timedelta(days=row)
+                if commit_date < calendar.first:
+                    if verbose: print(f"  Skipping cell (Week: {commit_col}, Day: {row}) because it's before {calendar.first}")
+                    continue
+                if commit_date > today and not warned_future:
+                    warned_future = True
+                    print(f"\nWarning: The marquee runs past today (from {commit_date} on). GitHub only shows those days once they are reached.", flush=True)
+                yield commit_date, commits_per_dot, message
+
+    return iter_plan(), None
+
+def execute_plan(plan, writer, expected_dots=0, verbose=False, checkpoint=None):
+    """
+    Feeds each plan entry to the commit writer and closes it, which publishes the commits.
+    'expected_dots' sizes the progress bar; None shows a running count for plans of unknown length.
+    The run is all or nothing: if a dot fails the writer is aborted and the branch keeps its
+    previous tip. An interrupted run is aborted too, unless a PaintCheckpoint is given: then the
+    finished dots are kept for the next run of the same plan, which resumes from them.
+    Returns the number of commits written; raises UnwrittenDotsError listing the planned
+    work that did not reach the branch if a dot or the backend fails.
+    """
+    total_commits_made = 0
+    dots_done = 0
+    first_date = last_date = None
+    reason = None
+    if checkpoint:
+        plan, dots_done, total_commits_made, first_date = checkpoint.resume(plan)
+    METRICS.start_progress(expected_dots)
+    if dots_done:
+        METRICS.advance(dots_done)
+
+    try:
+        for commit_date, count, message in plan:
+            if first_date is None: first_date = commit_date
+            last_date = commit_date
+            if verbose: print(f"  Target commit date: {commit_date} ({count} commits)")
+            # Create the specified number of commits for this 'dot'
+            if not writer.write_dot(commit_date, count, message_suffix=message):
+                METRICS.count('dot_failures')
+                print(f"Failed making commits for {commit_date}. Stopping; the branch was left unchanged.", flush=True)
+                writer.abort()
+                reason = f"Failed making commits for {commit_date}"
+                total_commits_made += count
+                dots_done += 1
+                break
+            total_commits_made += count
+            dots_done += 1
+            if checkpoint:
+                checkpoint.mark(commit_date, count, message)
+            METRICS.advance()
+    except KeyboardInterrupt:
+        if checkpoint and checkpoint.dots:
+            print(f"\nInterrupted after {checkpoint.dots} dots. They are kept on {writer.transaction.scratch_ref}; "
+                  f"running the same paint again continues from there.", flush=True)
+        else:
+            writer.abort()
+            if checkpoint: checkpoint.clear()
+        raise
+    except BaseException:
+        writer.abort()
+        if checkpoint: checkpoint.clear()
+        raise
+    finally:
+        METRICS.finish_progress()
+
+    if reason is None:
+        if writer.close():
+            if checkpoint: checkpoint.clear()
+            return total_commits_made
+        METRICS.count('backend_failures')
+        print("The backend failed to write the commits. The branch was left unchanged.", flush=True)
+        reason = "The backend failed to write the commits"
+    if checkpoint: checkpoint.clear()
+
+    # Nothing was published: count the rest of the plan so the report covers every planned dot
+    for commit_date, count, _ in plan:
+        total_commits_made += count
+        dots_done += 1
+        last_date = commit_date
+    raise UnwrittenDotsError(reason, dots_done, total_commits_made, first_date, last_date)
+
+
+class PaintCheckpoint:
+    """
+    Lets an interrupted run of the 'commit' backend continue where it stopped. Its scratch ref
+    already follows every finished dot; '.git/contribution-art-checkpoint.json' records that
+    ref, the branch tip the run started from and a hash of the plan entries it covers. A later
+    run of the same plan (same seed and messages) from the same branch tip takes the ref over
+    and skips those dots. Any other run drops the stale ref.
+    """
+    FILE_NAME = "contribution-art-checkpoint.json"
+
+    def __init__(self, writer):
+        import hashlib
+
+        self.writer = writer
+        self.path = os.path.join(get_git_dir(writer.repo_path), self.FILE_NAME)
+        self.settings = [writer.seed, writer.compact]
+        self.digest = hashlib.sha1()
+        self.dots = 0
+        self.commits = 0
+
+    def add(self, commit_date, count, message):
+        self.digest.update(f"{commit_date.isoformat()} {count} {message}\n".encode('utf-8'))
+        self.dots += 1
+        self.commits += count
+
+    def mark(self, commit_date, count, message):
+        """Records a finished dot (the writer's scratch ref already points past it), atomically."""
+        import json
+
+        self.add(commit_date, count, message)
+        transaction = self.writer.transaction
+        data = {
+            'scratch_ref': transaction.scratch_ref, 'branch_ref': transaction.branch_ref, 'base': transaction.old_tip,
+            'tip': self.writer.parent, 'settings': self.settings, 'dots': self.dots, 'commits': self.commits,
+            'digest': self.digest.hexdigest(),
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def resume(self, plan):
+        """
+        Takes over the scratch ref of an interrupted run of the same plan, if there is one.
+        Returns (rest of the plan, dots, commits, first date) of the work already done.
+        """
+        import hashlib
+        import itertools
+        import json
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return plan, 0, 0, None
+        transaction = self.writer.transaction
+        repo_path = self.writer.repo_path
+        prefix = []
+        if (isinstance(data, dict) and data.get('branch_ref') == transaction.branch_ref and data.get('base') == transaction.old_tip
+                and data.get('settings') == self.settings and isinstance(data.get('dots'), int)
+                and query_git(['git', 'rev-parse', '--verify', '-q', str(data.get('scratch_ref'))], repo_path) == data.get('tip')):
+            prefix = list(itertools.islice(plan, data['dots']))
+            for entry in prefix:
+                self.add(*entry)
+            if self.dots == data['dots'] and self.digest.hexdigest() == data.get('digest'):
+                transaction.abort() # This run's own scratch ref is not needed
+                transaction.scratch_ref = data['scratch_ref']
+                self.writer.parent = data['tip']
+                print(f"Resuming an interrupted run: {self.dots} dots ({self.commits} commits) were already written.", flush=True)
+                return plan, self.dots, self.commits, prefix[0][0]
+
+        # A different plan, or the branch moved: the old commits cannot be reused
+        if isinstance(data, dict) and str(data.get('scratch_ref')).startswith(SCRATCH_REF_PREFIX):
+            transaction.delete_ref(data['scratch_ref'])
+        self.clear()
+        self.digest, self.dots, self.commits = hashlib.sha1(), 0, 0
+        return itertools.chain(prefix, plan), 0, 0, None
+
+    def clear(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+# --- Incremental Repaint ---
+
+def read_commit_counts(repo_path, ref='HEAD', native=False):
+    """
+    Builds a {date: commit count} index of the existing history with a single streaming
+    'git log' pass, or with 'native' (for the native backends) without git, see
+    read_commit_counts_native. An empty or missing repository yields an empty index.
+    """
+    import subprocess
+
+    if native:
+        return read_commit_counts_native(repo_path, ref)
+    counts = {}
+    if query_git(['git', 'rev-parse', '--verify', '-q', ref], repo_path) is None:
+        return counts
+    try:
+        process = subprocess.Popen(
+            ['git', 'log', '--format=%ad', '--date=short', ref],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=repo_path
+        )
+    except FileNotFoundError:
+        raise ContributionArtError(GIT_NOT_FOUND_MESSAGE)
+    for line in process.stdout:
+        day = date.fromisoformat(line.strip())
+        counts[day] = counts.get(day, 0) + 1
+    process.wait()
+    return counts
+
+def read_commit_counts_native(repo_path, ref='HEAD'):
+    """
+    Like read_commit_counts, but walks every commit reachable from 'ref' with read_object.
+    Each commit counts on its author date in the author's time zone, as 'git log --date=short' shows it.
+    """
+    counts = {}
+    try:
+        git_dir = get_git_dir(repo_path)
+    except ContributionArtError:
+        return counts
+    if ref == 'HEAD':
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        tip = read_ref(git_dir, head[5:]) if head.startswith("ref: ") else head
+    else:
+        tip = read_ref(git_dir, ref)
+
+    pending = [tip] if tip else []
+    seen = set(pending)
+    while pending:
+        _, content = read_object(git_dir, pending.pop())
+        for line in content.split(b"\n\n", 1)[0].split(b"\n"):
+            if line.startswith(b"parent "):
+                parent = line[7:].decode('ascii')
+                if parent not in seen:
+                    seen.add(parent)
+                    pending.append(parent)
+            elif line.startswith(b"author "):
+                timestamp, offset = line.rsplit(b" ", 2)[1:]
+                minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+                local_time = datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc) + timedelta(
+                    minutes=-minutes if offset.startswith(b"-") else minutes)
+                day = local_time.date()
+                counts[day] = counts.get(day, 0) + 1
+    return counts
+
+def diff_plan(plan, existing_counts):
+    """
+    Reduces each plan entry to the commits still missing for its date, given the existing
+    per-day counts. Entries that are already satisfied are dropped.
+    """
+    for commit_date, count, message in plan:
+        missing = count - existing_counts.get(commit_date, 0)
+        if missing > 0:
+            yield commit_date, missing, message
+
+
+# --- Sharded Painting ---
+# Commits on one branch form a parent chain, so a single history is written strictly in order.
+# Sharding splits the plan at week-column boundaries into independent histories that are painted
+# concurrently, each by its own worker process:
+#   'branches' : one orphan branch per shard in the same repository, combined afterwards by a
+#                single octopus merge into the painted branch (published like any other run)
+#   'repos'    : shard 0 is the repository itself, shard k is the repository '<repo_path>-shard-k'
+#                (GitHub counts contributions from every repository)
+# Finally the per-day commit counts of all shards are compared against the plan.
+
+SHARD_LAYOUTS = ('branches', 'repos')
+SHARD_BRANCH_PREFIX = 'refs/heads/contribution-art/shard-'
+
+def split_plan(plan, shards, calendar):
+    """
+    Splits plan entries into at most 'shards' contiguous runs of whole week columns with
+    roughly equal commit counts. Returns a list of entry lists.
+    """
+    columns = []
+    for entry in plan:
+        column = (entry[0] - calendar.start).days // GRAPH_ROWS # Week column, also past the window (marquee)
+        if not columns or columns[-1][0] != column:
+            columns.append((column, []))
+        columns[-1][1].append(entry)
+
+    total_commits = sum(entry[1] for _, entries in columns for entry in entries)
+    parts = [[]]
+    part_commits = 0
+    for column_index, (_, entries) in enumerate(columns):
+        # Start the next shard once this one has its share, keeping a column for every remaining shard
+        remaining_shards = shards - len(parts)
+        if parts[-1] and remaining_shards and (part_commits >= total_commits * len(parts) / shards
+                                               or len(columns) - column_index <= remaining_shards):
+            parts.append([])
+        parts[-1].extend(entries)
+        part_commits += sum(entry[1] for entry in entries)
+    return [part for part in parts if part]
+
+def get_shard_targets(repo_path, shards, layout):
+    """(repository, branch ref, orphan) for every shard; a ref of None means the checked-out branch."""
+    repo_path = os.path.abspath(repo_path)
+    if layout == 'branches':
+        return [(repo_path, f"{SHARD_BRANCH_PREFIX}{index}", True) for index in range(shards)]
+    return [(repo_path if index == 0 else f"{repo_path}-shard-{index}", None, False) for index in range(shards)]
+
+def read_combined_counts(targets, ref='HEAD', native=False):
+    """
+    Sums the per-day commit counts of every repository in 'targets' (each counted once).
+    With 'native' the histories are read without git (see read_commit_counts_native).
+    """
+    import asyncio
+
+    repo_paths = [repo_path for repo_path in dict.fromkeys(target[0] for target in targets) if os.path.isdir(repo_path)]
+    if len(repo_paths) > 1 and not native:
+        # Independent repositories: read all histories at once
+        async def read_all():
+            runner = AsyncGitRunner()
+            return await asyncio.gather(*(runner.commit_counts(repo_path, ref) for repo_path in repo_paths))
+        all_counts = asyncio.run(read_all())
+    else:
+        all_counts = [read_commit_counts(repo_path, ref, native) for repo_path in repo_paths]
+    combined = {}
+    for counts in all_counts:
+        for day, count in counts.items():
+            combined[day] = combined.get(day, 0) + count
+    return combined
+
+def paint_shard(shard_index, repo_path, branch_ref, orphan, entries, backend, verbose=False, seed=None, transaction=None):
+    """
+    Writes one shard's plan entries (runs in a worker process; output is captured), inside
+    'transaction' if given. Returns a result dictionary with the published (or staged) tip of the shard.
+    """
+    import io
+
+    start_time = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            configure_metrics(progress=False)
+            writer = open_commit_writer(backend, repo_path, verbose=verbose, branch_ref=branch_ref, orphan=orphan, seed=seed,
+                                        transaction=transaction)
+            commits = execute_plan(iter(entries), writer, len(entries), verbose=verbose)
+            ok = commits > 0
+            tip = writer.transaction.staged_tip or writer.transaction.published_tip
+            error = None
+        except (ContributionArtError, OSError) as e:
+            ok, commits, tip, error = False, 0, None, str(e)
+    if not ok and error is None:
+        error = ([line for line in output.getvalue().splitlines() if line.strip('- ')] or ["Painting failed."])[-1]
+    return {
+        'shard': shard_index, 'repo_path': repo_path, 'ref': branch_ref, 'ok': ok, 'commits': commits,
+        'seconds': time.perf_counter() - start_time, 'tip': tip, 'error': error,
+    }
+
+def verify_counts(planned, before, after):
+    """Returns the (date, planned, added) triples where the commits added differ from the plan."""
+    mismatches = []
+    for day in sorted(set(planned) | {day for day in after if after[day] != before.get(day, 0)}):
+        added = after.get(day, 0) - before.get(day, 0)
+        if added != planned.get(day, 0):
+            mismatches.append((day, planned.get(day, 0), added))
+    return mismatches
+
+def run_sharded(plan, repo_path, year, shards, layout='branches', backend='commit', workers=None, verbose=False, seed=None):
     """
-    Runs a Git command using subprocess in the specified repository path
-    and handles errors.
+    Paints the plan as 'shards' concurrent histories (see SHARD_LAYOUTS), then checks the
+    combined per-day totals against the plan. The run is all or nothing: no branch moves
+    until every shard is painted. Returns the number of commits added; raises
+    UnwrittenDotsError if a shard or the publish fails, and ContributionArtError if the
+    published totals do not match the plan.
     """
-    try:
-        # Execute commands within the target repository directory
-        result = subprocess.run(command, check=True, capture_output=True, text=True, env=env, cwd=repo_path)
-        if verbose:
-             print(f"DEBUG: Ran '{' '.join(command)}' in '{repo_path}'. Output:\n{result.stdout}\n{result.stderr}")
-        return result
-    except subprocess.CalledProcessError as e:
-        # Print detailed error information
-        print(f"\n--- Git Command Error ---", flush=True)
-        print(f"Command: {' '.join(command)}")
-        print(f"Path: {repo_path}")
-        if env:
-            print(f"Environment: GIT_AUTHOR_DATE={env.get('GIT_AUTHOR_DATE')}, GIT_COMMITTER_DATE={env.get('GIT_COMMITTER_DATE')}")
-        print(f"Return Code: {e.returncode}")
-        print(f"Stderr: {e.stderr.strip()}")
-        print(f"Stdout: {e.stdout.strip()}")
-        print(f"-------------------------\n", flush=True)
-        # Exit on critical initialization errors
-        if command[1] == 'init' or (command[1] == 'commit' and 'Initial commit' in command[-1]):
-             print("Critical error during repository initialization or first commit. Exiting.", flush=True)
-             exit(1)
-        print("Error occurred for this commit, attempting to continue with others...", flush=True)
-        return None # Indicate failure for this specific command
-    except FileNotFoundError:
-        print("Error: 'git' command not found. Make sure Git is installed and in your system's PATH.", flush=True)
-        exit(1)
-    except Exception as e:
-        print(f"An unexpected error occurred while running git command: {e}", flush=True)
-        print(f"Command: {' '.join(command)}")
-        print(f"Path: {repo_path}")
-        return None
+    from concurrent.futures import ProcessPoolExecutor
+
+    calendar = get_calendar(year)
+    entries = list(plan)
+    parts = split_plan(entries, shards, calendar)
+    if not parts:
+        print("Nothing to paint.", flush=True)
+        return 0
+    targets = get_shard_targets(repo_path, len(parts), layout)
+    native = backend in ('native', 'native-pack')
+    for target_repo, _, _ in targets[1:]:
+        if target_repo != targets[0][0]:
+            initialize_repo(target_repo, year, verbose, backend)
+    planned = {}
+    for commit_date, count, _ in entries:
+        planned[commit_date] = planned.get(commit_date, 0) + count
+    before = read_combined_counts(targets, native=native)
+    if layout == 'branches':
+        # The merge commit keeps the existing tip as first parent, so HEAD's history is what's compared
+        main_transaction = PaintTransaction(repo_path, native=native, verbose=verbose)
+        transactions = [None] * len(targets)
+    else:
+        # Each repository's shard waits on its scratch ref until all shards are painted
+        main_transaction = None
+        transactions = [PaintTransaction(target_repo, native=native, verbose=verbose, staged=True) for target_repo, _, _ in targets]
+
+    def unwritten(reason):
+        return UnwrittenDotsError(reason, len(entries), sum(planned.values()), entries[0][0], entries[-1][0])
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(parts)))
+    print(f"Sharding {sum(planned.values())} commits into {len(parts)} {layout} on {workers} worker processes...", flush=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(paint_shard, index, target_repo, branch_ref, orphan, part, backend, verbose, seed, transaction)
+            for index, ((target_repo, branch_ref, orphan), part, transaction) in enumerate(zip(targets, parts, transactions))
+        ]
+        results = [future.result() for future in futures]
+
+    for result, part in zip(results, parts):
+        first_day, last_day = part[0][0], part[-1][0]
+        if result['ok']:
+            print(f"  Shard {result['shard']}: {result['commits']} commits ({first_day} to {last_day}) in {result['seconds']:.2f}s", flush=True)
+        else:
+            print(f"  Shard {result['shard']} FAILED ({first_day} to {last_day}): {result['error']}", flush=True)
+    failed = [result for result in results if not result['ok']]
+    if failed:
+        if main_transaction:
+            for _, branch_ref, _ in targets:
+                main_transaction.delete_ref(branch_ref)
+        else:
+            for transaction in transactions:
+                transaction.abort()
+        raise unwritten(f"{len(failed)} of {len(parts)} shards failed")
+
+    if main_transaction:
+        # One merge commit, dated like the initial commit (before the graph window), brings all shards onto the branch
+        merge_day = calendar.first - timedelta(days=3)
+        parents = [main_transaction.old_tip] + [result['tip'] for result in results]
+        merge_sha = main_transaction.create_merge([parent for parent in parents if parent], f"{merge_day.isoformat()} 12:00:00",
+                                                  f"Merge {len(parts)} contribution art shards")
+        published = merge_sha is not None and main_transaction.publish(merge_sha)
+        for _, branch_ref, _ in targets:
+            main_transaction.delete_ref(branch_ref)
+        if not published:
+            raise unwritten("Could not merge the shards")
+        planned[merge_day] = planned.get(merge_day, 0) + 1
+    else:
+        for index, (transaction, result) in enumerate(zip(transactions, results)):
+            if transaction.publish_staged(result['tip']):
+                continue
+            for pending in transactions[index + 1:]:
+                pending.abort()
+            if not index:
+                raise unwritten(f"Could not publish shard 0 to {transaction.repo_path}")
+            # Refs of separate repositories cannot move together
+            published = ', '.join(str(shard) for shard in range(index))
+            unpublished = ', '.join(str(shard) for shard in range(index, len(parts)))
+            raise ContributionArtError(f"Could not publish shard {index} to {transaction.repo_path}. "
+                                       f"Shards {published} stayed published; shards {unpublished} were not written.")
+
+    mismatches = verify_counts(planned, before, read_combined_counts(targets, native=native))
+    if mismatches:
+        print(f"Verification FAILED for {len(mismatches)} days:", flush=True)
+        for day, expected, added in mismatches[:10]:
+            print(f"  {day}: planned {expected} commits, found {added}")
+        raise ContributionArtError(f"The painted shards do not match the plan on {len(mismatches)} days.")
+    total_commits = sum(result['commits'] for result in results)
+    METRICS.count('commits_written', total_commits) # Counted in the workers' own METRICS
+    print(f"Verified: the per-day totals of all {len(parts)} shards match the plan ({total_commits} commits).", flush=True)
+    return total_commits
+
+
+# --- History Cache ---
+# A seeded run is fully determined by its plan, the seed, the commit identities, the local time
+# zone and the commit it starts from. Those are hashed into a key, and the painted commits are
+# kept on disk as one packfile per key. A repeat paint copies the pack into the repository and
+# publishes the cached tip instead of writing every commit again. The least recently used
+# entries are evicted once the cache grows past its size limit.
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_SIZE_MB = 512
+
+def get_default_cache_dir():
+    """'$XDG_CACHE_HOME/contribution-art' (default: '~/.cache/contribution-art')."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "contribution-art")
+
+def get_commit_identity(repo_path, native=False):
+    """The (author, committer) pair the backend will write, read the same way it does."""
+    get_ident = get_native_ident if native else get_git_ident
+    return get_ident(repo_path, 'AUTHOR'), get_ident(repo_path, 'COMMITTER')
+
+def history_key(plan, seed, identity, base, compact=False):
+    """SHA-256 over everything that decides the bytes of a seeded history (streams the plan)."""
+    import hashlib
+    import json
 
+    key = hashlib.sha256(json.dumps({
+        'version': CACHE_FORMAT_VERSION, 'seed': seed, 'identity': identity, 'base': base, 'compact': compact,
+        'timezone': [time.timezone, time.altzone, list(time.tzname)],
+    }, sort_keys=True).encode('utf-8'))
+    for commit_date, count, message in plan:
+        key.update(f"{commit_date.isoformat()} {count} {message}\n".encode('utf-8'))
+    return key.hexdigest()
 
-def create_commit(repo_path, commit_date, commits_per_dot, message_suffix="", verbose=False):
+class HistoryCache:
     """
-    Creates one or more empty Git commits for a specific date in the specified repository.
-    Returns True if at least one commit was successfully created, False otherwise.
+    Painted histories on disk: '<cache_dir>/<key>/' holds 'pack-<checksum>.pack/.idx' with
+    the painted commits and 'entry.json' with their tip. The mtime of 'entry.json' records
+    the last use, for LRU eviction once all entries take more than 'max_bytes'.
     """
-    base_time_sec = random.randint(0, 59)
-    commit_count_success = 0
 
-    for i in range(commits_per_dot):
-        # Vary commit times slightly to look more 'natural'
-        commit_hour = random.randint(10, 19) # Simulate business hours
-        commit_min = random.randint(0, 59)
-        # Ensure seconds are distinct within the same minute for multiple dots
-        commit_sec = (base_time_sec + i) % 60
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_SIZE_MB << 20):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
 
-        # Format date string for Git environment variables
-        date_str = f"{commit_date.isoformat()} {commit_hour:02d}:{commit_min:02d}:{commit_sec:02d}"
-        message = f"Art commit {message_suffix} ({i+1}/{commits_per_dot})"
+    def lookup(self, key):
+        """Returns the entry for 'key' (marking it as used), or None."""
+        import json
 
-        # Set Git environment variables for author and committer dates
-        env = os.environ.copy()
-        env['GIT_AUTHOR_DATE'] = date_str
-        env['GIT_COMMITTER_DATE'] = date_str
+        entry_path = os.path.join(self.cache_dir, key, "entry.json")
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+        return entry
 
-        # Prepare and run the git commit command
-        commit_command = ['git', 'commit', '--allow-empty', '-m', message, '--date', date_str]
-        result = run_git_command(commit_command, repo_path, env=env, verbose=verbose)
+    def store(self, key, git_dir, tip, base, commits):
+        """
+        Packs the commits from 'tip' back to 'base' (exclusive) into a new entry, then evicts
+        old entries. Another process storing the same key first wins; the copies are identical.
+        """
+        import json
+        import shutil
 
-        if result:
-            commit_count_success += 1
-            if verbose:
-                print(f"  Commit {i+1}/{commits_per_dot} created for {date_str}", flush=True)
-        else:
-            # If one commit fails, stop trying for this specific dot/date
-            print(f"  Failed to create commit {i+1}/{commits_per_dot} for {date_str}. Stopping for this day.", flush=True)
-            return False # Indicate failure for this dot
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = os.path.join(self.cache_dir, f"tmp-{os.getpid()}-{time.time_ns():x}")
+        pack = PackWriter(tmp_dir)
+        try:
+            if base is None:
+                pack.add('tree', b"") # An orphan history starts from the empty tree
+            sha = tip
+            while sha and sha != base:
+                _, content = read_object(git_dir, sha)
+                pack.add('commit', content)
+                parent_line = content.split(b"\n", 2)[1]
+                sha = parent_line[7:47].decode('ascii') if parent_line.startswith(b"parent ") else None
+            pack_name = pack.close()
+        except BaseException:
+            pack.abort()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        with open(os.path.join(tmp_dir, "entry.json"), "w") as f:
+            json.dump({'tip': tip, 'base': base, 'commits': commits, 'pack': pack_name}, f)
+        try:
+            os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True) # Already cached by another run
+        self.evict()
 
-    return commit_count_success > 0 # Return True if any commits succeeded for this dot
+    def import_into(self, key, entry, git_dir):
+        """
+        Copies the entry's pack and index into the repository's object store, after checking
+        both against their checksums. Raises ContributionArtError for a damaged entry.
+        """
+        import hashlib
 
-# --- Core Logic ---
+        name = f"pack-{entry['pack']}"
+        with open(os.path.join(self.cache_dir, key, name + ".pack"), "rb") as f:
+            pack = f.read()
+        with open(os.path.join(self.cache_dir, key, name + ".idx"), "rb") as f:
+            idx = f.read()
+        pack_checksum = pack[-20:]
+        if (pack_checksum.hex() != entry['pack'] or hashlib.sha1(pack[:-20]).digest() != pack_checksum
+                or idx[-40:-20] != pack_checksum or hashlib.sha1(idx[:-20]).digest() != idx[-20:]):
+            raise ContributionArtError(f"The cached {name} does not match its checksum.")
+        pack_dir = os.path.join(git_dir, "objects", "pack")
+        os.makedirs(pack_dir, exist_ok=True)
+        # The index goes last: git only uses a pack once its .idx exists
+        for suffix, data in ((".pack", pack), (".idx", idx)):
+            target = os.path.join(pack_dir, name + suffix)
+            if not os.path.exists(target):
+                with open(target + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(target + ".tmp", target)
+
+    def discard(self, key):
+        """Removes an entry (e.g. one that could not be read)."""
+        import shutil
+
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        import shutil
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            with contextlib.suppress(OSError):
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                entries.append((os.stat(os.path.join(entry_dir, "entry.json")).st_mtime, size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
 
-def get_start_date(year):
+def execute_cached(plan, writer, cache, seed, expected_dots=0, verbose=False):
     """
-    Find the date of the Sunday of the first week to align with GitHub's graph.
-    GitHub contribution graphs start on a Sunday.
+    Like execute_plan for a seeded run, through the history cache. The plan is read into
+    memory first, to compute the key. On a hit the cached pack is imported and its tip
+    published; on a miss (or an unreadable entry, which is dropped) the plan is painted and
+    the result cached. Raises UnwrittenDotsError if the history could not be published.
     """
-    jan_1 = date(year, 1, 1)
-    # weekday() returns 0 for Monday, 6 for Sunday.
-    # We want the offset from Sunday (0). (jan_1.weekday() + 1) % 7 gives Sunday=0, Monday=1, etc.
-    day_of_week_sun_0 = (jan_1.weekday() + 1) % 7
-    # Subtract the offset to get the previous Sunday
-    start_date = jan_1 - timedelta(days=day_of_week_sun_0)
-    print(f"Calculated graph start date (Sunday): {start_date}")
-    return start_date
+    entries = list(plan)
+    transaction = writer.transaction
+    native = isinstance(writer, NativeObjectWriter)
+    identity = get_commit_identity(writer.repo_path, native)
+    key = history_key(entries, seed, identity, transaction.base, writer.compact)
+    git_dir = get_git_dir(writer.repo_path)
+
+    entry = cache.lookup(key)
+    if entry:
+        try:
+            cache.import_into(key, entry, git_dir)
+            read_object(git_dir, entry['tip']) # The tip must have come with the pack
+            commits = int(entry['commits'])
+        except (OSError, KeyError, TypeError, ValueError, zlib.error, ContributionArtError) as e:
+            print(f"Warning: Dropping an unreadable cache entry ({e}); painting the commits instead.", flush=True)
+            cache.discard(key)
+            entry = None
+    if entry:
+        writer.abort() # Nothing was written yet
+        print(f"Cache hit: imported {commits} cached commits (pack-{entry['pack']}).", flush=True)
+        if not transaction.publish(entry['tip']):
+            raise UnwrittenDotsError("Could not publish the cached history", len(entries), commits,
+                                     entries[0][0] if entries else None, entries[-1][0] if entries else None)
+        METRICS.count('commits_written', commits)
+        return commits
+
+    if verbose: print(f"DEBUG: No cached history for key {key}", flush=True)
+    total_commits_made = execute_plan(iter(entries), writer, expected_dots=expected_dots, verbose=verbose)
+    if total_commits_made and transaction.published_tip:
+        try:
+            cache.store(key, git_dir, transaction.published_tip, transaction.base, total_commits_made)
+        except (OSError, ContributionArtError) as e:
+            print(f"Warning: Could not add the painted history to the cache: {e}", flush=True)
+    return total_commits_made
+
 
-def initialize_repo(repo_path, year, verbose=False):
+def print_dry_run(plan, backend='commit', compact=False, repo_path=None):
     """
-    Initializes a Git repository at the specified path if it doesn't exist.
-    Creates the directory if necessary.
-    Adds an initial commit if the repository is empty.
+    Streams the plan to the terminal without touching the repository: every affected date,
+    then the total commit count, an estimated runtime for the chosen backend and the
+    estimated push size (see PushEstimate). Returns the total number of planned commits.
     """
-    print("\n--- Initializing Repository ---", flush=True)
-    repo_path = os.path.abspath(repo_path) # Ensure we have an absolute path
+    print("Dry run: no commits will be created.", flush=True)
+    print("Affected dates:")
+    total_commits = 0
+    total_dates = 0
+    first_date = last_date = None
+    estimate = PushEstimate(repo_path)
+
+    for commit_date, count, message in plan:
+        print(f"  {commit_date.isoformat()} ({commit_date.strftime('%a')})  {count:>3} commits  {message}")
+        estimate.add(count, message)
+        total_commits += count
+        total_dates += 1
+        first_date = first_date or commit_date
+        last_date = commit_date
+
+    estimated_seconds = total_commits * ESTIMATED_SECONDS_PER_COMMIT.get(backend, ESTIMATED_SECONDS_PER_COMMIT['commit'])
+    print("\n--- Dry Run Summary ---")
+    print(f"Dates:      {total_dates}" + (f" ({first_date} to {last_date})" if total_dates else ""))
+    print(f"Commits:    {total_commits}")
+    print(f"Backend:    {backend}")
+    print(f"Est. time:  ~{estimated_seconds:.1f}s")
+    print(f"Push:       {estimate.describe(compact)}")
+    print("-----------------------", flush=True)
+    return total_commits
+
+
+# --- Compact Packing ---
+# Git sends painted commits whole when pushing: they are too small for its delta search to pay
+# off. A compact run gives every commit the same short message and, once the branch is published,
+# repacks the painted range into one pack in which each commit is a delta against its successor
+# (the parent id and two timestamps are all that differ). Push reuses those deltas as they are.
+
+PACK_MAX_DELTA_DEPTH = 50 # Like git's default pack.depth; longer chains make every read slower
+PACK_OVERHEAD_BYTES = 32 # Pack header and trailing checksum
+ESTIMATE_IDENTITY = "Your Name <you@example.com>" # Stands in for an unconfigured identity in estimates
+
+def format_bytes(size):
+    """A byte count for humans (e.g. '174.3 KiB')."""
+    for unit in ('bytes', 'KiB', 'MiB'):
+        if size < 1024 or unit == 'MiB':
+            return f"{size} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+        size /= 1024
+
+class PushEstimate:
+    """
+    The push payload of a plan's commits, estimated before they exist: 'plain_bytes' with the
+    per-dot messages, sent whole as git does, and 'compact_bytes' for the pack compact_history
+    writes. Sample commits with random ids and the identity configured for 'repo_path' stand in
+    for the real ones. Feed it with add().
+    """
+
+    def __init__(self, repo_path=None):
+        import random
 
-    # Create directory if it doesn't exist
-    if not os.path.exists(repo_path):
         try:
-            os.makedirs(repo_path)
-            print(f"Created directory: {repo_path}", flush=True)
-        except OSError as e:
-            print(f"Error: Could not create directory: {repo_path}", flush=True)
-            print(f"Reason: {e}", flush=True)
-            exit(1)
-    elif not os.path.isdir(repo_path):
-         print(f"Error: The specified path '{repo_path}' exists but is not a directory.", flush=True)
-         exit(1)
+            self.identity = get_native_ident(repo_path)
+        except ContributionArtError:
+            self.identity = ESTIMATE_IDENTITY
+        self.rng = random.Random(0) # Stable estimates
+        self.tree = f"{self.rng.getrandbits(160):040x}" # Painted commits all share their tree
+        older = self.sample_commit(COMPACT_COMMIT_MESSAGE, 1700000000)
+        newer = self.sample_commit(COMPACT_COMMIT_MESSAGE, 1700000421, parent=hash_object('commit', older)[0])
+        delta = make_delta(newer, older)
+        self.whole_compact = self.packed_size(newer, 9)
+        self.delta_compact = len(encode_pack_entry_header(PACK_OFS_DELTA, len(delta))) + 1 + len(zlib.compress(delta, 9))
+        self.commits = 0
+        self.plain_bytes = PACK_OVERHEAD_BYTES
 
-    git_dir = os.path.join(repo_path, ".git")
+    def sample_commit(self, message, timestamp, parent=None):
+        parent = parent or f"{self.rng.getrandbits(160):040x}"
+        return (f"tree {self.tree}\nparent {parent}\nauthor {self.identity} {timestamp} +0000\n"
+                f"committer {self.identity} {timestamp} +0000\n\n{message}\n").encode('utf-8')
 
-    # Initialize Git repo if .git directory doesn't exist
-    if not os.path.isdir(git_dir):
-        print("'.git' directory not found. Initializing a new Git repository...", flush=True)
-        init_result = run_git_command(['git', 'init'], repo_path=repo_path, verbose=verbose)
-        if not init_result:
-             exit(1) # Exit if git init fails
-    else:
-        if verbose: print("Existing '.git' directory found.", flush=True)
+    def packed_size(self, content, level=-1):
+        return len(encode_pack_entry_header(PACK_TYPE_CODES['commit'], len(content))) + len(zlib.compress(content, level))
 
-    # Check if the repository has any commits
-    has_commits = False
+    def add(self, count, message):
+        """Adds a plan entry: 'count' commits of a dot painted by 'message'."""
+        self.plain_bytes += count * self.packed_size(self.sample_commit(format_commit_message(message, count, count), 1700000000))
+        self.commits += count
+
+    @property
+    def compact_bytes(self):
+        whole = -(-self.commits // (PACK_MAX_DELTA_DEPTH + 1))
+        return PACK_OVERHEAD_BYTES + whole * self.whole_compact + (self.commits - whole) * self.delta_compact
+
+    def describe(self, compact=False):
+        """One line for the user, leading with the size the chosen mode will push."""
+        if compact:
+            return (f"{self.commits} objects, ~{format_bytes(self.compact_bytes)} compacted "
+                    f"(~{format_bytes(self.plain_bytes)} with per-dot messages)")
+        return f"{self.commits} objects, ~{format_bytes(self.plain_bytes)} (~{format_bytes(self.compact_bytes)} with --compact)"
+
+def compact_history(repo_path, base, tip, verbose=False):
+    """
+    Repacks the commits from 'tip' back to 'base' (exclusive) into one pack at maximum compression:
+    newest first, each commit a delta against the one after it, with a whole commit every
+    PACK_MAX_DELTA_DEPTH + 1. Loose copies of those objects, and packs holding nothing else, are
+    then removed. Returns (objects, bytes before, bytes after), where 'before' is what pushing
+    the same objects whole would send.
+    """
+    git_dir = get_git_dir(repo_path)
+    pack_dir = os.path.join(git_dir, "objects", "pack")
+    old_packs = [name[:-4] for name in os.listdir(pack_dir) if name.endswith(".idx")] if os.path.isdir(pack_dir) else []
+    pack = PackWriter(pack_dir, compression=9)
+    shas = set()
+    before = PACK_OVERHEAD_BYTES
     try:
-        # Use rev-parse HEAD which fails in an empty repo
-        run_git_command(['git', 'rev-parse', '--verify', 'HEAD'], repo_path=repo_path, verbose=False)
-        has_commits = True
-        if verbose: print("Repository already has commits.", flush=True)
-    except subprocess.CalledProcessError:
-        if verbose: print("No existing commits found (or HEAD is unborn).", flush=True)
-    except Exception as e:
-        print(f"Error checking for existing commits: {e}", flush=True)
-        # Decide if we should continue or exit? Let's try to continue.
+        sha, newer, depth, content = tip, None, 0, None
+        while sha and sha != base:
+            _, content = read_object(git_dir, sha)
+            depth = depth + 1 if newer and depth < PACK_MAX_DELTA_DEPTH else 0
+            pack.add('commit', content, base=newer if depth else None)
+            before += len(encode_pack_entry_header(PACK_TYPE_CODES['commit'], len(content))) + len(zlib.compress(content))
+            shas.add(sha)
+            newer = (sha, content)
+            parent_line = content.split(b"\n", 2)[1]
+            sha = parent_line[7:47].decode('ascii') if parent_line.startswith(b"parent ") else None
+        if base is None and content is not None:
+            # An orphan history also brings its tree
+            tree = content[5:45].decode('ascii')
+            _, tree_content = read_object(git_dir, tree)
+            pack.add('tree', tree_content)
+            before += len(encode_pack_entry_header(PACK_TYPE_CODES['tree'], len(tree_content))) + len(zlib.compress(tree_content))
+            shas.add(tree)
+        pack_name = pack.close()
+    except BaseException:
+        pack.abort()
+        raise
+    after = os.path.getsize(os.path.join(pack_dir, f"pack-{pack_name}.pack"))
 
-    # Create an initial commit if the repository is empty
-    if not has_commits:
-        print("Creating an initial commit...", flush=True)
-        readme_path = os.path.join(repo_path, "README.md")
-        try:
-            # Create a simple README.md
-            with open(readme_path, "w") as f:
-                f.write(f"# GitHub Contribution Art\n\nRepository initialized for GitHub contribution art ({year}).\nGenerated by script.\n")
-            if verbose: print(f"Created {readme_path}", flush=True)
+    # The new pack is complete (with its index), so the old copies can go. Packs are left alone
+    # if a multi-pack-index lists them
+    keep_packs = os.path.exists(os.path.join(pack_dir, "multi-pack-index"))
+    for prefix in {sha[:2] for sha in shas}:
+        object_dir = os.path.join(git_dir, "objects", prefix)
+        if not os.path.isdir(object_dir):
+            continue
+        for name in os.listdir(object_dir):
+            if prefix + name in shas:
+                os.remove(os.path.join(object_dir, name))
+        with contextlib.suppress(OSError):
+            os.rmdir(object_dir) # Only if empty
+    for name in old_packs:
+        base_name = os.path.join(pack_dir, name)
+        if keep_packs or name == f"pack-{pack_name}" or os.path.exists(base_name + ".keep"):
+            continue
+        if all(old_sha in shas for old_sha in read_pack_index_names(base_name + ".idx")):
+            # The index goes first: git ignores a pack without one
+            for suffix in (".idx", ".pack", ".rev", ".bitmap"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(base_name + suffix)
+            if verbose: print(f"DEBUG: Removed {name}, all of its objects are in pack-{pack_name}", flush=True)
+    if verbose: print(f"DEBUG: Wrote pack-{pack_name}.pack with {len(shas)} objects", flush=True)
+    return len(shas), before, after
+
+
+# --- Preview & Verification ---
+# The planned graph is drawn straight from the plan (no git work), as ANSI blocks in the
+# terminal or as an SVG file. Verification draws the repository's real graph from one
+# streaming 'git log' pass and compares the two cell by cell, using GitHub's shading levels.
+
+LEVEL_COLORS = ('#ebedf0', '#9be9a8', '#40c463', '#30a14e', '#216e39') # GitHub's light theme, levels 0-4
+MISMATCH_COLOR = '#f85149'
+LEVEL_CHARS = ' ░▒▓█' # Used instead of colors when NO_COLOR is set
+ROW_LABELS = ('', 'Mon', '', 'Wed', '', 'Fri', '')
+SVG_CELL = 10
+SVG_GAP = 3
+SVG_LABEL_WIDTH = 30
 
-            # Add the README
-            add_result = run_git_command(['git', 'add', 'README.md'], repo_path=repo_path, verbose=verbose)
-            if not add_result:
-                 print("Failed to git add README.md. Cannot create initial commit.", flush=True)
-                 # Consider cleanup? For now, we might continue, but painting will likely fail.
+PreviewOptions = collections.namedtuple('PreviewOptions', 'verify svg_path')
+PreviewOptions.__doc__ = """What paint_plan renders instead of painting: the plan, or with 'verify' the plan against the repository."""
+
+def plan_cell_counts(plan, calendar, baseline=None):
+    """
+    Sums the plan's commits per day of the calendar window, on top of 'baseline' if given.
+    Plans are in date order, so reading stops at the end of the window (even for a marquee).
+    """
+    counts = {day: count for day, count in (baseline or {}).items() if calendar.position(day)}
+    for commit_date, count, _ in plan:
+        if commit_date > calendar.last:
+            break
+        if calendar.position(commit_date):
+            counts[commit_date] = counts.get(commit_date, 0) + count
+    return counts
+
+def cell_levels(counts, calendar):
+    """The level (0-4) of every cell of the window in column-major order; None outside the window."""
+    peak = max((counts.get(day, 0) for day in calendar.dates if day), default=0)
+    return [None if day is None else count_to_level(counts.get(day, 0), peak) for day in calendar.dates]
+
+def diff_levels(planned_levels, actual_levels):
+    """Indexes of the cells whose level differs between the two grids."""
+    return [index for index, (planned, actual) in enumerate(zip(planned_levels, actual_levels)) if planned != actual]
+
+def hex_to_rgb(color):
+    return tuple(int(color[index:index + 2], 16) for index in (1, 3, 5))
+
+def render_ansi(title, levels, calendar, marks=()):
+    """
+    Draws one grid as text: 7 rows of 2-character cells, colored with ANSI 24-bit escapes
+    (or shaded block characters if NO_COLOR is set). Cells in 'marks' are drawn in red.
+    """
+    use_color = not os.environ.get('NO_COLOR')
+    marks = set(marks)
+    lines = [title]
+    for row in range(GRAPH_ROWS):
+        cells = []
+        for col in range(calendar.width):
+            index = col * GRAPH_ROWS + row
+            level = levels[index]
+            if level is None:
+                cells.append('  ')
+            elif not use_color:
+                cells.append('!!' if index in marks else LEVEL_CHARS[level] * 2)
             else:
-                # Create the initial commit with a date slightly before the target year starts
-                initial_commit_date = date(year, 1, 1) - timedelta(days=3)
-                initial_date_str = f"{initial_commit_date.isoformat()} 12:00:00"
-                env = os.environ.copy()
-                env['GIT_AUTHOR_DATE'] = initial_date_str
-                env['GIT_COMMITTER_DATE'] = initial_date_str
-
-                commit_result = run_git_command(
-                    ['git', 'commit', '-m', f'Initial commit ({year})'],
-                    repo_path=repo_path,
-                    env=env,
-                    verbose=verbose
-                )
-                if commit_result:
-                    print(f"Initial commit created for date {initial_commit_date.isoformat()}.", flush=True)
-                else:
-                    print(f"Failed to create initial commit.", flush=True)
-                    # Exit here as subsequent commits will likely fail without a HEAD
-                    exit(1)
+                red, green, blue = hex_to_rgb(MISMATCH_COLOR if index in marks else LEVEL_COLORS[level])
+                cells.append(f"\x1b[38;2;{red};{green};{blue}m██")
+        lines.append(f"{ROW_LABELS[row]:<4}" + ''.join(cells) + ("\x1b[0m" if use_color else ''))
+    return '\n'.join(lines)
 
-        except Exception as e:
-            print(f"Error creating initial commit files: {e}", flush=True)
-            exit(1)
-    else:
-        print("Repository is not empty. Skipping initial commit.", flush=True)
+def render_svg(panels, calendar):
+    """
+    Draws the grids of 'panels' ((title, levels, marks) tuples) stacked in one SVG document,
+    in the layout of GitHub's graph. Cells in 'marks' get a red outline.
+    """
+    pitch = SVG_CELL + SVG_GAP
+    panel_height = 20 + GRAPH_ROWS * pitch + 10
+    width = SVG_LABEL_WIDTH + calendar.width * pitch
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{panel_height * len(panels)}" '
+        f'font-family="sans-serif" font-size="9">'
+    ]
+    for panel_index, (title, levels, marks) in enumerate(panels):
+        top = panel_index * panel_height
+        marks = set(marks)
+        parts.append(f'<text x="0" y="{top + 12}" font-size="11">{title}</text>')
+        for row, label in enumerate(ROW_LABELS):
+            if label:
+                parts.append(f'<text x="0" y="{top + 20 + row * pitch + SVG_CELL - 1}">{label}</text>')
+        for index, level in enumerate(levels):
+            if level is None:
+                continue
+            col, row = divmod(index, GRAPH_ROWS)
+            outline = f' stroke="{MISMATCH_COLOR}" stroke-width="2"' if index in marks else ''
+            parts.append(
+                f'<rect x="{SVG_LABEL_WIDTH + col * pitch}" y="{top + 20 + row * pitch}" width="{SVG_CELL}" '
+                f'height="{SVG_CELL}" rx="2" fill="{LEVEL_COLORS[level]}"{outline}/>'
+            )
+    parts.append('</svg>')
+    return '\n'.join(parts) + '\n'
 
-    print("--- Initialization Complete ---", flush=True)
+def preview_plan(plan, calendar, targets, options, baseline=None, native=False):
+    """
+    Renders the planned graph and, with options.verify, the repository's actual graph and
+    the cells where they differ ('native' reads it without git). Writes an SVG to
+    options.svg_path if set. Returns the number of planned commits; raises
+    ContributionArtError if verification finds differences.
+    """
+    planned_counts = plan_cell_counts(plan, calendar, baseline)
+    planned_levels = cell_levels(planned_counts, calendar)
+    panels = [(f"Planned ({calendar.label})", planned_levels, ())]
+    mismatches = []
+    if options.verify:
+        actual_counts = read_combined_counts(targets, native=native)
+        actual_levels = cell_levels(actual_counts, calendar)
+        mismatches = diff_levels(planned_levels, actual_levels)
+        panels.append((f"Repository ({calendar.label})", actual_levels, mismatches))
 
+    for title, levels, marks in panels:
+        print(render_ansi(title, levels, calendar, marks) + "\n", flush=True)
+    if options.svg_path:
+        with open(options.svg_path, "w") as f:
+            f.write(render_svg(panels, calendar))
+        print(f"Wrote {options.svg_path}", flush=True)
 
-def paint_text(repo_path, text, year, start_column, commits_per_dot, spacing, verbose=False):
+    planned_commits = sum(planned_counts.values()) - sum((baseline or {}).get(day, 0) for day in planned_counts)
+    if not options.verify:
+        return planned_commits
+    if not mismatches:
+        print(f"Verification passed: all {sum(level is not None for level in planned_levels)} cells match the plan.", flush=True)
+        return planned_commits
+    print(f"Verification failed: {len(mismatches)} cells differ from the plan (marked red):", flush=True)
+    for index in mismatches[:20]:
+        day = calendar.dates[index]
+        print(f"  {day.isoformat()} ({day.strftime('%a')}) week {index // GRAPH_ROWS}: planned level {planned_levels[index]} "
+              f"({planned_counts.get(day, 0)} commits), actual level {actual_levels[index]} ({actual_counts.get(day, 0)} commits)")
+    if len(mismatches) > 20:
+        print(f"  ... and {len(mismatches) - 20} more")
+    raise ContributionArtError(f"{len(mismatches)} cells of the graph differ from the plan.")
+
+
+def paint_text(repo_path, text, year, start_column, commits_per_dot, spacing, verbose=False, backend='commit', dry_run=False, incremental=False,
+               shading=False, baseline_path=None, font_path=None, shards=1, shard_layout='branches', marquee=False, preview=None,
+               seed=None, cache=None, compact=False):
     """
     Generates Git commits in the specified repository to paint the text onto
     the GitHub contribution graph for the given year.
+    'backend' selects how commits are written (see BACKENDS). With 'dry_run' the plan is
+    only printed and the repository is never modified. With 'incremental' only the commits
+    missing from the existing history are added. Commits reach the branch only if the whole
+    run succeeds (see PaintTransaction).
+    With 'shading' commits_per_dot is ignored and the fewest commits that make the text the
+    darkest shade are added, on top of the repository's history or the per-day counts in 'baseline_path'.
+    'font_path' draws the text with a BDF/PSF font instead of the built-in CHAR_MAP.
+    With 'shards' > 1 the commits are written by that many parallel workers (see run_sharded).
+    With 'marquee' text that does not fit flows on into the following years (see plan_marquee).
+    With 'preview' (a PreviewOptions) nothing is painted; the graph is rendered instead (see preview_plan).
+    A 'seed' makes the commits reproducible; a HistoryCache in 'cache' then reuses earlier runs.
+    With 'compact' the commits get one short message and are repacked for a small push (see compact_history).
+    """
+    if marquee:
+        if shading:
+            raise ValueError("Shading is not available in marquee mode.")
+        build_plan = lambda shading_baseline: plan_marquee(text, year, start_column, commits_per_dot, spacing, verbose, font_path)
+    else:
+        build_plan = lambda shading_baseline: plan_text(text, year, start_column, commits_per_dot, spacing, verbose, shading_baseline, font_path)
+
+    name = text if len(text) <= 40 else f"{text[:37]}..."
+    return paint_plan(
+        repo_path, 'text', name, build_plan, year,
+        verbose, backend, dry_run, incremental, shading, baseline_path, shards=shards, shard_layout=shard_layout, preview=preview,
+        seed=seed, cache=cache, compact=compact
+    )
+
+def paint_image(repo_path, image_path, year, start_column, commits_per_dot, dither=False, invert=False, verbose=False, backend='commit',
+                dry_run=False, incremental=False, shading=False, baseline_path=None, shards=1, shard_layout='branches', preview=None,
+                seed=None, cache=None, compact=False):
+    """
+    Like paint_text, for a PBM/PGM/PPM image. The image is downsampled to 7 rows from
+    'start_column' on and quantized to the graph's five shades (see rasterize_image); a cell
+    at level L gets ceil(commits_per_dot * L / 4) commits unless 'shading' is on.
+    """
+    image_path = os.path.abspath(image_path)
+    build_plan = lambda shading_baseline: plan_image(image_path, year, start_column, commits_per_dot, dither, invert, verbose, shading_baseline)
+    return paint_plan(
+        repo_path, 'image', os.path.basename(image_path), build_plan, year,
+        verbose, backend, dry_run, incremental, shading, baseline_path, shards=shards, shard_layout=shard_layout, preview=preview,
+        seed=seed, cache=cache, compact=compact
+    )
+
+def paint_plan(repo_path, kind, name, build_plan, year, verbose=False, backend='commit',
+               dry_run=False, incremental=False, shading=False, baseline_path=None, shards=1, shard_layout='branches', preview=None,
+               seed=None, cache=None, compact=False):
+    """
+    Shared body of paint_text and paint_image: builds the plan with
+    build_plan(shading_baseline) -> (plan, expected_dots) and writes its commits.
+    With a 'seed' the commits are reproducible, and a HistoryCache in 'cache' reuses them.
+    Plans of known length get a push estimate up front; 'compact' repacks the painted commits afterwards.
     """
     print(f"\n--- Generating Commits ---", flush=True)
-    print(f"Painting '{text}' in year {year}...", flush=True)
+    calendar = get_calendar(year)
+    print(f"Painting '{name}' in {calendar.label} (graph starts on Sunday {calendar.start})...", flush=True)
     repo_path = os.path.abspath(repo_path) # Ensure absolute path
+    # Existing contributions are summed over every repository the run paints into
+    targets = get_shard_targets(repo_path, shards, shard_layout)
+    native = backend in ('native', 'native-pack')
 
-    base_date = get_start_date(year) # Sunday of the first week
-    current_col = start_column       # Starting week column (0-52)
-    total_commits_made = 0
-    max_cols = 53                    # GitHub graph has 53 columns (weeks)
-    # Row offsets map CHAR_MAP rows (0-4) to GitHub graph days (1-5: Mon-Fri)
-    # CHAR_MAP row 0 -> Monday (day index 1)
-    # CHAR_MAP row 1 -> Tuesday (day index 2)
-    # ...
-    # CHAR_MAP row 4 -> Friday (day index 5)
-    row_offset_start = 1 # Start drawing on Monday
-
-    print(f"Processing text: '{text}'", flush=True)
-    print("Progress: [", end="", flush=True) # Start progress indicator
-    progress_bar_width = 50
-    last_progress_ticks = 0
-
-    total_chars = len(text)
-    processed_chars = 0
-
-    # Iterate through each character in the input text
-    for char_index, char in enumerate(text):
-        if char not in CHAR_MAP:
-            if verbose: print(f"\nWarning: Character '{char}' not found in CHAR_MAP, treating as space.", flush=True)
-            char = ' ' # Default to space if character not defined
+    shading_baseline = None
+    if shading:
+        if baseline_path:
+            shading_baseline = load_baseline(baseline_path)
+        else:
+            shading_baseline = read_combined_counts(targets, native=native)
+
+    with METRICS.phase('layout'):
+        plan, expected_dots = build_plan(shading_baseline)
+    if preview:
+        # The whole planned graph, compared against the whole history
+        return preview_plan(plan, calendar, targets, preview, baseline=shading_baseline, native=native)
+    # Shaded counts are already relative to the existing history
+    if incremental and not shading and os.path.isdir(repo_path):
+        existing_counts = read_combined_counts(targets, native=native)
+        print(f"Incremental mode: {len(existing_counts)} days already have commits.", flush=True)
+        plan = diff_plan(plan, existing_counts)
 
-        pattern = CHAR_MAP[char]
+    if dry_run:
+        return print_dry_run(plan, backend=backend, compact=compact, repo_path=repo_path)
 
-        # Determine the width of the character pattern
-        if not pattern:
-             char_width = 0 # Handle potential empty patterns gracefully
-             if verbose: print(f"\nWarning: Empty pattern found for character '{char}'. Skipping.", flush=True)
+    if expected_dots is not None:
+        # At most one graph's worth of entries: cheap to hold, so the push can be estimated first
+        entries = list(plan)
+        estimate = PushEstimate(repo_path)
+        for _, count, message in entries:
+            estimate.add(count, message)
+        if shards > 1: # Compact packing needs a single history
+            print(f"Push estimate: {estimate.commits} objects, ~{format_bytes(estimate.plain_bytes)}.", flush=True)
         else:
-             # Width is determined by the length of the first row string
-             char_width = len(pattern[0])
+            print(f"Push estimate: {estimate.describe(compact)}.", flush=True)
+        plan = iter(entries)
+
+    print(f"Processing {kind}: '{name}'", flush=True)
+    with METRICS.phase('commit'):
+        if shards > 1:
+            total_commits_made = run_sharded(plan, repo_path, year, shards, shard_layout, backend, verbose=verbose, seed=seed)
+        else:
+            writer = open_commit_writer(backend, repo_path, verbose=verbose, seed=seed, compact=compact)
+            if cache and seed is not None:
+                total_commits_made = execute_cached(plan, writer, cache, seed, expected_dots=expected_dots, verbose=verbose)
+            else:
+                # Only the slow 'commit' backend keeps its finished dots across an interruption
+                checkpoint = PaintCheckpoint(writer) if isinstance(writer, CommitCommandWriter) else None
+                total_commits_made = execute_plan(plan, writer, expected_dots=expected_dots, verbose=verbose, checkpoint=checkpoint)
+    if compact and total_commits_made and shards == 1:
+        with METRICS.phase('compact'):
+            try:
+                objects, before, after = compact_history(repo_path, writer.transaction.base, writer.transaction.published_tip, verbose)
+                print(f"Compacted {objects} objects into one pack: {format_bytes(before)} -> {format_bytes(after)} to push "
+                      f"({100 - 100 * after // max(before, 1)}% smaller).", flush=True)
+            except (OSError, ContributionArtError) as e:
+                print(f"Warning: Could not compact the painted history (it was published as written): {e}", flush=True)
 
-        if verbose:
-             print(f"\nProcessing char '{char}' (Index: {char_index}, Width: {char_width}), Target start column: {current_col}", flush=True)
-
-        # Check if the character would start beyond the graph's width
-        if current_col >= max_cols:
-            print(f"]\nWarning: Starting column {current_col} for char '{char}' is at or beyond the maximum {max_cols} columns. Stopping.", flush=True)
-            break # Stop processing further characters
-
-        char_commits = 0
-        # Iterate through each row of the character pattern (0 to CHAR_HEIGHT-1)
-        for pattern_row_index in range(CHAR_HEIGHT):
-            # Check if the pattern definition has this many rows
-            if pattern_row_index >= len(pattern): continue
-
-            pattern_row_str = pattern[pattern_row_index]
-            # Iterate through each column within the character's pattern row
-            for pattern_col_offset in range(char_width):
-                 # Check if the pattern string is long enough for this column
-                if pattern_col_offset >= len(pattern_row_str): continue
-
-                # Check if this position in the pattern requires a commit ('X')
-                if pattern_row_str[pattern_col_offset] == 'X':
-                    # Calculate the target column (week) on the GitHub graph
-                    commit_col = current_col + pattern_col_offset
-                    # Ensure the commit column is within the graph bounds
-                    if commit_col >= max_cols:
-                         if verbose: print(f"  Skipping dot at pattern row {pattern_row_index}, col offset {pattern_col_offset} because target column {commit_col} >= {max_cols}")
-                         continue # Skip if this dot falls outside the graph weeks
-
-                    # Calculate the day of the week offset (1=Mon, 2=Tue, ..., 5=Fri)
-                    # This maps the pattern row index to the desired day on the graph
-                    day_of_week_offset = row_offset_start + pattern_row_index
-
-                    # Calculate the exact date for the commit
-                    commit_date = base_date + timedelta(weeks=commit_col, days=day_of_week_offset)
-
-                    # Crucially, only make commits for the target year
-                    if commit_date.year == year:
-                        if verbose: print(f"  Target commit date: {commit_date} (Week: {commit_col}, Day: {day_of_week_offset})")
-                        # Create the specified number of commits for this 'dot'
-                        if create_commit(repo_path, commit_date, commits_per_dot, message_suffix=f"char='{char}' pos={char_index}", verbose=verbose):
-                           char_commits += commits_per_dot
-                        else:
-                            # If create_commit failed, we might want to stop or log more seriously
-                            if verbose: print(f"  Failed making commits for {commit_date}")
-                            # Continue to the next dot for now
-                    elif verbose:
-                         print(f"  Skipping date {commit_date} because it's not in the target year {year}")
-
-        if verbose and char_commits > 0:
-            print(f"  Made {char_commits} commits for character '{char}'.", flush=True)
-        total_commits_made += char_commits
-
-        # Advance the current column position for the next character
-        # Includes the character width and the spacing between characters
-        current_col += char_width + spacing
-
-        # Update progress bar
-        processed_chars += 1
-        progress_ticks = int(progress_bar_width * processed_chars / total_chars)
-        ticks_to_print = progress_ticks - last_progress_ticks
-        if ticks_to_print > 0:
-            print("=" * ticks_to_print, end="", flush=True)
-            last_progress_ticks = progress_ticks
-
-
-    print("]", flush=True) # End progress indicator
     print(f"\n--- Generation Complete ---", flush=True)
-    print(f"Made approximately {total_commits_made} commits in total for '{text}' in year {year}.", flush=True)
+    print(f"Made approximately {total_commits_made} commits in total for '{name}' in {calendar.label}.", flush=True)
     return total_commits_made
 
 
+# --- Configuration ---
+# The interactive prompts, the command line, config files, batch manifests and the library API
+# all go through validate_field, so every entry point applies the same defaults and checks.
+
+CONFIG_FIELDS = ('repo_path', 'text', 'year', 'column', 'dots', 'spacing', 'backend', 'incremental', 'shading', 'baseline', 'verbose',
+                 'image', 'dither', 'invert', 'font', 'shards', 'shard_layout', 'marquee', 'align',
+                 'seed', 'cache', 'cache_dir', 'cache_size', 'compact')
+FLAG_FIELDS = ('incremental', 'shading', 'verbose', 'dither', 'invert', 'marquee', 'cache', 'compact')
+NUMBER_FIELD_NAMES = {'year': 'the year', 'column': 'the column', 'dots': 'dots', 'spacing': 'spacing', 'shards': 'shards',
+                      'seed': 'the seed', 'cache_size': 'the cache size'}
+
+def validate_field(field, value):
+    """
+    Parses and checks one configuration value (a raw string from a prompt or file, or an
+    already typed value). Empty values take the field's default.
+    Returns the normalized value; raises ValueError with a message for the user.
+    """
+    raw = value.strip() if isinstance(value, str) else value
+    if field == 'repo_path':
+        if not raw:
+            raise ValueError("Repository path cannot be empty.")
+        return str(raw)
+    if field == 'text':
+        if not str(value or '').strip():
+            raise ValueError("Text cannot be empty.")
+        return str(value) # Keep original spacing if intended
+    if field == 'backend':
+        backend = str(raw or 'commit').lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend must be one of: {', '.join(BACKENDS)}.")
+        return backend
+    if field == 'align':
+        align = str(raw or ALIGN_MODES[0]).lower()
+        if align not in ALIGN_MODES:
+            raise ValueError(f"Alignment must be one of: {', '.join(ALIGN_MODES)}.")
+        return align
+    if field == 'shard_layout':
+        layout = str(raw or SHARD_LAYOUTS[0]).lower()
+        if layout not in SHARD_LAYOUTS:
+            raise ValueError(f"Shard layout must be one of: {', '.join(SHARD_LAYOUTS)}.")
+        return layout
+    if field in ('baseline', 'image', 'font', 'cache_dir'):
+        return str(raw) if raw else None
+    if field in FLAG_FIELDS:
+        if isinstance(raw, bool):
+            return raw
+        answer = str(raw or 'n').lower()
+        if answer in ('y', 'yes', 'true', '1'):
+            return True
+        if answer in ('n', 'no', 'false', '0'):
+            return False
+        raise ValueError("Please enter 'y' or 'n'.")
+
+    # Numeric fields
+    if field == 'seed' and raw in (None, ''):
+        return None # Unseeded: random commit times
+    if field == 'cache_size' and raw in (None, ''):
+        return DEFAULT_CACHE_SIZE_MB
+    if raw in (None, ''):
+        return datetime.datetime.now().year if field == 'year' else 1
+    if field == 'year' and str(raw).lower() == ROLLING_WINDOW:
+        return ROLLING_WINDOW
+    try:
+        number = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid input. Please enter a number for {NUMBER_FIELD_NAMES[field]}.")
+    if field == 'year' and not 1970 < number < 2100: # Reasonable year range
+        raise ValueError("Please enter a valid year (e.g., between 1971 and 2099).")
+    if field == 'column' and not 0 <= number <= 52:
+        raise ValueError("Column must be between 0 and 52.")
+    if field == 'dots' and number < 1:
+        raise ValueError("Commits per dot must be at least 1.")
+    if field == 'spacing' and number < 0:
+        raise ValueError("Spacing cannot be negative.")
+    if field == 'shards' and number < 1:
+        raise ValueError("Shards must be at least 1.")
+    if field == 'seed' and number < 0:
+        raise ValueError("The seed cannot be negative.")
+    if field == 'cache_size' and number < 1:
+        raise ValueError("The cache size must be at least 1 MB.")
+    return number
+
+def validate_config(params):
+    """
+    Applies validate_field to every known field of a parameter dictionary.
+    Returns a new, normalized dictionary; raises ValueError describing the first invalid field.
+    With an 'image' the text is optional and defaults to the image's file name.
+    """
+    config = dict(params)
+    for field in CONFIG_FIELDS:
+        if field == 'text' and params.get('image') and not str(params.get('text') or '').strip():
+            config['text'] = os.path.basename(str(params['image']).strip()) # Only a label for messages
+            continue
+        config[field] = validate_field(field, params.get(field))
+    if config['marquee'] and config['shading']:
+        raise ValueError("Shading is not available in marquee mode.")
+    # Both need the whole plan in memory, which an endless marquee stream never fits in
+    if config['marquee'] and config['shards'] > 1:
+        raise ValueError("Sharding is not available in marquee mode.")
+    if config['marquee'] and config['cache']:
+        raise ValueError("The history cache is not available in marquee mode.")
+    if config['align'] != 'left' and (config['marquee'] or config['image']):
+        raise ValueError("Alignment only applies to text that stays on the graph (not to marquees or images).")
+    if config['cache'] and config['seed'] is None:
+        raise ValueError("The history cache needs a seed, so that repeat paints produce the same commits.")
+    if config['cache'] and config['shards'] > 1:
+        raise ValueError("The history cache is not available for sharded runs.")
+    if config['compact'] and config['shards'] > 1:
+        raise ValueError("Compact packing is not available for sharded runs.")
+    return config
+
+def load_config_file(config_path):
+    """
+    Reads painting parameters from a JSON object whose keys are the CONFIG_FIELDS
+    (e.g. {"repo_path": "art", "text": "HI", "year": 2024}). Values are validated later.
+    """
+    import json
+
+    with open(config_path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"'{config_path}' must contain a JSON object.")
+    unknown = sorted(set(data) - set(CONFIG_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown setting(s) in '{config_path}': {', '.join(unknown)}")
+    return data
+
+# --- Library API ---
+
+PaintResult = collections.namedtuple('PaintResult', 'ok repo_path text year commits seconds error')
+PaintResult.__doc__ = """Outcome of paint(): 'ok' is False (with 'error' set) if the run failed."""
+
+def paint(repo_path, text=None, year=None, column=1, dots=1, spacing=1, backend='commit', incremental=False,
+          shading=False, baseline=None, verbose=False, image=None, dither=False, invert=False, font=None, shards=1,
+          shard_layout='branches', marquee=False, align='left', seed=None, cache=False, cache_dir=None, cache_size=None,
+          compact=False, dry_run=False, preview=False, verify=False, svg_path=None):
+    """
+    Validates the parameters, prepares the repository and paints the text, without prompting.
+    With 'image' (a PBM/PGM/PPM file) the image is painted instead of the text. 'font' is an
+    optional BDF/PSF font file for the text. 'shards' > 1 paints in parallel (see run_sharded).
+    With 'marquee' long text keeps flowing into the following years. 'align' fits or centers
+    the text (see fit_text); the text is measured, and truncation reported, before the repository is touched.
+    A 'seed' makes the commits reproducible; with 'cache' they are also kept in (and reused from) a
+    HistoryCache in 'cache_dir' of at most 'cache_size' MB. 'compact' trades the per-dot commit messages
+    for a much smaller push (see compact_history).
+    Never exits the process: problems are reported in the returned PaintResult.
+    With 'dry_run' the plan is only printed and 'commits' is the number that would be made.
+    'preview' draws the planned graph in the terminal and 'svg_path' also writes it as SVG, without
+    touching the repository. 'verify' compares the plan with the repository's graph and fails on differences.
+    """
+    start_time = time.perf_counter()
+    try:
+        config = validate_config({
+            'repo_path': repo_path, 'text': text, 'year': year, 'column': column, 'dots': dots,
+            'spacing': spacing, 'backend': backend, 'incremental': incremental, 'shading': shading,
+            'baseline': baseline, 'verbose': verbose, 'image': image, 'dither': dither, 'invert': invert, 'font': font,
+            'shards': shards, 'shard_layout': shard_layout, 'marquee': marquee, 'align': align,
+            'seed': seed, 'cache': cache, 'cache_dir': cache_dir, 'cache_size': cache_size, 'compact': compact,
+        })
+        if not config['image'] and not config['marquee']:
+            config['column'], config['spacing'] = layout_text(
+                config['text'], config['column'], config['spacing'], config['align'], config['font']
+            )
+        preview_options = PreviewOptions(verify, svg_path) if preview or verify or svg_path else None
+        history_cache = None
+        if config['cache']:
+            history_cache = HistoryCache(config['cache_dir'] or get_default_cache_dir(), config['cache_size'] << 20)
+        # Concurrent runs on the same repository wait for each other (see RepoLock)
+        writes = not dry_run and not preview_options
+        with RepoLock(config['repo_path']) if writes else contextlib.nullcontext():
+            if writes:
+                initialize_repo(config['repo_path'], config['year'], config['verbose'], config['backend'])
+            if config['image']:
+                commits = paint_image(
+                    config['repo_path'], config['image'], config['year'], config['column'], config['dots'], config['dither'],
+                    config['invert'], config['verbose'], config['backend'], dry_run=dry_run, incremental=config['incremental'],
+                    shading=config['shading'], baseline_path=config['baseline'], shards=config['shards'], shard_layout=config['shard_layout'],
+                    preview=preview_options, seed=config['seed'], cache=history_cache, compact=config['compact']
+                )
+            else:
+                commits = paint_text(
+                    config['repo_path'], config['text'], config['year'], config['column'], config['dots'], config['spacing'],
+                    config['verbose'], config['backend'], dry_run=dry_run, incremental=config['incremental'],
+                    shading=config['shading'], baseline_path=config['baseline'], font_path=config['font'],
+                    shards=config['shards'], shard_layout=config['shard_layout'], marquee=config['marquee'],
+                    preview=preview_options, seed=config['seed'], cache=history_cache, compact=config['compact']
+                )
+    except (ContributionArtError, ValueError, OSError) as e:
+        return PaintResult(False, repo_path, text, year, 0, time.perf_counter() - start_time, str(e))
+    return PaintResult(True, config['repo_path'], config['text'], config['year'], commits, time.perf_counter() - start_time, None)
+
+# --- Batch Mode ---
+# A manifest lists many (repo_path, text, year, column, dots, spacing) jobs. Jobs are grouped by
+# repository so each worker process owns its repositories exclusively, and the groups run in
+# parallel on a process pool.
+
+BATCH_FIELDS = ('repo_path', 'text', 'year', 'column', 'dots', 'spacing')
+
+def load_manifest(manifest_path, defaults=None):
+    """
+    Reads batch jobs from a JSON file (a list of objects, or {"jobs": [...]}) or a CSV file
+    with a header row. 'defaults' fills the fields a job leaves out or empty.
+    Every job is validated; raises ValueError naming the bad entry.
+    """
+    import json
+
+    with open(manifest_path, newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            import csv
+            raw_jobs = list(csv.DictReader(f))
+        else:
+            raw_jobs = json.load(f)
+            if isinstance(raw_jobs, dict):
+                raw_jobs = raw_jobs.get('jobs', [])
+
+    jobs = []
+    for job_index, raw_job in enumerate(raw_jobs, start=1):
+        try:
+            given = {field: value for field, value in raw_job.items() if value not in (None, '')}
+            jobs.append(validate_config({**(defaults or {}), **given}))
+        except ValueError as e:
+            raise ValueError(f"Job {job_index} in '{manifest_path}': {e}")
+    return jobs
+
+def run_repo_jobs(jobs, metrics_json=None):
+    """
+    Runs every job of one repository in order, inside a worker process.
+    Output is captured instead of interleaving with other workers. Metrics events are
+    appended to 'metrics_json' as each job finishes.
+    Returns one result dictionary per job and the worker's metrics (see Metrics.export).
+    """
+    import io
+
+    configure_metrics(progress=False, json_path=metrics_json)
+    results = []
+    for job in jobs:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            paint_result = paint(**{field: job[field] for field in CONFIG_FIELDS})
+        results.append(make_batch_result(job, paint_result, output.getvalue()))
+        METRICS.flush()
+    return results, METRICS.export()
+
+def make_batch_result(job, paint_result, output=""):
+    """The result dictionary of one job; failures carry the error and the last lines of 'output'."""
+    result = {field: job[field] for field in BATCH_FIELDS}
+    result.update(ok=paint_result.ok, commits=paint_result.commits, seconds=paint_result.seconds)
+    if not paint_result.ok:
+        last_lines = [line for line in output.splitlines() if line.strip('- ')][-3:]
+        result['error'] = paint_result.error + "".join(f"\n    {line}" for line in last_lines)
+    return result
+
+def group_jobs_by_repo(jobs):
+    """Jobs for the same repository must run one after another, in manifest order."""
+    jobs_by_repo = {}
+    for job in jobs:
+        jobs_by_repo.setdefault(os.path.abspath(job['repo_path']), []).append(job)
+    return jobs_by_repo
+
+def print_batch_result(result):
+    if result['ok']:
+        rate = result['commits'] / result['seconds'] if result['seconds'] else 0
+        print(f"  OK    {result['repo_path']} '{result['text']}' ({result['year']}): "
+              f"{result['commits']} commits in {result['seconds']:.2f}s ({rate:.0f} commits/s)", flush=True)
+    else:
+        print(f"  FAIL  {result['repo_path']} '{result['text']}' ({result['year']}): {result['error']}", flush=True)
+
+def print_batch_summary(results, wall_time):
+    total_commits = sum(result['commits'] for result in results)
+    failures = sum(1 for result in results if not result['ok'])
+    print(f"\n--- Batch Complete ---", flush=True)
+    print(f"Jobs:       {len(results) - failures} succeeded, {failures} failed")
+    print(f"Commits:    {total_commits}")
+    print(f"Wall time:  {wall_time:.2f}s ({total_commits / wall_time if wall_time else 0:.0f} commits/s overall)")
+    print("----------------------", flush=True)
+
+def run_batch(jobs, workers=None, metrics_json=None):
+    """
+    Paints all jobs on a pool of worker processes, one task per repository. The workers'
+    metrics are merged into METRICS, and their events appended to 'metrics_json'.
+    Prints one line per finished job and a summary. Returns the list of result dictionaries.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    jobs_by_repo = group_jobs_by_repo(jobs) # Each repository's jobs run in one worker
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs_by_repo)))
+
+    print(f"\n--- Batch Run ---", flush=True)
+    print(f"{len(jobs)} jobs across {len(jobs_by_repo)} repositories on {workers} worker processes.", flush=True)
+    start_time = time.perf_counter()
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_repo_jobs, repo_jobs, metrics_json) for repo_jobs in jobs_by_repo.values()]
+        for future in as_completed(futures):
+            repo_results, worker_metrics = future.result()
+            METRICS.merge(worker_metrics)
+            for result in repo_results:
+                results.append(result)
+                print_batch_result(result)
+
+    print_batch_summary(results, time.perf_counter() - start_time)
+    return results
+
+# --- Async Batch Mode ---
+# With --async the whole batch runs in one process: every repository is an asyncio task, and
+# all git work (initialization, history reads and the commit stream) goes through one
+# AsyncGitRunner, so the git processes of different repositories overlap up to its limit.
+# Commits are always written with a single 'git fast-import' stream per job.
+
+async def initialize_repo_async(runner, repo_path, year):
+    """The git path of initialize_repo, run through 'runner' (without progress messages)."""
+    with METRICS.phase('init'): # Timed like initialize_repo
+        if os.path.exists(repo_path) and not os.path.isdir(repo_path):
+            raise ContributionArtError(f"The specified path '{repo_path}' exists but is not a directory.")
+        os.makedirs(repo_path, exist_ok=True)
+        if not os.path.isdir(os.path.join(repo_path, ".git")):
+            await runner.run(['git', 'init'], repo_path, fatal=True)
+        if await runner.query(['git', 'rev-parse', '--verify', '-q', 'HEAD'], repo_path) is not None:
+            return
+        readme_text, initial_date_str, initial_message = get_initial_commit(year)
+        with open(os.path.join(repo_path, "README.md"), "w") as f:
+            f.write(readme_text)
+        await runner.run(['git', 'add', 'README.md'], repo_path, fatal=True)
+        env = os.environ.copy()
+        env['GIT_AUTHOR_DATE'] = initial_date_str
+        env['GIT_COMMITTER_DATE'] = initial_date_str
+        await runner.run(['git', 'commit', '-m', initial_message], repo_path, env=env, fatal=True)
+
+async def write_plan_async(runner, repo_path, plan, seed=None):
+    """
+    Streams the plan into one 'git fast-import' process on a scratch ref and publishes it with
+    the same compare-and-swap as PaintTransaction. Returns the number of commits written.
+    """
+    branch_ref = await runner.query(['git', 'symbolic-ref', '-q', 'HEAD'], repo_path)
+    if not branch_ref:
+        raise ContributionArtError(f"HEAD is detached in '{repo_path}'. Check out a branch before painting.")
+    old_tip = await runner.query(['git', 'rev-parse', '--verify', '-q', branch_ref], repo_path)
+    idents = []
+    for kind in ('AUTHOR', 'COMMITTER'):
+        ident = await runner.query(['git', 'var', f'GIT_{kind}_IDENT'], repo_path)
+        if not ident:
+            raise ContributionArtError(f"Could not determine the Git {kind.lower()} identity. Set user.name and user.email.")
+        idents.append(ident.rsplit(' ', 2)[0])
+    scratch_ref = f"{SCRATCH_REF_PREFIX}paint-{os.getpid()}-{time.time_ns():x}"
+    commits_written = 0
+    dots = []
+
+    def iter_stream():
+        nonlocal commits_written
+        for commit_date, commits_per_dot, message_suffix in plan:
+            dots.append((commit_date, commits_per_dot))
+            for i, date_str in enumerate(make_commit_times(commit_date, commits_per_dot, seed)):
+                parent = old_tip if commits_written == 0 else None
+                yield format_fast_import_commit(scratch_ref, idents[0], idents[1], date_str,
+                                                format_commit_message(message_suffix, i + 1, commits_per_dot), parent)
+                commits_written += 1
+
+    try:
+        if await runner.run(['git', 'fast-import', '--quiet', '--date-format=raw'], repo_path, input_chunks=iter_stream()) is None:
+            dots.extend((commit_date, count) for commit_date, count, _ in plan)
+            raise UnwrittenDotsError("git fast-import failed", len(dots), sum(count for _, count in dots),
+                                     dots[0][0] if dots else None, dots[-1][0] if dots else None)
+        if not commits_written:
+            return 0
+        tip = await runner.query(['git', 'rev-parse', '--verify', '-q', scratch_ref], repo_path)
+        await runner.run(['git', 'update-ref', '-m', 'contribution art', branch_ref, tip, old_tip or NULL_SHA], repo_path, fatal=True)
+    finally:
+        await runner.query(['git', 'update-ref', '-d', scratch_ref], repo_path)
+    METRICS.count('commits_written', commits_written)
+    return commits_written
+
+async def paint_job_async(runner, job):
+    """Paints one validated batch job through 'runner'. Returns a PaintResult, like paint()."""
+    import io
+
+    start_time = time.perf_counter()
+    repo_path = os.path.abspath(job['repo_path'])
+    lock = RepoLock(repo_path)
+    try:
+        if job['shards'] > 1 or job['cache'] or job['compact']:
+            raise ContributionArtError("Shards, the history cache and compact packing are not available in async batch mode.")
+        if job['backend'] != 'fast-import':
+            raise ContributionArtError(f"The {job['backend']} backend is not available in async batch mode; "
+                                       f"every job is streamed through git fast-import.")
+        # Serializes with other processes painting this repository (jobs of this batch already run in order)
+        await lock.acquire_async()
+        await initialize_repo_async(runner, repo_path, job['year'])
+        shading_baseline = None
+        if job['shading']:
+            shading_baseline = load_baseline(job['baseline']) if job['baseline'] else await runner.commit_counts(repo_path)
+        # Planning never awaits, so its messages can be captured without mixing in other jobs
+        with contextlib.redirect_stdout(io.StringIO()):
+            if job['image']:
+                plan, _ = plan_image(job['image'], job['year'], job['column'], job['dots'], job['dither'], job['invert'],
+                                     shading_baseline=shading_baseline)
+            elif job['marquee']:
+                plan, _ = plan_marquee(job['text'], job['year'], job['column'], job['dots'], job['spacing'], font_path=job['font'])
+            else:
+                column, spacing = layout_text(job['text'], job['column'], job['spacing'], job['align'], job['font'])
+                plan, _ = plan_text(job['text'], job['year'], column, job['dots'], spacing,
+                                    shading_baseline=shading_baseline, font_path=job['font'])
+        if job['incremental'] and not job['shading']:
+            plan = diff_plan(plan, await runner.commit_counts(repo_path))
+        commits = await write_plan_async(runner, repo_path, plan, job['seed']) # 0 if nothing was missing, as in paint_plan
+    except (ContributionArtError, ValueError, OSError) as e:
+        return PaintResult(False, repo_path, job['text'], job['year'], 0, time.perf_counter() - start_time, str(e))
+    finally:
+        lock.release()
+    return PaintResult(True, repo_path, job['text'], job['year'], commits, time.perf_counter() - start_time, None)
+
+def run_batch_async(jobs, concurrency=None):
+    """
+    Like run_batch, but in this process: one asyncio task per repository (its jobs in manifest
+    order), with at most 'concurrency' git processes at a time. Returns the result dictionaries.
+    """
+    import asyncio
+
+    jobs_by_repo = group_jobs_by_repo(jobs)
+    runner = AsyncGitRunner(concurrency)
+    print(f"\n--- Batch Run (async) ---", flush=True)
+    print(f"{len(jobs)} jobs across {len(jobs_by_repo)} repositories, up to {runner.concurrency} git processes at a time.", flush=True)
+    start_time = time.perf_counter()
+    results = []
+
+    async def run_repo(repo_jobs):
+        for job in repo_jobs:
+            result = make_batch_result(job, await paint_job_async(runner, job))
+            results.append(result)
+            print_batch_result(result)
+
+    async def run_all():
+        await asyncio.gather(*(run_repo(repo_jobs) for repo_jobs in jobs_by_repo.values()))
+
+    asyncio.run(run_all())
+    print_batch_summary(results, time.perf_counter() - start_time)
+    return results
+
+
+
 def print_final_instructions(repo_path):
     """Prints instructions for the user on how to push the changes to GitHub."""
     print("\n--- Next Steps ---")
@@ -421,100 +4223,35 @@ def get_user_input():
     print("--- GitHub Contribution Art Configuration ---")
     params = {}
     current_year = datetime.datetime.now().year
+    prompts = [
+        ('repo_path', "Enter the full path to your local Git repository directory: "),
+        ('text', "Enter the text to paint on the graph (e.g., 'HELLO WORLD'): "),
+        ('year', f"Enter the target year, or '{ROLLING_WINDOW}' for the profile's last-year view [{current_year}]: "),
+        ('column', "Enter the starting week column (0-52, 0=first week) [1]: "),
+        ('dots', "Enter the number of commits per 'dot' (for intensity) [1]: "),
+        ('spacing', "Enter the space between characters (in columns) [1]: "),
+        ('align', f"Align the text ({'/'.join(ALIGN_MODES)}; fit and center adjust column and spacing) [left]: "),
+        ('backend', f"Choose the commit backend ({'/'.join(BACKENDS)}) [commit]: "),
+        ('incremental', "Only add commits missing from the existing history? (y/n) [n]: "),
+        ('shading', "Use the fewest commits that still show the text at full shade? (y/n) [n]: "),
+        ('baseline', "Optional file with your existing per-day contributions (JSON/CSV) [use repository history]: "),
+        ('compact', "Pack the commits compactly for a faster push (one short message for all)? (y/n) [n]: "),
+        ('verbose', "Enable detailed verbose output? (y/n) [n]: "),
+    ]
 
-    # 1. Repository Path
-    while True:
-        repo_path = input("Enter the full path to your local Git repository directory: ")
-        if repo_path.strip():
-            params['repo_path'] = repo_path.strip()
-            break
-        else:
-            print("Repository path cannot be empty.")
-
-    # 2. Text to Paint
-    while True:
-        text = input("Enter the text to paint on the graph (e.g., 'HELLO WORLD'): ")
-        if text.strip():
-            params['text'] = text # Keep original spacing if intended
-            break
-        else:
-            print("Text cannot be empty.")
-
-    # 3. Year
-    while True:
-        year_str = input(f"Enter the target year [{current_year}]: ")
-        if not year_str:
-            params['year'] = current_year
-            break
-        try:
-            year = int(year_str)
-            if year > 1970 and year < 2100: # Reasonable year range
-                 params['year'] = year
-                 break
-            else:
-                 print("Please enter a valid year (e.g., between 1971 and 2099).")
-        except ValueError:
-            print("Invalid input. Please enter a number for the year.")
-
-    # 4. Starting Column
-    while True:
-        col_str = input("Enter the starting week column (0-52, 0=first week) [1]: ")
-        if not col_str:
-            params['column'] = 1
-            break
-        try:
-            column = int(col_str)
-            if 0 <= column <= 52:
-                params['column'] = column
-                break
-            else:
-                print("Column must be between 0 and 52.")
-        except ValueError:
-            print("Invalid input. Please enter a number for the column.")
-
-    # 5. Commits per Dot
-    while True:
-        dots_str = input("Enter the number of commits per 'dot' (for intensity) [1]: ")
-        if not dots_str:
-            params['dots'] = 1
-            break
-        try:
-            dots = int(dots_str)
-            if dots >= 1:
-                params['dots'] = dots
-                break
-            else:
-                print("Commits per dot must be at least 1.")
-        except ValueError:
-            print("Invalid input. Please enter a number for dots.")
-
-    # 6. Spacing
-    while True:
-        spacing_str = input("Enter the space between characters (in columns) [1]: ")
-        if not spacing_str:
-            params['spacing'] = 1
-            break
-        try:
-            spacing = int(spacing_str)
-            if spacing >= 0:
-                params['spacing'] = spacing
+    for field, prompt in prompts:
+        if field == 'baseline' and not params['shading']:
+            params['baseline'] = None # Only used for shading
+            continue
+        # Ask again until the answer passes the same checks as every other entry point
+        while True:
+            try:
+                params[field] = validate_field(field, input(prompt))
                 break
-            else:
-                print("Spacing cannot be negative.")
-        except ValueError:
-            print("Invalid input. Please enter a number for spacing.")
+            except ValueError as e:
+                print(e)
 
-    # 7. Verbose Output
-    while True:
-        verbose_str = input("Enable detailed verbose output? (y/n) [n]: ").lower()
-        if not verbose_str or verbose_str == 'n':
-            params['verbose'] = False
-            break
-        elif verbose_str == 'y':
-            params['verbose'] = True
-            break
-        else:
-            print("Please enter 'y' or 'n'.")
+    params = validate_config(params) # Fills in the settings that have no prompt
 
     # --- Confirmation ---
     print("\n--- Summary ---")
@@ -524,6 +4261,11 @@ def get_user_input():
     print(f"Start Col:  {params['column']}")
     print(f"Dots:       {params['dots']}")
     print(f"Spacing:    {params['spacing']}")
+    print(f"Align:      {params['align']}")
+    print(f"Backend:    {params['backend']}")
+    print(f"Top-up:     {params['incremental']}")
+    print(f"Shading:    {params['shading']}" + (f" (baseline: {params['baseline']})" if params['baseline'] else ""))
+    print(f"Compact:    {params['compact']}")
     print(f"Verbose:    {params['verbose']}")
     print("---------------")
 
@@ -538,31 +4280,119 @@ def get_user_input():
             print("Please enter 'y' or 'n'.")
 
 
-# --- Main Execution ---
-if __name__ == "__main__":
-    print("Starting GitHub Contribution Art Script (TUI Mode)...", flush=True)
+# --- Command Line ---
 
-    # Get configuration from user via interactive prompts
-    config = get_user_input()
+def build_arg_parser():
+    """Command line flags. Without --repo/--text/--image/--config/--batch the interactive prompts are used."""
+    import argparse
 
-    if config:
-        # If user confirmed, proceed with the operations
+    parser = argparse.ArgumentParser(
+        description="Paint text onto your GitHub contribution graph by generating dated commits.",
+        epilog="Run without arguments for the interactive prompts."
+    )
+    painting = parser.add_argument_group("painting (non-interactive)")
+    painting.add_argument('--config', metavar='FILE', help="JSON file with any of the settings below; flags override it")
+    painting.add_argument('--repo', dest='repo_path', metavar='PATH', help="Local repository to paint (created if missing)")
+    painting.add_argument('--text', help="Text to paint")
+    painting.add_argument('--year', help=f"Target year, or '{ROLLING_WINDOW}' for the profile's last-year view (default: current year)")
+    painting.add_argument('--column', help="Starting week column, 0-52 (default: 1)")
+    painting.add_argument('--dots', help="Commits per dot (default: 1)")
+    painting.add_argument('--spacing', help="Columns between characters (default: 1)")
+    painting.add_argument('--backend', help=f"Commit backend: {', '.join(BACKENDS)} (default: commit)")
+    painting.add_argument('--incremental', action='store_const', const=True, help="Only add commits missing from the existing history")
+    painting.add_argument('--shading', action='store_const', const=True, help="Use the fewest commits that show the text at full shade")
+    painting.add_argument('--baseline', metavar='FILE', help="JSON/CSV per-day contribution counts used for shading")
+    painting.add_argument('--verbose', action='store_const', const=True, help="Print detailed progress")
+    painting.add_argument('--align', help=f"Text alignment: {', '.join(ALIGN_MODES)} (default: left); fit and center adjust column and spacing")
+    painting.add_argument('--marquee', action='store_const', const=True, help="Let long text flow on past the graph's edge into the following years")
+    painting.add_argument('--font', metavar='FILE', help="BDF or PSF bitmap font (up to 7 rows) to draw the text with")
+    painting.add_argument('--image', metavar='FILE', help="Paint a PBM/PGM/PPM image instead of text (7 rows high, from --column on)")
+    painting.add_argument('--dither', action='store_const', const=True, help="Dither the image's shades instead of rounding them")
+    painting.add_argument('--invert', action='store_const', const=True, help="Treat light image pixels as dark cells (for light-on-dark art)")
+    painting.add_argument('--shards', help="Paint with this many parallel workers, each on its own history (default: 1)")
+    painting.add_argument('--shard-layout', help="Where shards go: 'branches' (merged into the branch) or 'repos' (<repo>-shard-N)")
+    painting.add_argument('--compact', action='store_const', const=True, help="Give every commit one short message and repack them as deltas, for a much smaller push")
+    painting.add_argument('--dry-run', action='store_true', help="Print the plan and an estimate without touching the repository")
+
+    preview = parser.add_argument_group("preview")
+    preview.add_argument('--preview', action='store_true', help="Draw the planned graph in the terminal without touching the repository")
+    preview.add_argument('--svg', dest='svg_path', metavar='FILE', help="Also write the preview (or verification) as an SVG image")
+    preview.add_argument('--verify', action='store_true', help="Compare the repository's graph with the plan; exit code 1 if they differ")
+
+    reproducible = parser.add_argument_group("reproducible runs")
+    reproducible.add_argument('--seed', help="Seed the commit times, so the same settings always produce the same commits")
+    reproducible.add_argument('--cache', action='store_const', const=True, help="Reuse seeded histories from an on-disk cache (needs --seed)")
+    reproducible.add_argument('--cache-dir', metavar='DIR', help="Cache directory (default: ~/.cache/contribution-art)")
+    reproducible.add_argument('--cache-size', metavar='MB', help=f"Evict the least recently used histories beyond this size (default: {DEFAULT_CACHE_SIZE_MB})")
+
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument('--batch', metavar='MANIFEST', help="Paint every job of a JSON/CSV manifest")
+    batch.add_argument('--workers', type=int, help="Worker processes for --batch, or git processes at a time with --async (default: CPU count)")
+    batch.add_argument('--async', dest='use_async', action='store_true', help="Run the batch in one process with asyncio, overlapping the git work of all repositories")
+
+    metrics = parser.add_argument_group("metrics")
+    metrics.add_argument('--summary', action='store_true', help="Print a metrics table at the end of the run")
+    metrics.add_argument('--metrics-json', metavar='FILE', help="Append every metrics event to FILE as JSON lines")
+    metrics.add_argument('--profile', metavar='FILE', help="Run under cProfile and dump the stats to FILE")
+    return parser
+
+def main(argv=None):
+    """Entry point of the script. Returns the process exit code."""
+    args = build_arg_parser().parse_args(argv)
+    configure_metrics(json_path=args.metrics_json, summary=args.summary)
+
+    if args.batch:
         try:
-            initialize_repo(config['repo_path'], config['year'], config['verbose'])
-            paint_text(config['repo_path'], config['text'], config['year'], config['column'], config['dots'], config['spacing'], config['verbose'])
-            print_final_instructions(config['repo_path'])
-        except Exception as e:
-            print(f"\n--- An Unexpected Error Occurred ---", flush=True)
-            print(f"Error: {e}")
-            import traceback
-            print("\n--- Traceback ---")
-            traceback.print_exc()
-            print("-----------------", flush=True)
-            print("Script execution failed.", flush=True)
-            exit(1)
+            # Async jobs are always written with git fast-import
+            batch_jobs = load_manifest(args.batch, {'backend': 'fast-import'} if args.use_async else None)
+        except (ValueError, OSError) as e:
+            print(f"Error: Could not load the batch manifest: {e}", flush=True)
+            return 1
+        if args.use_async:
+            batch_results = run_batch_async(batch_jobs, concurrency=args.workers)
+        else:
+            METRICS.flush() # The workers append to the same file
+            batch_results = run_batch(batch_jobs, workers=args.workers, metrics_json=args.metrics_json)
+        METRICS.close()
+        return 0 if all(result['ok'] for result in batch_results) else 1
+
+    if args.config or args.repo_path or args.text or args.image:
+        # Headless: config file first, then any flags given on the command line
+        try:
+            settings = load_config_file(args.config) if args.config else {}
+            settings.update({field: getattr(args, field) for field in CONFIG_FIELDS if getattr(args, field) is not None})
+            config = validate_config(settings)
+        except (ValueError, OSError) as e:
+            print(f"Error: {e}", flush=True)
+            return 2
+    else:
+        print("Starting GitHub Contribution Art Script (TUI Mode)...", flush=True)
+        # Get configuration from user via interactive prompts
+        config = get_user_input()
+        if not config:
+            # User cancelled during configuration
+            print("Exiting script.", flush=True)
+            return 0
+
+    options = {'dry_run': args.dry_run, 'preview': args.preview, 'verify': args.verify, 'svg_path': args.svg_path}
+    options.update({field: config[field] for field in CONFIG_FIELDS})
+    if args.profile:
+        result = run_profiled(args.profile, paint, **options)
     else:
-        # User cancelled during configuration
-        print("Exiting script.", flush=True)
-        exit(0)
+        result = paint(**options)
+    METRICS.close()
 
-    print("\nScript finished.", flush=True)
\ No newline at end of file
+    if not result.ok:
+        print("\n--- Painting Failed ---", flush=True)
+        print(f"Error: {result.error}")
+        print("Script execution failed.", flush=True)
+        return 1
+    if not (args.dry_run or args.preview or args.verify or args.svg_path):
+        print_final_instructions(config['repo_path'])
+    print("\nScript finished.", flush=True)
+    return 0
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    sys.exit(main())